@@ -2,29 +2,150 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 import os
 from dotenv import load_dotenv
+from app.database import database_uri, engine_options, configure_sqlite
 
 load_dotenv()
 
 db = SQLAlchemy()
 
+def upgrade_schema():
+    """
+    Add columns and indexes that are missing from existing tables.
+    db.create_all only creates new tables, so databases created before a column
+    or index was added to a model would otherwise be missing it.
+    """
+    inspector = db.inspect(db.engine)
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            
+            existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing_columns:
+                    column_type = column.type.compile(dialect=db.engine.dialect)
+                    connection.execute(db.text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+            
+            for index in table.indexes:
+                index.create(bind=connection, checkfirst=True)
+
+def init_db():
+    """Create any missing tables and columns, and seed the defaults into an empty database"""
+    from app.services import init_services
+    db.create_all()
+    upgrade_schema()
+    return init_services()
+
 def create_app():
     app = Flask(__name__)
     
-    # Configure the SQLite database
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///medical_app.db'
+    # Configure the database: the local SQLite file unless DATABASE_URL is set (e.g. postgresql://...)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_uri(os.getenv('DATABASE_URL'))
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['DB_POOL_SIZE'] = int(os.getenv('DB_POOL_SIZE', 10))
+    app.config['DB_MAX_OVERFLOW'] = int(os.getenv('DB_MAX_OVERFLOW', 20))
+    app.config['DB_POOL_TIMEOUT'] = float(os.getenv('DB_POOL_TIMEOUT', 30))
+    app.config['DB_POOL_RECYCLE'] = int(os.getenv('DB_POOL_RECYCLE', 1800))
+    
+    # SQLite tuning: WAL journaling so readers and writers don't block each other, and how long a writer waits for the lock
+    app.config['SQLITE_WAL'] = os.getenv('SQLITE_WAL', 'true').lower() in ('1', 'true', 'yes')
+    app.config['SQLITE_BUSY_TIMEOUT_MS'] = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 15000))
+    app.config['SQLITE_CACHE_SIZE_KB'] = int(os.getenv('SQLITE_CACHE_SIZE_KB', 20000))
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
     app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev_key')
     
+    # Create, upgrade and seed the database whenever the app starts. Turn off where workers restart
+    # often (e.g. gunicorn) and run `flask init-db` once per deploy instead
+    app.config['DB_INIT_ON_STARTUP'] = os.getenv('DB_INIT_ON_STARTUP', 'true').lower() in ('1', 'true', 'yes')
+    
+    # Send the prompt to all active models at once instead of one after another
+    app.config['LLM_CONCURRENT_DISPATCH'] = os.getenv('LLM_CONCURRENT_DISPATCH', 'true').lower() in ('1', 'true', 'yes')
+    
+    # Abandon in-flight LLM calls when a newer request arrives from the same session
+    app.config['LLM_CANCEL_SUPERSEDED'] = os.getenv('LLM_CANCEL_SUPERSEDED', 'true').lower() in ('1', 'true', 'yes')
+    
+    # Run one update at a time per session, on the latest text, and combine updates that arrive meanwhile
+    app.config['LLM_COALESCE_UPDATES'] = os.getenv('LLM_COALESCE_UPDATES', 'true').lower() in ('1', 'true', 'yes')
+    
+    # LLM calls in flight at once per backend (for Ollama, per healthy node), and how many may queue (and for
+    # how many seconds) before new ones are turned away as busy; background work is turned away first
+    app.config['LLM_OLLAMA_CONCURRENCY'] = int(os.getenv('LLM_OLLAMA_CONCURRENCY', 4))
+    app.config['LLM_OPENAI_CONCURRENCY'] = int(os.getenv('LLM_OPENAI_CONCURRENCY', 8))
+    app.config['LLM_MAX_QUEUE_DEPTH'] = int(os.getenv('LLM_MAX_QUEUE_DEPTH', 32))
+    app.config['LLM_QUEUE_TIMEOUT'] = float(os.getenv('LLM_QUEUE_TIMEOUT', 60))
+    
+    # LLM backend connections: requests are balanced across the comma-separated Ollama URLs
+    app.config['OLLAMA_BASE_URLS'] = os.getenv('OLLAMA_BASE_URLS', 'http://localhost:11434').split(',')
+    app.config['OLLAMA_HEALTH_CHECK_INTERVAL'] = float(os.getenv('OLLAMA_HEALTH_CHECK_INTERVAL', 15))
+    
+    # Keep Ollama models loaded between requests, and load the active ones at startup
+    app.config['OLLAMA_KEEP_ALIVE'] = os.getenv('OLLAMA_KEEP_ALIVE', '30m')
+    app.config['OLLAMA_WARMUP_ON_STARTUP'] = os.getenv('OLLAMA_WARMUP_ON_STARTUP', 'true').lower() in ('1', 'true', 'yes')
+    app.config['LLM_CONNECT_TIMEOUT'] = float(os.getenv('LLM_CONNECT_TIMEOUT', 3.05))
+    app.config['LLM_READ_TIMEOUT'] = float(os.getenv('LLM_READ_TIMEOUT', 300))
+    app.config['LLM_MAX_RETRIES'] = int(os.getenv('LLM_MAX_RETRIES', 2))
+    app.config['LLM_RETRY_BACKOFF'] = float(os.getenv('LLM_RETRY_BACKOFF', 0.5))
+    
+    # Seconds before another worker's new investigations are picked up (this worker's are immediate)
+    app.config['INVESTIGATION_CACHE_TTL'] = float(os.getenv('INVESTIGATION_CACHE_TTL', 60))
+    
+    # Skip the models when the history changed by fewer than LLM_CHANGE_MIN_WORDS words since they last ran
+    # for the session (whitespace, punctuation and case never count, nor typo fixes with LLM_CHANGE_IGNORE_TYPOS).
+    # Typo fixes are off by default, as many clinical terms are one letter apart (dysphagia, dysphasia); with a
+    # word list in LLM_CHANGE_VOCABULARY, only fixes from a word not in it to a word in it count as typos
+    app.config['LLM_CHANGE_GATE'] = os.getenv('LLM_CHANGE_GATE', 'true').lower() in ('1', 'true', 'yes')
+    app.config['LLM_CHANGE_MIN_WORDS'] = int(os.getenv('LLM_CHANGE_MIN_WORDS', 1))
+    app.config['LLM_CHANGE_IGNORE_TYPOS'] = os.getenv('LLM_CHANGE_IGNORE_TYPOS', 'false').lower() in ('1', 'true', 'yes')
+    app.config['LLM_CHANGE_VOCABULARY'] = os.getenv('LLM_CHANGE_VOCABULARY') or None
+    
+    # Models in the "refine" tier run once a session's history has gone this long without an update,
+    # and their results are pushed to the browser
+    app.config['LLM_REFINE_SETTLE_MS'] = int(os.getenv('LLM_REFINE_SETTLE_MS', 2000))
+    
+    # Send Ollama only the newly appended history, reusing the session's context tokens
+    app.config['LLM_INCREMENTAL_PROMPTS'] = os.getenv('LLM_INCREMENTAL_PROMPTS', 'false').lower() in ('1', 'true', 'yes')
+    app.config['LLM_INCREMENTAL_MAX_TURNS'] = int(os.getenv('LLM_INCREMENTAL_MAX_TURNS', 8))
+    
+    # Cache model results by content hash: 'memory', 'sqlite' or 'none'
+    app.config['LLM_CACHE_BACKEND'] = os.getenv('LLM_CACHE_BACKEND', 'memory')
+    app.config['LLM_CACHE_MAX_ENTRIES'] = int(os.getenv('LLM_CACHE_MAX_ENTRIES', 512))
+    app.config['LLM_CACHE_TTL_SECONDS'] = int(os.getenv('LLM_CACHE_TTL_SECONDS', 3600))
+    
+    # Write query logs on a background thread in batched transactions
+    app.config['QUERY_LOG_ASYNC'] = os.getenv('QUERY_LOG_ASYNC', 'true').lower() in ('1', 'true', 'yes')
+    app.config['QUERY_LOG_BATCH_SIZE'] = int(os.getenv('QUERY_LOG_BATCH_SIZE', 50))
+    app.config['QUERY_LOG_FLUSH_INTERVAL_MS'] = int(os.getenv('QUERY_LOG_FLUSH_INTERVAL_MS', 200))
+    
+    # Query text and raw responses are stored once per distinct text, compressed: 'zlib', 'zstd' (needs zstandard) or 'none'
+    app.config['QUERY_LOG_COMPRESSION'] = os.getenv('QUERY_LOG_COMPRESSION', 'zlib')
+    
+    # `flask logs archive` moves logs older than this many days to gzipped files, one directory per day
+    app.config['QUERY_LOG_RETENTION_DAYS'] = int(os.getenv('QUERY_LOG_RETENTION_DAYS', 90))
+    app.config['QUERY_LOG_ARCHIVE_DIR'] = os.getenv('QUERY_LOG_ARCHIVE_DIR', os.path.join(app.instance_path, 'archive'))
+    
     db.init_app(app)
+    with app.app_context():
+        configure_sqlite(db.engine, app.config)
+    
+    from app.log_writer import init_query_log_writer
+    init_query_log_writer(app)
     
     from app.routes import main_bp
     app.register_blueprint(main_bp)
     
+    from app.commands import register_commands
+    register_commands(app)
+    
     with app.app_context():
-        db.create_all()
+        if app.config['DB_INIT_ON_STARTUP']:
+            init_db()
+        
+        from app.services import configure_clients, warm_models, load_active_model_configs
+        configure_clients(app.config)
         
-        # Import and initialize services
-        from app.services import init_services
-        init_services()
+        # Read-only, so booting a worker never writes to the database; on a database `flask init-db`
+        # hasn't created yet there is nothing to warm
+        if app.config['OLLAMA_WARMUP_ON_STARTUP']:
+            warm_models(load_active_model_configs())
     
     return app 
\ No newline at end of file
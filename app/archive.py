@@ -0,0 +1,264 @@
+from app import db
+from app.blob_store import load_texts
+from app.log_queries import QUERY_PREVIEW_LENGTH, encode_cursor, decode_cursor
+from app.models import QueryLog, TextBlob
+from datetime import datetime, timedelta
+from flask import current_app
+import gzip
+import json
+import os
+import re
+
+# Query log columns written to the archive, besides the texts kept in the blob store
+ARCHIVE_COLUMNS = (
+    "id", "timestamp", "model_type", "model_name", "recommended_questions", "recommended_investigations",
+    "problem_list", "processing_time_ms", "error", "cache_hit", "stage_timings", "prompt_eval_count", "eval_count",
+    "skip_reason"
+)
+
+# Archive layout: <archive dir>/date=YYYY-MM-DD/part-<first id>-<last id>.jsonl.gz
+PARTITION_NAME = re.compile(r"^date=(\d{4}-\d{2}-\d{2})$")
+PART_NAME = re.compile(r"^part-(\d+)-(\d+)\.jsonl\.gz$")
+
+DEFAULT_BATCH_SIZE = 500
+
+class ArchivedLog:
+    """A query log read back from the archive, with the same attributes as a QueryLog"""
+    def __init__(self, record):
+        self.__dict__.update(record)
+        self.timestamp = datetime.fromisoformat(record["timestamp"])
+        self.has_error = record.get("error") is not None
+        self.skipped = record.get("skip_reason") is not None
+        self.query_preview = (record.get("query_text") or "")[:QUERY_PREVIEW_LENGTH + 1]
+
+    def __repr__(self):
+        return f'<ArchivedLog {self.id} - {self.timestamp}>'
+
+def _day_begin(day):
+    return datetime.combine(day, datetime.min.time())
+
+def archive_dir():
+    return current_app.config['QUERY_LOG_ARCHIVE_DIR']
+
+def _partition_path(root, day):
+    return os.path.join(root, f"date={day.isoformat()}")
+
+def list_partitions(root=None):
+    """Dates that have archived logs, oldest first"""
+    root = root or archive_dir()
+    if not os.path.isdir(root):
+        return []
+    days = []
+    for name in os.listdir(root):
+        match = PARTITION_NAME.match(name)
+        if match:
+            days.append(datetime.strptime(match.group(1), "%Y-%m-%d").date())
+    return sorted(days)
+
+def _parts(root, day):
+    """A partition's part files as (first id, last id, path), in id order"""
+    path = _partition_path(root, day)
+    if not os.path.isdir(path):
+        return []
+    parts = []
+    for name in os.listdir(path):
+        match = PART_NAME.match(name)
+        if match:
+            parts.append((int(match.group(1)), int(match.group(2)), os.path.join(path, name)))
+    return sorted(parts)
+
+def iter_partition(day, root=None):
+    """Yield a day's archived logs as dicts in id order, reading one line at a time"""
+    for _, _, path in _parts(root or archive_dir(), day):
+        with gzip.open(path, "rt", encoding="utf-8") as part_file:
+            for line in part_file:
+                if line.strip():
+                    yield json.loads(line)
+
+def _matches(record, model_name, start, end, has_error):
+    if model_name and record["model_name"] != model_name:
+        return False
+    if has_error is not None and (record.get("error") is not None) != has_error:
+        return False
+    timestamp = record["timestamp"]
+    if start and timestamp < start.isoformat():
+        return False
+    if end and timestamp >= end.isoformat():
+        return False
+    return True
+
+def iter_archived_logs(model_name=None, start=None, end=None, has_error=None, after_id=None, root=None):
+    """
+    Yield archived logs as dicts, oldest partition first, optionally filtered like
+    the live log list. Partitions outside start/end aren't opened, and only one
+    line is held in memory at a time.
+    """
+    for day in list_partitions(root):
+        if start and day < start.date():
+            continue
+        if end and _day_begin(day) >= end:
+            break
+        for record in iter_partition(day, root):
+            if after_id is not None and record["id"] <= after_id:
+                continue
+            if _matches(record, model_name, start, end, has_error):
+                yield record
+
+def find_archived_log(log_id, day, root=None):
+    """An archived log by id, looked up in its day's partition; None if it isn't there"""
+    for first_id, last_id, path in _parts(root or archive_dir(), day):
+        if not first_id <= log_id <= last_id:
+            continue
+        with gzip.open(path, "rt", encoding="utf-8") as part_file:
+            for line in part_file:
+                if line.strip():
+                    record = json.loads(line)
+                    if record["id"] == log_id:
+                        return ArchivedLog(record)
+    return None
+
+def archived_log_summaries(model_name=None, start=None, end=None, has_error=None, cursor=None, limit=50, root=None):
+    """
+    One page of archived logs, newest first, with the same filters, cursor and
+    return value as log_queries.query_log_summaries. Partitions are read newest
+    first and reading stops once the page is full, so only the partitions a page
+    spans are opened.
+    """
+    before = decode_cursor(cursor) if cursor else None
+    rows = []
+    for day in reversed(list_partitions(root)):
+        if end and _day_begin(day) >= end:
+            continue
+        if start and day < start.date():
+            break
+        if before and day > before[0].date():
+            continue
+
+        # Rows are newest first across partitions; within one, sort just that day's matches
+        day_rows = []
+        for record in iter_partition(day, root):
+            if not _matches(record, model_name, start, end, has_error):
+                continue
+            # Keep just the start of the texts while the rest of the page is read
+            summary = {key: record.get(key) for key in ARCHIVE_COLUMNS}
+            summary["query_text"] = (record.get("query_text") or "")[:QUERY_PREVIEW_LENGTH + 1]
+            log = ArchivedLog(summary)
+            if before and (log.timestamp, log.id) >= before:
+                continue
+            day_rows.append(log)
+        day_rows.sort(key=lambda log: (log.timestamp, log.id), reverse=True)
+        rows.extend(day_rows)
+        if len(rows) > limit:
+            break
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].timestamp, rows[-1].id)
+    return rows, next_cursor
+
+def _archived_up_to(root, day):
+    """The highest log id already archived for a day, or 0"""
+    parts = _parts(root, day)
+    return parts[-1][1] if parts else 0
+
+def _day_logs(day, after_id, batch_size):
+    """The day's logs after after_id, batch_size at a time, with their texts read from the blob store"""
+    day_begin = _day_begin(day)
+    day_end = day_begin + timedelta(days=1)
+    while True:
+        rows = (
+            QueryLog.query
+            .filter(QueryLog.timestamp >= day_begin, QueryLog.timestamp < day_end, QueryLog.id > after_id)
+            .order_by(QueryLog.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            return
+        texts = load_texts([row.query_text_hash for row in rows] + [row.raw_response_hash for row in rows])
+        records = []
+        for row in rows:
+            record = {column: getattr(row, column) for column in ARCHIVE_COLUMNS}
+            record["timestamp"] = row.timestamp.isoformat()
+            record["query_text"] = texts.get(row.query_text_hash) if row.query_text_hash else row.stored_query_text
+            record["raw_response"] = texts.get(row.raw_response_hash) if row.raw_response_hash else row.stored_raw_response
+            records.append(record)
+        yield records
+        after_id = rows[-1].id
+        db.session.expunge_all()
+
+def _delete_day(day, up_to_id):
+    """Delete a day's logs up to up_to_id, and any blobs no other log uses. Returns the number of logs deleted."""
+    day_begin = _day_begin(day)
+    day_end = day_begin + timedelta(days=1)
+    in_day = db.and_(QueryLog.timestamp >= day_begin, QueryLog.timestamp < day_end, QueryLog.id <= up_to_id)
+
+    hashes = set()
+    for row in db.session.query(QueryLog.query_text_hash, QueryLog.raw_response_hash).filter(in_day):
+        hashes.update(digest for digest in row if digest)
+    deleted = db.session.query(QueryLog).filter(in_day).delete(synchronize_session=False)
+
+    hashes = list(hashes)
+    for index in range(0, len(hashes), DEFAULT_BATCH_SIZE):
+        chunk = hashes[index:index + DEFAULT_BATCH_SIZE]
+        still_used = {
+            row[0] for row in db.session.query(QueryLog.query_text_hash).filter(QueryLog.query_text_hash.in_(chunk))
+        } | {
+            row[0] for row in db.session.query(QueryLog.raw_response_hash).filter(QueryLog.raw_response_hash.in_(chunk))
+        }
+        unused = [digest for digest in chunk if digest not in still_used]
+        if unused:
+            db.session.query(TextBlob).filter(TextBlob.hash.in_(unused)).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+def archive_old_logs(retention_days, root=None, batch_size=DEFAULT_BATCH_SIZE, log=print):
+    """
+    Move logs from days before the last retention_days into the archive, one day
+    at a time: the day's logs are written to a new gzipped JSONL part file, which
+    is renamed into place once complete, and only then deleted from the database.
+
+    Part files are named by the id range they hold, so a run interrupted between
+    writing and deleting just deletes the already-archived logs next time instead
+    of archiving them twice. Returns the number of logs archived.
+    """
+    root = root or archive_dir()
+    cutoff = _day_begin(datetime.utcnow().date() - timedelta(days=retention_days))
+    archived = 0
+
+    while True:
+        oldest = db.session.query(db.func.min(QueryLog.timestamp)).filter(QueryLog.timestamp < cutoff).scalar()
+        if oldest is None:
+            return archived
+        day = oldest.date()
+
+        # Logs a previous, interrupted run already wrote out
+        done_up_to = _archived_up_to(root, day)
+        if done_up_to:
+            _delete_day(day, done_up_to)
+
+        partition = _partition_path(root, day)
+        os.makedirs(partition, exist_ok=True)
+        temp_path = os.path.join(partition, f".part-{os.getpid()}.tmp")
+        first_id = last_id = None
+        count = 0
+        with open(temp_path, "wb") as raw_file:
+            with gzip.GzipFile(fileobj=raw_file, mode="wb") as part_file:
+                for records in _day_logs(day, done_up_to, batch_size):
+                    for record in records:
+                        part_file.write((json.dumps(record) + "\n").encode("utf-8"))
+                    first_id = records[0]["id"] if first_id is None else first_id
+                    last_id = records[-1]["id"]
+                    count += len(records)
+            # On disk before the logs are deleted from the database
+            raw_file.flush()
+            os.fsync(raw_file.fileno())
+
+        if last_id is None:
+            os.remove(temp_path)
+            continue
+        os.replace(temp_path, os.path.join(partition, f"part-{first_id:010d}-{last_id:010d}.jsonl.gz"))
+        _delete_day(day, last_id)
+        archived += count
+        log(f"Archived {count} logs from {day.isoformat()}")
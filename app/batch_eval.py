@@ -0,0 +1,296 @@
+from app import db
+from app.archive import iter_archived_logs
+from app.blob_store import load_texts
+from app.models import QueryLog, ModelConfig, EvaluationRun, EvaluationResult
+from app.scheduler import SchedulerBusy, BACKGROUND
+from app.services import run_model, build_prompt, investigation_catalogue, _model_call_args
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import hashlib
+import threading
+import time
+import traceback
+
+DEFAULT_CHUNK_SIZE = 50
+
+# The scheduler is per process, so the web workers' queues can't see an evaluation's
+# calls; keep the load it adds to a shared backend low unless asked for more
+DEFAULT_WORKERS = 1
+DEFAULT_CALLS_PER_MINUTE = 30
+
+# Each update logs the same history once per model, one after another, so
+# duplicates are skipped by remembering this many recent histories
+DEDUP_WINDOW = 10000
+
+# How long to back off when the scheduler turns a call away
+BUSY_RETRY_SECONDS = 5
+BUSY_MAX_RETRIES = 12
+
+def _source_query(run):
+    """Query logs the run re-evaluates, before the checkpoint and chunking are applied"""
+    # Logs of updates the change gate skipped repeat an earlier history, give or take punctuation
+    query = (
+        db.session.query(QueryLog.id, QueryLog.stored_query_text, QueryLog.query_text_hash)
+        .filter(QueryLog.skip_reason.is_(None))
+    )
+    if run.source_model_name:
+        query = query.filter(QueryLog.model_name == run.source_model_name)
+    if run.source_start:
+        query = query.filter(QueryLog.timestamp >= run.source_start)
+    if run.source_end:
+        query = query.filter(QueryLog.timestamp < run.source_end)
+    return query
+
+def _remember(seen, text):
+    """Add a history to the dedup window; returns False if it was already there"""
+    digest = hashlib.sha256(text.encode("utf-8")).digest()
+    if digest in seen:
+        return False
+    seen[digest] = True
+    if len(seen) > DEDUP_WINDOW:
+        seen.popitem(last=False)
+    return True
+
+def _with_texts(rows):
+    """
+    (id, query_text) for each row, reading the texts of compacted logs from the
+    blob store. Logs whose text is missing from the blob store are left out.
+    """
+    texts = load_texts([row.query_text_hash for row in rows])
+    with_texts = [(row.id, texts.get(row.query_text_hash) if row.query_text_hash else row.stored_query_text) for row in rows]
+    return [(log_id, text) for log_id, text in with_texts if text is not None]
+
+def _archived_logs(run, after_id=None):
+    for record in iter_archived_logs(run.source_model_name, run.source_start, run.source_end, after_id=after_id):
+        if record.get("skip_reason") is None:
+            yield record
+
+def iter_query_log_chunks(run, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yield the run's remaining logs as lists of (id, query_text) pairs in id order,
+    chunk_size at a time, starting after the run's checkpoint. Only one chunk is
+    loaded at a time.
+
+    With include_archive, archived logs come first: they are older, so have lower
+    ids than any log still in the database.
+    """
+    source = _source_query(run)
+    after_id = run.last_query_log_id or 0
+
+    if run.include_archive:
+        chunk = []
+        for record in _archived_logs(run, after_id):
+            chunk.append((record["id"], record["query_text"]))
+            if len(chunk) == chunk_size:
+                yield chunk
+                after_id = chunk[-1][0]
+                chunk = []
+        if chunk:
+            yield chunk
+            after_id = chunk[-1][0]
+        # Moving on from the last archived id also skips logs an interrupted
+        # `flask logs archive` wrote out but didn't get to delete
+    while True:
+        rows = (
+            source
+            .filter(QueryLog.id > after_id)
+            .order_by(QueryLog.id)
+            .limit(chunk_size)
+            .all()
+        )
+        if not rows:
+            return
+        yield _with_texts(rows)
+        after_id = rows[-1].id
+
+def create_evaluation_run(model_config_ids, name=None, source_model_name=None, start=None, end=None, include_archive=False):
+    """Record a new evaluation run of the given models over the matching query logs"""
+    model_configs = ModelConfig.query.filter(ModelConfig.id.in_(model_config_ids)).all()
+    missing = set(model_config_ids) - {model_config.id for model_config in model_configs}
+    if missing:
+        raise ValueError(f"No model config with id {', '.join(str(id) for id in sorted(missing))}")
+
+    run = EvaluationRun(
+        name=name,
+        model_config_ids=",".join(str(id) for id in model_config_ids),
+        source_model_name=source_model_name,
+        source_start=start,
+        source_end=end,
+        include_archive=include_archive
+    )
+    run.total_cases = _source_query(run).count()
+    if include_archive:
+        run.total_cases += sum(1 for _ in _archived_logs(run))
+    db.session.add(run)
+    db.session.commit()
+    return run
+
+def run_model_config_ids(run):
+    return [int(id) for id in run.model_config_ids.split(",") if id]
+
+class CallRateLimiter:
+    """Starts calls at most calls_per_minute a minute, evenly spaced, across threads (0: no limit)"""
+    def __init__(self, calls_per_minute=DEFAULT_CALLS_PER_MINUTE):
+        self.interval = 60 / calls_per_minute if calls_per_minute else 0
+        self.lock = threading.Lock()
+        self.next_start = 0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.time()
+            start = max(now, self.next_start)
+            self.next_start = start + self.interval
+        time.sleep(start - now)
+
+def _evaluate(history_text, prompt, investigation_names, call_args, rate_limiter):
+    """Run one model on one history, waiting out a busy scheduler"""
+    for attempt in range(BUSY_MAX_RETRIES + 1):
+        rate_limiter.wait()
+        try:
+            return run_model(history_text, prompt, investigation_names, **call_args)
+        except SchedulerBusy:
+            if attempt == BUSY_MAX_RETRIES:
+                raise
+            time.sleep(BUSY_RETRY_SECONDS)
+
+def run_evaluation(run, workers=DEFAULT_WORKERS, chunk_size=DEFAULT_CHUNK_SIZE, limit=None, log=print,
+                   calls_per_minute=DEFAULT_CALLS_PER_MINUTE):
+    """
+    Run (or resume) an evaluation: stream the run's query logs in chunks, run
+    each history through the run's models with at most `workers` calls at once,
+    starting at most calls_per_minute calls a minute (0: no limit), and save the
+    results to the evaluation_result table.
+
+    After each chunk the results and the checkpoint are committed together, so
+    an interrupted run resumes after the last finished chunk. Calls go through
+    this process's LLM scheduler at background priority, but the web workers
+    each have their own scheduler, so they don't hold back for interactive
+    requests there: workers and calls_per_minute are what limit the load on a
+    backend the app shares. Stops after `limit` more histories if given.
+    """
+    model_configs = ModelConfig.query.filter(ModelConfig.id.in_(run_model_config_ids(run))).all()
+    model_configs.sort(key=lambda model_config: model_config.position)
+    if not model_configs:
+        raise ValueError("None of the run's models exist any more")
+
+    # Plain snapshots, as the session is cleared between chunks
+    user = f"evaluation-{run.id}"
+    models = []
+    for model_config in model_configs:
+        call_args = dict(_model_call_args(model_config, priority=BACKGROUND), user=user)
+        models.append((model_config.id, model_config.model_type, model_config.model_name, call_args))
+    run_id = run.id
+
+    run.status = "running"
+    db.session.commit()
+
+    # On resume, the histories just before the checkpoint are the likeliest duplicates of what follows
+    seen = OrderedDict()
+    if run.last_query_log_id:
+        recent = (
+            _source_query(run)
+            .filter(QueryLog.id <= run.last_query_log_id)
+            .order_by(QueryLog.id.desc())
+            .limit(chunk_size)
+            .all()
+        )
+        for _, text in reversed(_with_texts(recent)):
+            _remember(seen, text)
+
+    evaluated = 0
+    start_time = time.time()
+    rate_limiter = CallRateLimiter(calls_per_minute)
+    executor = ThreadPoolExecutor(max_workers=workers)
+
+    try:
+        for rows in iter_query_log_chunks(run, chunk_size):
+            if limit is not None and evaluated >= limit:
+                break
+
+            # Picked up each chunk, so investigations added during a long run are used from then on
+            investigation_names, prompt_prefix = investigation_catalogue.get()
+
+            cases = []
+            skipped = 0
+            last_id = run.last_query_log_id
+            for query_log_id, history_text in rows:
+                if limit is not None and evaluated + len(cases) >= limit:
+                    break
+                last_id = query_log_id
+                if _remember(seen, history_text):
+                    cases.append((query_log_id, history_text))
+                else:
+                    skipped += 1
+
+            futures = []
+            for query_log_id, history_text in cases:
+                prompt = build_prompt(history_text, prompt_prefix)
+                for model in models:
+                    future = executor.submit(_evaluate, history_text, prompt, investigation_names, model[3], rate_limiter)
+                    futures.append((query_log_id, model, future))
+
+            failed = 0
+            for query_log_id, (model_config_id, model_type, model_name, _), future in futures:
+                try:
+                    result, error_message, raw_response, processing_time_ms = future.result()
+                except Exception as e:
+                    traceback.print_exc()
+                    result, error_message, raw_response, processing_time_ms = {}, f"Error processing model: {str(e)}", None, None
+
+                if raw_response is None:
+                    # The call itself failed; don't keep the placeholder results run_model falls back to
+                    result = {}
+                if error_message:
+                    failed += 1
+
+                db.session.add(EvaluationResult(
+                    run_id=run_id,
+                    query_log_id=query_log_id,
+                    model_config_id=model_config_id,
+                    model_type=model_type,
+                    model_name=model_name,
+                    recommended_questions=result.get("recommended_questions", ""),
+                    recommended_investigations=result.get("recommended_investigations", ""),
+                    problem_list=result.get("problem_list", ""),
+                    raw_response=raw_response,
+                    processing_time_ms=processing_time_ms,
+                    error=error_message
+                ))
+
+            # Results and checkpoint go in one transaction, so a resumed run never repeats or skips a case
+            run.last_query_log_id = last_id
+            run.completed_cases += len(cases)
+            run.skipped_cases += skipped
+            run.failed_calls += failed
+            db.session.commit()
+            evaluated += len(cases)
+
+            log(
+                f"Run {run_id}: {run.completed_cases} histories evaluated, {run.skipped_cases} duplicates skipped, "
+                f"{run.failed_calls} failed calls ({evaluated / (time.time() - start_time):.1f} histories/s, "
+                f"up to log {last_id})"
+            )
+
+            # Let the session forget the chunk's rows
+            db.session.expunge_all()
+            run = db.session.get(EvaluationRun, run_id)
+    except BaseException:
+        # Don't start the calls still queued (e.g. on Ctrl-C); the unfinished chunk is redone on resume
+        executor.shutdown(wait=False, cancel_futures=True)
+        db.session.rollback()
+        run = db.session.get(EvaluationRun, run_id)
+        run.status = "interrupted"
+        db.session.commit()
+        raise
+    executor.shutdown()
+
+    if limit is not None and evaluated >= limit:
+        run.status = "interrupted"
+    else:
+        run.status = "completed"
+        run.finished_at = datetime.utcnow()
+    db.session.commit()
+    return run
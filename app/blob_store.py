@@ -0,0 +1,134 @@
+from app import db
+from app.compression import compress_text
+from app.database import insert_on_conflict
+from app.log_queries import QUERY_PREVIEW_LENGTH
+from app.models import TextBlob, QueryLog
+from flask import current_app
+import hashlib
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def _insert_ignoring_existing(rows):
+    """Insert blob rows, skipping any that another writer has stored in the meantime"""
+    insert = insert_on_conflict(db.engine.dialect.name)
+    if insert is None:
+        # No portable upsert; a concurrent insert of the same text fails the batch, which is retried
+        db.session.execute(db.insert(TextBlob), rows)
+        return
+    db.session.execute(insert(TextBlob).on_conflict_do_nothing(index_elements=["hash"]), rows)
+
+def store_texts(texts):
+    """
+    Store each distinct text once, compressed with QUERY_LOG_COMPRESSION.
+    Returns the texts' hashes (None for None). Runs in the caller's transaction.
+
+    Where the database supports it, every text is inserted, skipping those
+    already stored, rather than first looking up which exist: the archive can
+    delete a blob between that lookup and the caller's commit, leaving its logs
+    pointing at nothing. Inserting takes the write lock, so the archive either
+    deletes first and the blob is stored again, or sees the caller's logs.
+    """
+    hashes = [text_hash(text) if text is not None else None for text in texts]
+    new = {digest: text for digest, text in zip(hashes, texts) if digest is not None}
+    if not new:
+        return hashes
+
+    if insert_on_conflict(db.engine.dialect.name) is None:
+        existing = db.session.query(TextBlob.hash).filter(TextBlob.hash.in_(list(new))).all()
+        for row in existing:
+            del new[row.hash]
+
+    if new:
+        codec = current_app.config.get('QUERY_LOG_COMPRESSION', 'zlib')
+        rows = []
+        for digest, text in new.items():
+            used_codec, data = compress_text(text, codec)
+            rows.append({"hash": digest, "codec": used_codec, "data": data, "size": len(text.encode("utf-8"))})
+        _insert_ignoring_existing(rows)
+    return hashes
+
+def load_texts(hashes):
+    """Texts by hash for a batch of hashes, in one query"""
+    wanted = list({digest for digest in hashes if digest})
+    if not wanted:
+        return {}
+    return {blob.hash: blob.text for blob in TextBlob.query.filter(TextBlob.hash.in_(wanted))}
+
+def compact_query_logs(records):
+    """
+    Turn dicts of QueryLog values with query_text and raw_response into rows that
+    reference shared blobs instead. Returns new dicts; the records are left as they are.
+    """
+    compacted = []
+    query_texts = []
+    raw_responses = []
+    for record in records:
+        record = dict(record)
+        query_texts.append(record.pop("query_text", None))
+        raw_responses.append(record.pop("raw_response", None))
+        record["query_preview"] = query_preview(query_texts[-1])
+        compacted.append(record)
+
+    hashes = store_texts(query_texts + raw_responses)
+    for record, query_hash, response_hash in zip(compacted, hashes[:len(records)], hashes[len(records):]):
+        record["query_text_hash"] = query_hash
+        record["raw_response_hash"] = response_hash
+    return compacted
+
+def query_preview(text):
+    return text[:QUERY_PREVIEW_LENGTH + 1] if text is not None else None
+
+def compact_existing_logs(batch_size=500, log=print):
+    """
+    Move the text of logs written before the blob store into it, batch_size logs
+    per transaction. Safe to interrupt and run again. Returns the number of logs moved.
+    """
+    moved = 0
+    after_id = 0
+    while True:
+        rows = (
+            db.session.query(QueryLog.id, QueryLog.stored_query_text, QueryLog.stored_raw_response)
+            .filter(QueryLog.query_text_hash.is_(None), QueryLog.id > after_id)
+            .order_by(QueryLog.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            return moved
+
+        hashes = store_texts([row.stored_query_text for row in rows] + [row.stored_raw_response for row in rows])
+        updates = [
+            {
+                "id": row.id,
+                "stored_query_text": "",
+                "query_text_hash": query_hash,
+                "query_preview": query_preview(row.stored_query_text),
+                "stored_raw_response": None,
+                "raw_response_hash": response_hash
+            }
+            for row, query_hash, response_hash in zip(rows, hashes[:len(rows)], hashes[len(rows):])
+        ]
+        db.session.execute(db.update(QueryLog), updates)
+        db.session.commit()
+
+        moved += len(rows)
+        after_id = rows[-1].id
+        log(f"Compacted {moved} query logs (up to log {after_id})")
+
+def blob_stats():
+    """Counts and sizes of the stored texts, and of the logs still holding their own copies"""
+    blobs = db.session.query(
+        db.func.count(TextBlob.hash), db.func.sum(TextBlob.size), db.func.sum(db.func.length(TextBlob.data))
+    ).one()
+    legacy = db.session.query(
+        db.func.count(QueryLog.id),
+        db.func.sum(db.func.length(QueryLog.stored_query_text) + db.func.coalesce(db.func.length(QueryLog.stored_raw_response), 0))
+    ).filter(QueryLog.query_text_hash.is_(None)).one()
+    return {
+        "blobs": blobs[0] or 0,
+        "uncompressed_bytes": blobs[1] or 0,
+        "stored_bytes": blobs[2] or 0,
+        "uncompacted_logs": legacy[0] or 0,
+        "uncompacted_bytes": legacy[1] or 0
+    }
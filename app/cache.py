@@ -0,0 +1,113 @@
+from app import db
+from app.models import CachedResult
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from flask import current_app
+import hashlib
+import json
+import threading
+import time
+
+def make_cache_key(model_type, model_name, system_prompt, history_text, investigation_names):
+    """
+    Content hash of everything that determines a model's output
+    """
+    content = json.dumps([model_type, model_name, system_prompt or "", history_text, list(investigation_names)])
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+class MemoryResultCache:
+    """
+    In-process LRU cache of model results with a time-to-live
+    """
+    def __init__(self, max_entries=512, ttl_seconds=3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+
+            stored_at, value = entry
+            if time.time() - stored_at > self.ttl_seconds:
+                del self.entries[key]
+                return None
+
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.time(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+class SQLiteResultCache:
+    """
+    Model result cache stored in the CachedResult table, so it survives restarts
+    and is shared between workers. Must be used from a thread with an app context.
+
+    Reads and writes go through their own connection and transaction rather than
+    the request's session, so they never commit the request's pending changes.
+    """
+    def __init__(self, max_entries=512, ttl_seconds=3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.table = CachedResult.__table__
+
+    def get(self, key):
+        with db.engine.begin() as connection:
+            entry = connection.execute(db.select(self.table).where(self.table.c.key == key)).first()
+            if entry is None:
+                return None
+
+            if entry.created_at < datetime.utcnow() - timedelta(seconds=self.ttl_seconds):
+                connection.execute(db.delete(self.table).where(self.table.c.key == key))
+                return None
+
+        return {"result": json.loads(entry.result), "raw_response": entry.raw_response}
+
+    def set(self, key, value):
+        with db.engine.begin() as connection:
+            connection.execute(db.delete(self.table).where(self.table.c.key == key))
+            connection.execute(db.insert(self.table).values(
+                key=key,
+                result=json.dumps(value["result"]),
+                raw_response=value["raw_response"],
+                created_at=datetime.utcnow()
+            ))
+
+            # Evict the oldest entries beyond the size limit
+            newest = db.select(self.table.c.key).order_by(self.table.c.created_at.desc()).limit(self.max_entries)
+            connection.execute(db.delete(self.table).where(self.table.c.key.not_in(newest)))
+
+    def clear(self):
+        with db.engine.begin() as connection:
+            connection.execute(db.delete(self.table))
+
+def get_result_cache():
+    """
+    The result cache configured for the current app, or None if caching is disabled
+    """
+    if 'result_cache' not in current_app.extensions:
+        backend = current_app.config.get('LLM_CACHE_BACKEND', 'memory')
+        max_entries = current_app.config.get('LLM_CACHE_MAX_ENTRIES', 512)
+        ttl_seconds = current_app.config.get('LLM_CACHE_TTL_SECONDS', 3600)
+
+        if backend == 'memory':
+            cache = MemoryResultCache(max_entries, ttl_seconds)
+        elif backend == 'sqlite':
+            cache = SQLiteResultCache(max_entries, ttl_seconds)
+        else:
+            cache = None
+        current_app.extensions['result_cache'] = cache
+
+    return current_app.extensions['result_cache']
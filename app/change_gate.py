@@ -0,0 +1,169 @@
+from collections import OrderedDict
+import difflib
+import hashlib
+import re
+import threading
+import time
+
+# Words as the gate compares them: case, whitespace and punctuation are ignored,
+# but decimals ("2.5") and contractions ("don't") stay one word. Signs and
+# qualifiers are words of their own, as they change the meaning: "+ve" and "-ve",
+# "135" and "<135", "PE" and "?PE"
+WORD = re.compile(r"[a-z0-9]+(?:[.'][a-z0-9]+)*|[+\-<>?=≤≥±]")
+
+# Above this many differing words either side, don't bother aligning them; the change is significant anyway
+MAX_DIFF_WORDS = 400
+
+# Shortest word whose one-letter edit counts as a typo fix ("fevre" -> "fever");
+# shorter words ("no" -> "so") are too easily a different word
+MIN_TYPO_WORD_LENGTH = 5
+
+def _words(count):
+    return f"{count} word" if count == 1 else f"{count} words"
+
+def normalize_words(text):
+    return WORD.findall((text or "").lower())
+
+def fingerprint(words):
+    return hashlib.sha256(" ".join(words).encode("utf-8")).digest()
+
+def _one_edit_apart(a, b):
+    """True if b is a with one letter inserted, removed, changed, or swapped with the next"""
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    prefix = 0
+    while prefix < len(a) and a[prefix] == b[prefix]:
+        prefix += 1
+    if len(a) == len(b):
+        if a[prefix + 1:] == b[prefix + 1:]:
+            return True
+        return a[prefix:prefix + 2] == b[prefix:prefix + 2][::-1] and a[prefix + 2:] == b[prefix + 2:]
+    return a[prefix:] == b[prefix + 1:]
+
+def load_vocabulary(path):
+    """The words in a word list file (e.g. a medical dictionary), normalized as the gate compares them"""
+    with open(path, encoding="utf-8") as vocabulary_file:
+        return set(normalize_words(vocabulary_file.read()))
+
+def is_typo_fix(old, new, vocabulary=None):
+    """
+    A one-letter change to a longer word. Numbers never count: "10" -> "100"
+    is a different dose, not a typo. Many real words are one letter apart
+    ("dysphagia" and "dysphasia"), so given a vocabulary, the old word must
+    not be in it and the new word must be.
+    """
+    if any(char.isdigit() for char in old + new):
+        return False
+    if vocabulary is not None and (old in vocabulary or new not in vocabulary):
+        return False
+    return min(len(old), len(new)) >= MIN_TYPO_WORD_LENGTH and _one_edit_apart(old, new)
+
+def changed_words(old_words, new_words, ignore_typos=False, vocabulary=None):
+    """
+    How many words were added, removed or replaced between two word lists, not
+    counting typo fixes (checked against vocabulary, if given) if ignore_typos.
+    Typing mostly appends, so the common start and end are skipped before the
+    rest is diffed.
+    """
+    start = 0
+    limit = min(len(old_words), len(new_words))
+    while start < limit and old_words[start] == new_words[start]:
+        start += 1
+    end = 0
+    while end < limit - start and old_words[-1 - end] == new_words[-1 - end]:
+        end += 1
+    old_middle = old_words[start:len(old_words) - end]
+    new_middle = new_words[start:len(new_words) - end]
+
+    if len(old_middle) > MAX_DIFF_WORDS or len(new_middle) > MAX_DIFF_WORDS:
+        return max(len(old_middle), len(new_middle))
+
+    changed = 0
+    matcher = difflib.SequenceMatcher(None, old_middle, new_middle, autojunk=False)
+    for tag, old_start, old_end, new_start, new_end in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        if tag == "replace" and ignore_typos:
+            pairs = list(zip(old_middle[old_start:old_end], new_middle[new_start:new_end]))
+            changed += sum(1 for old, new in pairs if not is_typo_fix(old, new, vocabulary))
+            changed += abs((old_end - old_start) - (new_end - new_start))
+        else:
+            changed += max(old_end - old_start, new_end - new_start)
+    return changed
+
+class GateDecision:
+    """Whether a history needs the models to run again, and why"""
+    def __init__(self, significant, changed_words=None, reason=""):
+        self.significant = significant
+        self.changed_words = changed_words
+        self.reason = reason
+
+class ChangeGate:
+    """
+    Remembers the last history each session's models were run on, and decides
+    whether a new history differs from it enough to run them again.
+
+    The comparison is on normalized words: edits to whitespace, punctuation or
+    case change nothing, and one-letter fixes to longer words (typos) are
+    ignored if ignore_typos, only from a word not in the vocabulary to one in
+    it if a vocabulary is given. A history is significant if at least min_words
+    words differ, or if the models or investigations (the context) changed.
+    Histories are compared with the last one that was processed, not the last
+    one seen, so small edits that add up are still picked up.
+
+    State is per process and least recently used sessions are forgotten, so a
+    session that reaches another worker, or was forgotten, just runs its models.
+    """
+    def __init__(self, min_words=1, ignore_typos=False, vocabulary=None, max_sessions=10000, ttl_seconds=3600):
+        self.min_words = min_words
+        self.ignore_typos = ignore_typos
+        self.vocabulary = vocabulary
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.sessions = OrderedDict()  # session id -> (time, words, fingerprint, context)
+        self.lock = threading.Lock()
+
+    def _entry(self, session_id):
+        entry = self.sessions.get(session_id)
+        if entry is not None and time.time() - entry[0] > self.ttl_seconds:
+            del self.sessions[session_id]
+            return None
+        return entry
+
+    def check(self, session_id, history_text, context):
+        """The GateDecision for running the session's models on history_text"""
+        with self.lock:
+            entry = self._entry(session_id)
+        if entry is None:
+            return GateDecision(True, reason="no processed history for this session")
+        _, old_words, old_fingerprint, old_context = entry
+        if context != old_context:
+            return GateDecision(True, reason="models or investigations changed")
+
+        words = normalize_words(history_text)
+        if fingerprint(words) == old_fingerprint:
+            return GateDecision(False, 0, "only whitespace, punctuation or case changed")
+        changed = changed_words(old_words, words, self.ignore_typos, self.vocabulary)
+        if changed >= self.min_words:
+            return GateDecision(True, changed, f"{_words(changed)} changed")
+        if changed == 0:
+            return GateDecision(False, 0, "only typo fixes, whitespace, punctuation or case changed")
+        return GateDecision(False, changed, f"{_words(changed)} changed, below the threshold of {self.min_words}")
+
+    def record(self, session_id, history_text, context):
+        """Remember history_text as the session's last processed history"""
+        words = normalize_words(history_text)
+        with self.lock:
+            self.sessions[session_id] = (time.time(), words, fingerprint(words), context)
+            self.sessions.move_to_end(session_id)
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+
+    def forget(self, session_id):
+        with self.lock:
+            self.sessions.pop(session_id, None)
+
+# Shared gate for all requests in this process
+change_gate = ChangeGate()
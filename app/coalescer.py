@@ -0,0 +1,179 @@
+from app.generations import RequestSuperseded
+from collections import OrderedDict
+import threading
+import time
+
+def covers(run_text, text):
+    """Whether an update run on run_text answers a caller who sent text: the caller's text must be where it started"""
+    return run_text.startswith(text)
+
+class CoalescerTicket:
+    """One caller's place in a session's queue of updates"""
+    def __init__(self, session_id, seq, own_text):
+        self.session_id = session_id
+        self.seq = seq
+        self.own_text = own_text  # Text this caller sent
+        self.text = None  # Text to process when the caller holds the slot
+        self.value = None  # Result this caller was answered with
+        self.covered = False  # Whether that result was run on text starting with own_text
+
+class _SessionState:
+    def __init__(self):
+        self.latest_seq = 0
+        self.latest_text = None
+        self.running = False
+        self.running_seq = 0
+        self.completed_seq = 0
+        self.value = None
+        self.value_text = None  # Text the last completed update ran on
+        self.last_dispatched = 0  # When the session's last update called the LLM
+        self.waiters = 0
+        self.condition = None
+
+class UpdateCoalescer:
+    """
+    Runs at most one update per session at a time, always on the session's latest text.
+
+    Each caller joins with its text. If nothing is running for the session, the
+    caller takes the slot and processes the latest text. Otherwise it waits: when
+    the running update finishes, one waiting caller takes the slot and processes
+    whatever text arrived last. Every caller up to that point gets that result if
+    it covers their text, i.e. the text it ran on starts with theirs; the others
+    (whose text was edited rather than extended) are superseded.
+
+    An update that needs the LLM can also wait_for_interval() before calling it,
+    so one session's LLM calls start at least min_interval seconds apart; updates
+    answered without the LLM never wait.
+
+    State is per process, so requests from one session only coalesce when they
+    reach the same worker process.
+    """
+    def __init__(self, max_sessions=10000):
+        self.max_sessions = max_sessions
+        self.lock = threading.Lock()
+        self.sessions = OrderedDict()
+
+    def _state(self, session_id):
+        state = self.sessions.get(session_id)
+        if state is None:
+            state = _SessionState()
+            state.condition = threading.Condition(self.lock)
+            self.sessions[session_id] = state
+            self._evict_idle()
+        self.sessions.move_to_end(session_id)
+        return state
+
+    def _evict_idle(self):
+        for session_id in list(self.sessions):
+            if len(self.sessions) <= self.max_sessions:
+                break
+            state = self.sessions[session_id]
+            if not state.running and not state.waiters:
+                del self.sessions[session_id]
+
+    def join(self, session_id, text):
+        """Register a caller's text; it replaces any text not yet started"""
+        with self.lock:
+            state = self._state(session_id)
+            state.latest_seq += 1
+            state.latest_text = text
+            return CoalescerTicket(session_id, state.latest_seq, text)
+
+    def next_turn(self, ticket):
+        """
+        Block until the ticket is answered or it is this caller's turn to run.
+        Returns True with ticket.text set when the caller holds the slot and must
+        call finish() or release(); False once an update including the ticket has
+        completed, with ticket.covered set and, if covered, ticket.value.
+        """
+        with self.lock:
+            state = self._state(ticket.session_id)
+            state.waiters += 1
+            try:
+                while True:
+                    if state.completed_seq >= ticket.seq:
+                        ticket.covered = covers(state.value_text, ticket.own_text)
+                        ticket.value = state.value if ticket.covered else None
+                        return False
+                    if not state.running:
+                        break
+                    state.condition.wait()
+
+                state.running = True
+                state.running_seq = state.latest_seq
+                ticket.text = state.latest_text
+                return True
+            finally:
+                state.waiters -= 1
+
+    def finish(self, ticket, value):
+        """Publish the result of the running update to every caller it covers"""
+        with self.lock:
+            state = self._state(ticket.session_id)
+            state.completed_seq = max(state.completed_seq, state.running_seq)
+            state.value = value
+            state.value_text = ticket.text
+            ticket.covered = covers(ticket.text, ticket.own_text)
+            ticket.value = value if ticket.covered else None
+            state.running = False
+            state.condition.notify_all()
+
+    def release(self, ticket):
+        """Give up the slot without a result, e.g. when the update was superseded or failed"""
+        with self.lock:
+            state = self._state(ticket.session_id)
+            state.running = False
+            state.condition.notify_all()
+
+    def wait_for_interval(self, session_id, min_interval, cancel_check=None):
+        """
+        Block until min_interval seconds after the session's last LLM call started,
+        then count this one as started. Raises RequestSuperseded if cancel_check()
+        becomes true while waiting, so newer text can take over the slot.
+        """
+        while True:
+            with self.lock:
+                state = self._state(session_id)
+                wait = state.last_dispatched + min_interval - time.time()
+                if wait <= 0:
+                    state.last_dispatched = time.time()
+                    return
+            if cancel_check and cancel_check():
+                raise RequestSuperseded("Superseded while waiting for the minimum update interval")
+            # Wake up regularly to notice cancellation
+            time.sleep(min(wait, 0.1))
+
+    def has_newer(self, ticket):
+        """Whether text newer than the update this caller is running has arrived"""
+        with self.lock:
+            state = self._state(ticket.session_id)
+            return state.latest_seq > state.running_seq
+
+    def run(self, session_id, text, process, retry_on=()):
+        """
+        Coalesce a call to process(text). Returns the value of the update that
+        covered this caller, which may have been run on later text by another caller.
+        Raises RequestSuperseded if the update that ran instead didn't cover it.
+        If process raises one of retry_on and newer text has arrived, the slot is
+        given up and the newer text is processed instead.
+        """
+        ticket = self.join(session_id, text)
+        while self.next_turn(ticket):
+            try:
+                value = process(ticket.text)
+            except retry_on:
+                self.release(ticket)
+                if not self.has_newer(ticket):
+                    raise
+                continue
+            except BaseException:
+                self.release(ticket)
+                raise
+            self.finish(ticket, value)
+            break
+        if not ticket.covered:
+            raise RequestSuperseded("An update for edited text answered this request")
+        return ticket.value
+
+# Shared coalescer for all requests in this process
+update_coalescer = UpdateCoalescer()
@@ -0,0 +1,145 @@
+from flask.cli import AppGroup
+from app import db
+from app.models import EvaluationRun
+from datetime import datetime
+import click
+
+evaluate_cli = AppGroup('evaluate', help='Re-run logged patient histories through models in bulk.')
+logs_cli = AppGroup('logs', help='Maintain the query log.')
+
+def _parse_date(value):
+    return datetime.fromisoformat(value) if value else None
+
+def _model_ids(value):
+    try:
+        return [int(id) for id in value.split(',') if id.strip()]
+    except ValueError:
+        raise click.BadParameter('expected comma-separated model config ids, e.g. 1,3')
+
+@evaluate_cli.command('run')
+@click.option('--models', required=True, help='Comma-separated model config ids to evaluate.')
+@click.option('--name', default=None, help='Label for the run.')
+@click.option('--source-model', default=None, help='Only re-run histories logged for this model name.')
+@click.option('--since', default=None, help='Only re-run histories logged on or after this date (YYYY-MM-DD).')
+@click.option('--until', default=None, help='Only re-run histories logged before this date (YYYY-MM-DD).')
+@click.option('--include-archive', is_flag=True, help='Also re-run histories that have been moved to the log archive.')
+@click.option('--workers', default=1, show_default=True, help='Model calls to run at once.')
+@click.option('--calls-per-minute', default=30, show_default=True, help='Most model calls to start a minute (0 for no limit).')
+@click.option('--chunk-size', default=50, show_default=True, help='Histories to read and checkpoint at a time.')
+@click.option('--limit', type=int, default=None, help='Stop after this many histories (resume later).')
+def run_command(models, name, source_model, since, until, include_archive, workers, calls_per_minute, chunk_size, limit):
+    """Start an evaluation run over the query log."""
+    from app.batch_eval import create_evaluation_run, run_evaluation
+
+    try:
+        run = create_evaluation_run(
+            _model_ids(models), name, source_model, _parse_date(since), _parse_date(until), include_archive
+        )
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+    click.echo(f'Evaluation run {run.id}: {run.total_cases} logged histories to evaluate')
+    run = run_evaluation(run, workers, chunk_size, limit, log=click.echo, calls_per_minute=calls_per_minute)
+    click.echo(f'Run {run.id} {run.status}')
+
+@evaluate_cli.command('resume')
+@click.argument('run_id', type=int)
+@click.option('--workers', default=1, show_default=True, help='Model calls to run at once.')
+@click.option('--calls-per-minute', default=30, show_default=True, help='Most model calls to start a minute (0 for no limit).')
+@click.option('--chunk-size', default=50, show_default=True, help='Histories to read and checkpoint at a time.')
+@click.option('--limit', type=int, default=None, help='Stop after this many more histories.')
+def resume_command(run_id, workers, calls_per_minute, chunk_size, limit):
+    """Continue an interrupted evaluation run from its checkpoint."""
+    from app.batch_eval import run_evaluation
+
+    run = db.session.get(EvaluationRun, run_id)
+    if run is None:
+        raise click.ClickException(f'No evaluation run {run_id}')
+    if run.status == 'completed':
+        raise click.ClickException(f'Run {run_id} has already completed')
+
+    click.echo(f'Resuming run {run.id} after query log {run.last_query_log_id}')
+    try:
+        run = run_evaluation(run, workers, chunk_size, limit, log=click.echo, calls_per_minute=calls_per_minute)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f'Run {run.id} {run.status}')
+
+@evaluate_cli.command('list')
+def list_command():
+    """Show evaluation runs and their progress."""
+    for run in EvaluationRun.query.order_by(EvaluationRun.id):
+        click.echo(
+            f'{run.id:>4}  {run.status:<11}  models {run.model_config_ids:<10}  '
+            f'{run.completed_cases + run.skipped_cases}/{run.total_cases} logs read, {run.completed_cases} evaluated, '
+            f'{run.failed_calls} failed calls  {run.name or ""}'
+        )
+
+def _format_size(size):
+    return f'{size / 1e6:.1f} MB' if size >= 1e6 else f'{size / 1e3:.1f} kB'
+
+@logs_cli.command('compact')
+@click.option('--batch-size', default=500, show_default=True, help='Logs to move per transaction.')
+@click.option('--vacuum', is_flag=True, help='Afterwards, rebuild the SQLite file to give the freed space back.')
+def compact_command(batch_size, vacuum):
+    """Move the text of older logs into the shared, compressed blob store."""
+    from app.blob_store import compact_existing_logs, blob_stats
+
+    moved = compact_existing_logs(batch_size, log=click.echo)
+    stats = blob_stats()
+    click.echo(
+        f'Compacted {moved} logs. {stats["blobs"]} distinct texts: '
+        f'{_format_size(stats["uncompressed_bytes"])} stored in {_format_size(stats["stored_bytes"])}'
+    )
+
+    if vacuum:
+        if db.engine.dialect.name != 'sqlite':
+            raise click.ClickException('--vacuum only applies to SQLite databases')
+        click.echo('Vacuuming the database...')
+        with db.engine.connect() as connection:
+            connection.execution_options(isolation_level='AUTOCOMMIT').execute(db.text('VACUUM'))
+
+@logs_cli.command('stats')
+def stats_command():
+    """Show how much space the query log text takes up."""
+    from app.blob_store import blob_stats
+
+    stats = blob_stats()
+    click.echo(
+        f'{stats["blobs"]} distinct texts: {_format_size(stats["uncompressed_bytes"])} '
+        f'stored in {_format_size(stats["stored_bytes"])}'
+    )
+    click.echo(f'{stats["uncompacted_logs"]} logs not yet compacted: {_format_size(stats["uncompacted_bytes"])}')
+
+@logs_cli.command('archive')
+@click.option('--older-than-days', type=int, default=None,
+              help='Archive logs from before this many days ago. Defaults to QUERY_LOG_RETENTION_DAYS.')
+@click.option('--batch-size', default=500, show_default=True, help='Logs to read from the database at a time.')
+def archive_command(older_than_days, batch_size):
+    """
+    Move old logs out of the database into gzipped files, one directory per day,
+    under QUERY_LOG_ARCHIVE_DIR. Safe to interrupt and run again; meant to run
+    daily, e.g. from cron.
+    """
+    from app.archive import archive_old_logs
+    from flask import current_app
+
+    if older_than_days is None:
+        older_than_days = current_app.config['QUERY_LOG_RETENTION_DAYS']
+    archived = archive_old_logs(older_than_days, batch_size=batch_size, log=click.echo)
+    click.echo(f'Archived {archived} logs older than {older_than_days} days to {current_app.config["QUERY_LOG_ARCHIVE_DIR"]}')
+
+@click.command('init-db')
+def init_db_command():
+    """Create or upgrade the database tables and seed the default models."""
+    from app import init_db
+
+    if init_db():
+        click.echo('Database created and seeded')
+    else:
+        click.echo('Database is up to date')
+
+def register_commands(app):
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(evaluate_cli)
+    app.cli.add_command(logs_cli)
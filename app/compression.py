@@ -0,0 +1,46 @@
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # Optional: pip install zstandard
+    zstandard = None
+
+# Texts shorter than this are stored as they are; compressing them saves little or nothing
+MIN_COMPRESS_SIZE = 64
+
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+
+def available_codec(codec):
+    """The codec to compress with: zstd falls back to zlib if zstandard isn't installed"""
+    if codec == "zstd" and zstandard is None:
+        return "zlib"
+    if codec not in ("zlib", "zstd", "none"):
+        raise ValueError(f"Unknown compression codec: {codec}")
+    return codec
+
+def compress_text(text, codec="zlib"):
+    """Encode and compress text. Returns (codec used, data)."""
+    data = text.encode("utf-8")
+    codec = available_codec(codec)
+    if codec == "none" or len(data) < MIN_COMPRESS_SIZE:
+        return "none", data
+
+    if codec == "zstd":
+        compressed = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    else:
+        compressed = zlib.compress(data, ZLIB_LEVEL)
+    if len(compressed) >= len(data):
+        return "none", data
+    return codec, compressed
+
+def decompress_text(codec, data):
+    if codec == "zlib":
+        data = zlib.decompress(data)
+    elif codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("This text was compressed with zstd; install zstandard to read it")
+        data = zstandard.ZstdDecompressor().decompress(data)
+    elif codec != "none":
+        raise ValueError(f"Unknown compression codec: {codec}")
+    return data.decode("utf-8")
@@ -0,0 +1,89 @@
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+DEFAULT_DATABASE_URI = 'sqlite:///medical_app.db'
+
+def database_uri(value):
+    """
+    The SQLAlchemy URI from DATABASE_URL, or the local SQLite file if it isn't set.
+    Hosting providers often give Postgres URLs as postgres://, which SQLAlchemy no longer accepts.
+    """
+    if not value:
+        return DEFAULT_DATABASE_URI
+    if value.startswith('postgres://'):
+        return 'postgresql://' + value[len('postgres://'):]
+    return value
+
+def is_sqlite(uri):
+    return uri.startswith('sqlite')
+
+def is_sqlite_memory(uri):
+    """In-memory SQLite, which uses a single shared connection (StaticPool) rather than a sized pool"""
+    url = make_url(uri)
+    return url.database in (None, '', ':memory:') or url.query.get('mode') == 'memory'
+
+def insert_on_conflict(dialect_name):
+    """
+    The dialect's insert construct, which supports ON CONFLICT clauses for
+    upserts, or None for dialects without one
+    """
+    if dialect_name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+        return insert
+    if dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        return insert
+    return None
+
+def engine_options(config):
+    """
+    Engine and pool settings for the configured database.
+
+    SQLite gets a busy timeout on the driver so a writer waits for the lock instead
+    of failing with "database is locked". Server databases get a sized pool that
+    checks connections before use and recycles them before the server drops them.
+    The pool size settings only apply to pooled engines: server databases and
+    file-backed SQLite, not in-memory SQLite.
+    """
+    uri = config['SQLALCHEMY_DATABASE_URI']
+    options = {}
+    if not (is_sqlite(uri) and is_sqlite_memory(uri)):
+        options['pool_size'] = config['DB_POOL_SIZE']
+        options['max_overflow'] = config['DB_MAX_OVERFLOW']
+        options['pool_timeout'] = config['DB_POOL_TIMEOUT']
+    if is_sqlite(uri):
+        options['connect_args'] = {
+            'timeout': config['SQLITE_BUSY_TIMEOUT_MS'] / 1000,
+            # Connections are shared between request threads and the query log writer via the pool
+            'check_same_thread': False
+        }
+    else:
+        options['pool_pre_ping'] = True
+        options['pool_recycle'] = config['DB_POOL_RECYCLE']
+    return options
+
+def configure_sqlite(engine, config):
+    """
+    Set pragmas on each new SQLite connection.
+
+    WAL lets readers carry on while a write is in progress and lets writes commit
+    without waiting for readers, so request threads, the query log writer and other
+    worker processes stop blocking each other. synchronous=NORMAL is safe with WAL
+    (a crash can lose the last commits but can't corrupt the database) and avoids an
+    fsync on every commit.
+    """
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            if config['SQLITE_WAL']:
+                cursor.execute('PRAGMA journal_mode=WAL')
+                cursor.execute('PRAGMA synchronous=NORMAL')
+            cursor.execute(f"PRAGMA busy_timeout={int(config['SQLITE_BUSY_TIMEOUT_MS'])}")
+            # Negative values are in KiB rather than pages
+            cursor.execute(f"PRAGMA cache_size=-{int(config['SQLITE_CACHE_SIZE_KB'])}")
+        finally:
+            cursor.close()
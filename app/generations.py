@@ -0,0 +1,61 @@
+from collections import OrderedDict
+import itertools
+import threading
+
+class RequestSuperseded(Exception):
+    """Raised when a newer request for the same session has started"""
+    pass
+
+class RequestToken:
+    """
+    Handle for one request generation, checked by in-flight work to see whether
+    it should be abandoned
+    """
+    def __init__(self, tracker, session_id, generation):
+        self.tracker = tracker
+        self.session_id = session_id
+        self.generation = generation
+
+    def is_superseded(self):
+        return not self.tracker.is_current(self.session_id, self.generation)
+
+    def check(self):
+        """Raise RequestSuperseded if a newer request has started"""
+        if self.is_superseded():
+            raise RequestSuperseded(f"Request {self.generation} for session {self.session_id} was superseded")
+
+class RequestGenerations:
+    """
+    Tracks the newest request generation for each session, so that starting a
+    new request marks every older in-flight request for that session as superseded.
+
+    Only the max_sessions most recently started sessions are tracked. Generations
+    are numbered across all sessions, so a session that was dropped and starts
+    again can't reuse a number, and a request whose session was dropped counts
+    as current.
+
+    State is per process; with several workers each one only supersedes the
+    requests it is serving itself.
+    """
+    def __init__(self, max_sessions=10000):
+        self.max_sessions = max_sessions
+        self.lock = threading.Lock()
+        self.current = OrderedDict()
+        self.generations = itertools.count(1)
+
+    def begin(self, session_id):
+        """Start a new request generation for the session and return its token"""
+        with self.lock:
+            generation = next(self.generations)
+            self.current[session_id] = generation
+            self.current.move_to_end(session_id)
+            while len(self.current) > self.max_sessions:
+                self.current.popitem(last=False)
+        return RequestToken(self, session_id, generation)
+
+    def is_current(self, session_id, generation):
+        with self.lock:
+            return self.current.get(session_id, generation) == generation
+
+# Shared tracker for all requests in this process
+request_generations = RequestGenerations()
@@ -0,0 +1,87 @@
+from collections import OrderedDict
+import threading
+import time
+
+def build_delta_prompt(appended_text):
+    """
+    Prompt for a follow-up call that only carries the newly appended history.
+    The earlier history and the model's previous answer are already in the context.
+    """
+    return f"""
+Additional Patient History:
+{appended_text}
+
+Based on the full patient history so far, provide updated recommendations in the same JSON format.
+"""
+
+class Conversation:
+    """
+    The Ollama context for one session and model: the history text it covers, the
+    context tokens Ollama returned for it (which include the model's last answer),
+    and a fingerprint of the model and prompt settings it was built with.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.history_text = None
+        self.context = None
+        self.fingerprint = None
+        self.turns = 0
+
+    def prepare(self, history_text, full_prompt, fingerprint, max_turns):
+        """
+        Choose what to send for history_text: returns (prompt, context, incremental).
+
+        Only the appended text is sent if the history extends the text this context
+        covers, the model and prompt settings are unchanged, and fewer than max_turns
+        incremental calls have been made. Otherwise (e.g. earlier text was edited)
+        the full prompt is sent without context.
+        """
+        with self.lock:
+            if (self.context and self.fingerprint == fingerprint and self.turns < max_turns
+                    and history_text.startswith(self.history_text)
+                    and history_text[len(self.history_text):].strip()):
+                return build_delta_prompt(history_text[len(self.history_text):]), self.context, True
+            return full_prompt, None, False
+
+    def update(self, history_text, context, fingerprint, incremental):
+        """Record the context returned for a successful call"""
+        with self.lock:
+            self.history_text = history_text
+            self.context = context
+            self.fingerprint = fingerprint
+            self.turns = self.turns + 1 if incremental else 0
+
+    def reset(self):
+        with self.lock:
+            self.history_text = None
+            self.context = None
+            self.turns = 0
+
+class ConversationStore:
+    """
+    Conversations by (session id, model config id), least recently used first out
+    and expired after ttl_seconds without use
+    """
+    def __init__(self, max_entries=1000, ttl_seconds=3600, max_turns=8):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        # Incremental calls before the context is rebuilt from a full prompt, bounding its growth
+        self.max_turns = max_turns
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, session_id, model_config_id):
+        key = (session_id, model_config_id)
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or now - entry[0] > self.ttl_seconds:
+                entry = (now, Conversation())
+            self.entries[key] = (now, entry[1])
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            return entry[1]
+
+# Shared store for all requests in this process
+conversation_store = ConversationStore()
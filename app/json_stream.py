@@ -0,0 +1,105 @@
+import json
+
+class IncrementalJSONParser:
+    """
+    Incremental parser for a streamed JSON object.
+
+    Text is fed in as it arrives from the LLM, and each top-level field is
+    reported as soon as its value is complete, without waiting for the rest
+    of the object. Any text before the opening brace (e.g. a code fence) is skipped.
+    """
+    def __init__(self, fields=None):
+        # Only report these top-level fields (all fields if None)
+        self.fields = set(fields) if fields is not None else None
+        self.buffer = ""
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.state = "start"  # start -> key -> colon -> value -> comma -> key ... -> end
+        self.key = None
+        self.token_start = None
+        self.completed = {}
+
+    def feed(self, text):
+        """
+        Add more text, returning a list of (field_name, value) pairs completed by it
+        """
+        self.buffer += text
+        completed = []
+
+        while self.pos < len(self.buffer):
+            char = self.buffer[self.pos]
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+                    if self.depth == 1:
+                        self._string_closed(completed)
+            elif self.state == "start":
+                if char == "{":
+                    self.depth = 1
+                    self.state = "key"
+            elif self.state == "end":
+                break
+            elif self.state == "scalar" and char in ",}":
+                # Numbers, booleans and null end at the next delimiter
+                self._emit(self.buffer[self.token_start:self.pos].strip(), completed)
+                self.state = "comma"
+                continue  # Re-read the delimiter in the comma state
+            elif char == '"':
+                self.in_string = True
+                if self.depth == 1 and self.state in ("key", "value"):
+                    self.token_start = self.pos
+                    if self.state == "value":
+                        self.state = "string"
+            elif char in "{[":
+                if self.depth == 1 and self.state == "value":
+                    self.token_start = self.pos
+                    self.state = "container"
+                self.depth += 1
+            elif char in "}]":
+                self.depth -= 1
+                if self.depth == 1 and self.state == "container":
+                    self._emit(self.buffer[self.token_start:self.pos + 1], completed)
+                    self.state = "comma"
+                elif self.depth == 0:
+                    self.state = "end"
+            elif self.depth == 1:
+                if self.state == "colon" and char == ":":
+                    self.state = "value"
+                elif self.state == "comma" and char == ",":
+                    self.state = "key"
+                elif self.state == "value" and not char.isspace():
+                    self.token_start = self.pos
+                    self.state = "scalar"
+
+            self.pos += 1
+
+        return completed
+
+    def _string_closed(self, completed):
+        token = self.buffer[self.token_start:self.pos + 1]
+        if self.state == "key":
+            try:
+                self.key = json.loads(token)
+            except json.JSONDecodeError:
+                self.key = None  # Not a valid key, so its value is never reported
+            self.state = "colon"
+        elif self.state == "string":
+            self._emit(token, completed)
+            self.state = "comma"
+
+    def _emit(self, token, completed):
+        try:
+            value = json.loads(token)
+        except json.JSONDecodeError:
+            return
+
+        if self.fields is None or self.key in self.fields:
+            self.completed[self.key] = value
+            completed.append((self.key, value))
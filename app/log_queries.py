@@ -0,0 +1,81 @@
+from app import db
+from app.models import QueryLog
+from datetime import datetime
+
+# Characters of query text shown in log listings; one extra is fetched to tell if it was cut off
+QUERY_PREVIEW_LENGTH = 50
+
+def encode_cursor(timestamp, log_id):
+    """Keyset cursor for the position after a row, ordered newest first"""
+    return f"{timestamp.isoformat()}_{log_id}"
+
+def decode_cursor(cursor):
+    """Returns (timestamp, id), raising ValueError if the cursor is malformed"""
+    timestamp, log_id = cursor.rsplit("_", 1)
+    return datetime.fromisoformat(timestamp), int(log_id)
+
+def query_log_summaries(model_name=None, start=None, end=None, has_error=None, cursor=None, limit=50):
+    """
+    One page of query logs, newest first, as summary rows.
+
+    Only small columns and a short preview of the query text are loaded; the
+    query text, raw response and results are left for the detail view. Pages are
+    found by keyset (timestamp, id) rather than offset, so later pages are as
+    cheap as the first. Returns (rows, next_cursor), where next_cursor is None on
+    the last page.
+    """
+    query = db.session.query(
+        QueryLog.id,
+        QueryLog.timestamp,
+        QueryLog.model_type,
+        QueryLog.model_name,
+        QueryLog.processing_time_ms,
+        QueryLog.cache_hit,
+        QueryLog.error.isnot(None).label("has_error"),
+        QueryLog.skip_reason.isnot(None).label("skipped"),
+        db.func.coalesce(
+            QueryLog.query_preview, db.func.substr(QueryLog.stored_query_text, 1, QUERY_PREVIEW_LENGTH + 1)
+        ).label("query_preview")
+    )
+
+    if model_name:
+        query = query.filter(QueryLog.model_name == model_name)
+    if start:
+        query = query.filter(QueryLog.timestamp >= start)
+    if end:
+        query = query.filter(QueryLog.timestamp < end)
+    if has_error is True:
+        query = query.filter(QueryLog.error.isnot(None))
+    elif has_error is False:
+        query = query.filter(QueryLog.error.is_(None))
+
+    if cursor:
+        timestamp, log_id = decode_cursor(cursor)
+        query = query.filter(db.or_(
+            QueryLog.timestamp < timestamp,
+            db.and_(QueryLog.timestamp == timestamp, QueryLog.id < log_id)
+        ))
+
+    rows = query.order_by(QueryLog.timestamp.desc(), QueryLog.id.desc()).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].timestamp, rows[-1].id)
+
+    return rows, next_cursor
+
+def summary_to_dict(row):
+    preview = row.query_preview or ""
+    return {
+        "id": row.id,
+        "timestamp": row.timestamp.isoformat() if row.timestamp else None,
+        "model_type": row.model_type,
+        "model_name": row.model_name,
+        "processing_time_ms": row.processing_time_ms,
+        "cache_hit": bool(row.cache_hit),
+        "has_error": bool(row.has_error),
+        "skipped": bool(row.skipped),
+        "query_preview": preview[:QUERY_PREVIEW_LENGTH],
+        "query_truncated": len(preview) > QUERY_PREVIEW_LENGTH
+    }
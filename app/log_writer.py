@@ -0,0 +1,209 @@
+from app import db
+from app.blob_store import compact_query_logs
+from app.models import QueryLog
+from app.metrics import QUERY_LOG_WRITE_SECONDS
+from datetime import datetime
+from flask import current_app
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+import traceback
+
+# Tries at writing a batch before it is split up, or a single record is set aside
+MAX_WRITE_ATTEMPTS = 3
+# Wait before trying again with records that couldn't be written or spilled
+REQUEUE_DELAY_SECONDS = 5
+
+class QueryLogWriter:
+    """
+    Writes QueryLog rows on a background thread, batching inserts into one
+    transaction every batch_size records or every flush_interval_ms, whichever
+    comes first.
+
+    Records are never dropped: a failed batch is retried with backoff, then split
+    to isolate any record the database won't take. Records that still can't be
+    written are appended to a spill file, which is replayed the next time a writer
+    starts. If the spill file can't be written either, the records are queued
+    again. On shutdown everything queued is written or spilled, without splitting
+    failed batches; records still queued once the thread has stopped are spilled.
+    """
+    def __init__(self, app, batch_size=50, flush_interval_ms=200, spill_path=None):
+        self.app = app
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.spill_path = spill_path or os.path.join(app.instance_path, "query_log_spill.jsonl")
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+        self.stopping = False
+
+    def submit(self, record):
+        """Queue a dict of QueryLog column values for writing"""
+        self._ensure_started()
+        self.queue.put(record)
+
+    def _ensure_started(self):
+        # Started lazily, and again in each forked worker process, since threads don't survive a fork
+        with self.lock:
+            if self.thread is not None and self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.queue = queue.Queue()
+            self._replay_spill()
+            self.thread = threading.Thread(target=self._run, name="query-log-writer", daemon=True)
+            self.thread.start()
+            atexit.register(self.stop)
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                self._write_batch(batch)
+            except Exception as e:
+                # Neither the database nor the spill file took them; keep the records and try again later
+                print(f"Failed to write or spill {len(batch)} query logs: {str(e)}")
+                traceback.print_exc()
+                if not self.stopping:
+                    time.sleep(REQUEUE_DELAY_SECONDS)
+                for record in batch:
+                    self.queue.put(record)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _next_batch(self):
+        """Block for the first record, then collect more until the batch is full or the interval ends"""
+        record = self.queue.get()
+        if record is None:
+            self.queue.task_done()
+            return None
+
+        batch = [record]
+        deadline = time.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                record = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if record is None:
+                # Put the stop marker back so the loop exits after this batch
+                self.queue.task_done()
+                self.queue.put(None)
+                break
+            batch.append(record)
+        return batch
+
+    def _write_batch(self, batch):
+        """
+        Write a batch, retrying with backoff. A batch that still fails after
+        MAX_WRITE_ATTEMPTS is split in half and each half written on its own, so
+        one record the database rejects can't hold up the rest; a single record
+        that can't be written goes to the spill file, to be tried again on the
+        next start.
+        """
+        attempt = 0
+        while True:
+            try:
+                start_time = time.time()
+                with self.app.app_context():
+                    db.session.execute(db.insert(QueryLog), compact_query_logs(batch))
+                    db.session.commit()
+                QUERY_LOG_WRITE_SECONDS.observe(time.time() - start_time)
+                return
+            except Exception as e:
+                attempt += 1
+                print(f"Failed to write {len(batch)} query logs (attempt {attempt}): {str(e)}")
+                traceback.print_exc()
+                with self.app.app_context():
+                    db.session.rollback()
+                if attempt >= MAX_WRITE_ATTEMPTS:
+                    if len(batch) > 1 and not self.stopping:
+                        middle = len(batch) // 2
+                        self._write_batch(batch[:middle])
+                        self._write_batch(batch[middle:])
+                    else:
+                        self._spill(batch)
+                    return
+                time.sleep(min(0.1 * 2 ** attempt, 5))
+
+    def flush(self):
+        """Block until every record submitted so far has been written"""
+        if self.thread is not None and self.pid == os.getpid():
+            self.queue.join()
+
+    def stop(self):
+        """Write all queued records and stop the background thread, spilling any it left queued"""
+        with self.lock:
+            if self.thread is None or self.pid != os.getpid():
+                return
+            thread = self.thread
+            self.thread = None
+        self.stopping = True
+        self.queue.put(None)
+        thread.join()
+        self.stopping = False
+
+        left = []
+        while True:
+            try:
+                record = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            self.queue.task_done()
+            if record is not None:
+                left.append(record)
+        if left:
+            try:
+                self._spill(left)
+            except Exception as e:
+                print(f"Lost {len(left)} query logs at shutdown: {str(e)}")
+
+    def _spill(self, batch):
+        os.makedirs(os.path.dirname(self.spill_path), exist_ok=True)
+        with open(self.spill_path, "a") as spill_file:
+            for record in batch:
+                record = dict(record)
+                if isinstance(record.get("timestamp"), datetime):
+                    record["timestamp"] = record["timestamp"].isoformat()
+                spill_file.write(json.dumps(record) + "\n")
+        print(f"Saved {len(batch)} unwritten query logs to {self.spill_path}")
+
+    def _replay_spill(self):
+        if not os.path.exists(self.spill_path):
+            return
+
+        replay_path = f"{self.spill_path}.{os.getpid()}"
+        try:
+            os.replace(self.spill_path, replay_path)
+        except FileNotFoundError:
+            # Another worker is already replaying it
+            return
+        with open(replay_path) as spill_file:
+            for line in spill_file:
+                if line.strip():
+                    record = json.loads(line)
+                    if record.get("timestamp"):
+                        record["timestamp"] = datetime.fromisoformat(record["timestamp"])
+                    self.queue.put(record)
+        os.remove(replay_path)
+
+def get_query_log_writer():
+    """The background query log writer for the current app, or None if logs are written inline"""
+    return current_app.extensions.get('query_log_writer')
+
+def init_query_log_writer(app):
+    if app.config.get('QUERY_LOG_ASYNC'):
+        app.extensions['query_log_writer'] = QueryLogWriter(
+            app,
+            batch_size=app.config['QUERY_LOG_BATCH_SIZE'],
+            flush_interval_ms=app.config['QUERY_LOG_FLUSH_INTERVAL_MS']
+        )
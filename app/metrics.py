@@ -0,0 +1,165 @@
+from contextlib import contextmanager
+import threading
+import time
+
+# Seconds; from a cache hit up to a slow CPU-only generation
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+class Histogram:
+    """
+    A Prometheus histogram with labels, rendered in the text exposition format.
+    Counts are per process.
+    """
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self.lock = threading.Lock()
+        self.series = {}  # label values -> [bucket counts, sum, count]
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = [[0] * len(self.buckets), 0.0, 0]
+                self.series[key] = series
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            series = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self.series.items())
+        for key, (counts, total, count) in series:
+            labels = [f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, key)]
+            for bound, bucket_count in zip(self.buckets, counts):
+                bucket_labels = ",".join(labels + [f'le="{_format_value(bound)}"'])
+                lines.append(f"{self.name}_bucket{{{bucket_labels}}} {bucket_count}")
+            label_text = "{" + ",".join(labels) + "}" if labels else ""
+            lines.append(f"{self.name}_sum{label_text} {_format_value(total)}")
+            lines.append(f"{self.name}_count{label_text} {count}")
+        return lines
+
+class Counter:
+    """A Prometheus counter with labels. Counts are per process."""
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            values = sorted(self.values.items())
+        for key, value in values:
+            labels = ",".join(f'{name}="{_escape(label)}"' for name, label in zip(self.labelnames, key))
+            label_text = "{" + labels + "}" if labels else ""
+            lines.append(f"{self.name}{label_text} {_format_value(value)}")
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+registry = MetricsRegistry()
+
+REQUEST_SECONDS = registry.histogram(
+    "medllm_request_duration_seconds", "Time to handle an update request", ["endpoint"]
+)
+REQUEST_STAGE_SECONDS = registry.histogram(
+    "medllm_request_stage_duration_seconds", "Time spent in each stage of an update request", ["endpoint", "stage"]
+)
+MODEL_STAGE_SECONDS = registry.histogram(
+    "medllm_model_stage_duration_seconds", "Time spent in each stage of one model's call", ["model", "stage"]
+)
+LLM_TOKENS = registry.histogram(
+    "medllm_llm_tokens", "Tokens per LLM call, from the backend's own counts", ["model", "kind"], TOKEN_BUCKETS
+)
+QUERY_LOG_WRITE_SECONDS = registry.histogram(
+    "medllm_query_log_write_seconds", "Time to write one batch of query logs"
+)
+SCHEDULER_QUEUE_WAIT_SECONDS = registry.histogram(
+    "medllm_scheduler_queue_wait_seconds", "Time LLM calls waited for a backend slot", ["backend", "priority"]
+)
+SCHEDULER_SHED_TOTAL = registry.counter(
+    "medllm_scheduler_shed_total", "LLM calls turned away because a backend was busy", ["backend", "priority", "reason"]
+)
+CHANGE_GATE_TOTAL = registry.counter(
+    "medllm_change_gate_total", "Updates run or skipped by the change-significance gate", ["decision"]
+)
+
+class StageTimer:
+    """
+    Durations in milliseconds of the named stages of one piece of work, such as
+    one model call or one request, plus any counts reported along the way
+    """
+    def __init__(self):
+        self.stages = {}
+        self.counts = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - start) * 1000)
+
+    def add(self, name, milliseconds):
+        self.stages[name] = self.stages.get(name, 0) + milliseconds
+
+    def count(self, name, value):
+        self.counts[name] = value
+
+    def to_dict(self):
+        return {name: round(milliseconds, 2) for name, milliseconds in self.stages.items()}
+
+def observe_model_timings(timer, model):
+    for stage, milliseconds in timer.stages.items():
+        MODEL_STAGE_SECONDS.observe(milliseconds / 1000, model=model, stage=stage)
+    if "prompt_eval_count" in timer.counts:
+        LLM_TOKENS.observe(timer.counts["prompt_eval_count"], model=model, kind="prompt")
+    if "eval_count" in timer.counts:
+        LLM_TOKENS.observe(timer.counts["eval_count"], model=model, kind="completion")
+
+def observe_request_timings(timer, endpoint, total_seconds):
+    REQUEST_SECONDS.observe(total_seconds, endpoint=endpoint)
+    for stage, milliseconds in timer.stages.items():
+        REQUEST_STAGE_SECONDS.observe(milliseconds / 1000, endpoint=endpoint, stage=stage)
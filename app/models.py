@@ -1,4 +1,5 @@
 from app import db
+from app.compression import decompress_text
 from datetime import datetime
 
 class Investigation(db.Model):
@@ -10,6 +11,7 @@ class Investigation(db.Model):
 
 class MedicalRecord(db.Model):
     id = db.Column(db.Integer, primary_key=True)
+    session_id = db.Column(db.String(64), nullable=True, unique=True, index=True)  # Browser session the record belongs to
     history = db.Column(db.Text, nullable=True)
     problem_list = db.Column(db.Text, nullable=True)
     recommended_questions = db.Column(db.Text, nullable=True)
@@ -26,12 +28,15 @@ class ModelConfig(db.Model):
     model_type = db.Column(db.String(20), nullable=False, default="ollama")  # "ollama" or "openai"
     model_name = db.Column(db.String(100), nullable=False)  # Actual model name (llama3.2, gpt-4, etc)
     api_key = db.Column(db.String(200), nullable=True)  # For OpenAI API
+    ollama_base_urls = db.Column(db.Text, nullable=True)  # Comma-separated Ollama nodes for this model (default: all)
+    keep_alive = db.Column(db.String(20), nullable=True)  # How long Ollama keeps the model loaded, e.g. "30m" or -1 (default: OLLAMA_KEEP_ALIVE)
     system_prompt = db.Column(db.Text, nullable=True)
     is_active = db.Column(db.Boolean, default=True)
     position = db.Column(db.Integer, default=0)  # Order in the tabs
+    tier = db.Column(db.String(20), nullable=True)  # "refine": runs in the background once the history settles, instead of on every update
     last_processing_time_ms = db.Column(db.Integer, default=0)
     
-    # Results
+    # Legacy results, shared by all sessions; results are now stored per session in ModelResult
     recommended_questions = db.Column(db.Text, nullable=True)
     recommended_investigations = db.Column(db.Text, nullable=True)
     problem_list = db.Column(db.Text, nullable=True)
@@ -39,11 +44,30 @@ class ModelConfig(db.Model):
     def __repr__(self):
         return f'<ModelConfig {self.name} ({self.model_type}:{self.model_name})>'
 
+class ModelResult(db.Model):
+    """The latest results from one model for one session"""
+    __table_args__ = (
+        db.Index('ix_model_result_session_model', 'session_id', 'model_config_id', unique=True),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    session_id = db.Column(db.String(64), nullable=False)
+    model_config_id = db.Column(db.Integer, db.ForeignKey('model_config.id'), nullable=False)
+    recommended_questions = db.Column(db.Text, nullable=True)
+    recommended_investigations = db.Column(db.Text, nullable=True)
+    problem_list = db.Column(db.Text, nullable=True)
+    processing_time_ms = db.Column(db.Integer, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<ModelResult {self.session_id} - {self.model_config_id}>'
+
 class LLMConfig(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     update_frequency = db.Column(db.Integer, default=100)  # Update every X words
     update_on_newline = db.Column(db.Boolean, default=True)  # Update on new line
     line_count_before_update = db.Column(db.Integer, default=2)  # Number of lines to wait before updating
+    min_update_interval_ms = db.Column(db.Integer, default=0)  # Minimum time between one session's LLM calls (0: no minimum)
     model_name = db.Column(db.String(100), default="llama3.2")  # Legacy field
     system_prompt = db.Column(db.Text, default="""You are a medical AI assistant. 
 Based on the patient history provided, you will:
@@ -62,19 +86,120 @@ Format your response in JSON with the following structure:
     def __repr__(self):
         return f'<LLMConfig {self.id}>'
 
+class TextBlob(db.Model):
+    """Compressed text stored once per distinct content, shared by the query logs that contain it"""
+    hash = db.Column(db.String(64), primary_key=True)  # SHA-256 of the uncompressed UTF-8 text
+    codec = db.Column(db.String(10), nullable=False)  # "zlib", "zstd" or "none"
+    data = db.Column(db.LargeBinary, nullable=False)
+    size = db.Column(db.Integer, nullable=False)  # Uncompressed size in bytes
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    @property
+    def text(self):
+        return decompress_text(self.codec, self.data)
+    
+    def __repr__(self):
+        return f'<TextBlob {self.hash[:12]} ({self.codec}, {self.size} bytes)>'
+
 class QueryLog(db.Model):
-    """Model to store all query content and LLM responses"""
+    """
+    Model to store all query content and LLM responses.
+    
+    The query text and raw response are kept in the text_blob table, shared by
+    every log with the same text (see app/blob_store.py). Logs written before
+    then keep them in their own columns until `flask logs compact` moves them;
+    the query_text and raw_response properties read from whichever is set.
+    """
     id = db.Column(db.Integer, primary_key=True)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
-    query_text = db.Column(db.Text, nullable=False)  # Patient history text
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    stored_query_text = db.Column('query_text', db.Text, nullable=False, default="")  # Only set on uncompacted logs
+    query_text_hash = db.Column(db.String(64), db.ForeignKey('text_blob.hash'), nullable=True, index=True)
+    query_preview = db.Column(db.String(100), nullable=True)  # Start of the query text, for the log list
     model_type = db.Column(db.String(20), nullable=False, default="ollama")  # Type of model
-    model_name = db.Column(db.String(100), nullable=False)  # Model used
+    model_name = db.Column(db.String(100), nullable=False, index=True)  # Model used
     recommended_questions = db.Column(db.Text, nullable=True)  # Generated questions
     recommended_investigations = db.Column(db.Text, nullable=True)  # Generated investigations
     problem_list = db.Column(db.Text, nullable=True)  # Generated problem list
-    raw_response = db.Column(db.Text, nullable=True)  # Raw LLM response
+    stored_raw_response = db.Column('raw_response', db.Text, nullable=True)  # Only set on uncompacted logs
+    raw_response_hash = db.Column(db.String(64), db.ForeignKey('text_blob.hash'), nullable=True)
     processing_time_ms = db.Column(db.Integer, nullable=True)  # Processing time in milliseconds
-    error = db.Column(db.Text, nullable=True)  # Any error message
+    error = db.Column(db.Text, nullable=True, index=True)  # Any error message
+    cache_hit = db.Column(db.Boolean, default=False)  # Served from the response cache
+    stage_timings = db.Column(db.Text, nullable=True)  # JSON: milliseconds spent in each stage of the call
+    prompt_eval_count = db.Column(db.Integer, nullable=True)  # Prompt tokens, as reported by the backend
+    eval_count = db.Column(db.Integer, nullable=True)  # Generated tokens, as reported by the backend
+    skip_reason = db.Column(db.String(200), nullable=True)  # Set if the model wasn't called because the history barely changed
+    
+    query_text_blob = db.relationship(TextBlob, foreign_keys=[query_text_hash])
+    raw_response_blob = db.relationship(TextBlob, foreign_keys=[raw_response_hash])
+    
+    @property
+    def query_text(self):
+        """Patient history text, or None if its blob is missing"""
+        if not self.query_text_hash:
+            return self.stored_query_text
+        return self.query_text_blob.text if self.query_text_blob is not None else None
+    
+    @property
+    def raw_response(self):
+        """Raw LLM response, or None if its blob is missing"""
+        if not self.raw_response_hash:
+            return self.stored_raw_response
+        return self.raw_response_blob.text if self.raw_response_blob is not None else None
+    
+    def __repr__(self):
+        return f'<QueryLog {self.id} - {self.timestamp}>'
+
+class EvaluationRun(db.Model):
+    """A batch re-evaluation of logged histories with a set of models (see app/batch_eval.py)"""
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    status = db.Column(db.String(20), nullable=False, default="pending")  # pending, running, interrupted, completed
+    model_config_ids = db.Column(db.Text, nullable=False)  # Comma-separated ids of the models being evaluated
+    source_model_name = db.Column(db.String(100), nullable=True)  # Only re-run histories logged for this model
+    source_start = db.Column(db.DateTime, nullable=True)  # Only re-run histories logged in this range
+    source_end = db.Column(db.DateTime, nullable=True)
+    include_archive = db.Column(db.Boolean, nullable=True, default=False)  # Also re-run logs moved to the archive
+    total_cases = db.Column(db.Integer, nullable=True)  # Query logs matching the filters when the run was created
+    last_query_log_id = db.Column(db.Integer, nullable=False, default=0)  # Checkpoint: logs up to here are done
+    completed_cases = db.Column(db.Integer, nullable=False, default=0)
+    skipped_cases = db.Column(db.Integer, nullable=False, default=0)  # Duplicate histories that weren't re-run
+    failed_calls = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<EvaluationRun {self.id} ({self.status})>'
+
+class EvaluationResult(db.Model):
+    """One model's output for one logged history in an evaluation run"""
+    __table_args__ = (
+        db.Index('ix_evaluation_result_run_log_model', 'run_id', 'query_log_id', 'model_config_id', unique=True),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    run_id = db.Column(db.Integer, db.ForeignKey('evaluation_run.id'), nullable=False)
+    query_log_id = db.Column(db.Integer, nullable=False)  # The log the history was taken from
+    model_config_id = db.Column(db.Integer, nullable=False)
+    model_type = db.Column(db.String(20), nullable=False)  # Copied so results outlive the model config
+    model_name = db.Column(db.String(100), nullable=False)
+    recommended_questions = db.Column(db.Text, nullable=True)
+    recommended_investigations = db.Column(db.Text, nullable=True)
+    problem_list = db.Column(db.Text, nullable=True)
+    raw_response = db.Column(db.Text, nullable=True)
+    processing_time_ms = db.Column(db.Integer, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<EvaluationResult {self.run_id} - {self.query_log_id} - {self.model_name}>'
+
+class CachedResult(db.Model):
+    """Persistent entries for the LLM response cache (LLM_CACHE_BACKEND=sqlite)"""
+    key = db.Column(db.String(64), primary_key=True)  # Hash of model, prompts and history
+    result = db.Column(db.Text, nullable=False)  # JSON encoded result fields
+    raw_response = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     
     def __repr__(self):
-        return f'<QueryLog {self.id} - {self.timestamp}>' 
\ No newline at end of file
+        return f'<CachedResult {self.key[:12]}>'
\ No newline at end of file
@@ -0,0 +1,164 @@
+from contextlib import contextmanager
+import requests
+import threading
+import time
+
+def normalize_model_name(name):
+    """Ollama reports untagged models with an explicit ':latest' tag"""
+    return name if ":" in name else f"{name}:latest"
+
+class OllamaNode:
+    """
+    One Ollama server and what the pool last learned about it
+    """
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.healthy = True
+        self.in_flight = 0
+        self.loaded_models = set()  # Models resident in memory (/api/ps)
+        self.available_models = set()  # Models pulled on the node (/api/tags)
+        self.last_checked = 0
+        self.last_error = None
+        self.checking = False  # A health check is running in the background
+
+    def to_dict(self):
+        return {
+            "base_url": self.base_url,
+            "healthy": self.healthy,
+            "in_flight": self.in_flight,
+            "loaded_models": sorted(self.loaded_models),
+            "available_models": sorted(self.available_models),
+            "last_error": self.last_error
+        }
+
+class OllamaPool:
+    """
+    Routes Ollama requests across several nodes.
+
+    Each request goes to the least-loaded healthy node, preferring nodes that
+    already have the model loaded, then nodes that have it pulled. Node health
+    and model lists are refreshed at most once per check interval per node, on a
+    background thread, so requests are ranked on what was last learned and never
+    wait on a slow node's health check. A node that refuses a connection is
+    marked unhealthy until its next check.
+
+    on_health_change, if set, is called with the number of healthy nodes
+    whenever it changes, e.g. to scale how many calls are sent at once.
+    """
+    def __init__(self, health_check_interval=15, health_check_timeout=2, base_urls=()):
+        self.health_check_interval = health_check_interval
+        self.health_check_timeout = health_check_timeout
+        self.nodes = {}
+        self.lock = threading.Lock()
+        self.on_health_change = None
+        for base_url in base_urls:
+            self.nodes[base_url] = OllamaNode(base_url)
+        # Health checks use their own session so they never wait on request retries
+        self.session = requests.Session()
+
+    def get_node(self, base_url):
+        with self.lock:
+            node = self.nodes.get(base_url)
+            if node is not None:
+                return node
+            node = OllamaNode(base_url)
+            self.nodes[base_url] = node
+        self._health_changed()
+        return node
+
+    def healthy_count(self):
+        with self.lock:
+            return sum(1 for node in self.nodes.values() if node.healthy)
+
+    def _health_changed(self):
+        if self.on_health_change is not None:
+            self.on_health_change(self.healthy_count())
+
+    def _set_health(self, node, healthy, error=None):
+        changed = node.healthy != healthy
+        node.healthy = healthy
+        node.last_error = error
+        node.last_checked = time.time()
+        if changed:
+            self._health_changed()
+
+    def check_health(self, node):
+        """
+        Refresh a node's health and its loaded and available models
+        """
+        try:
+            loaded = self.session.get(f"{node.base_url}/api/ps", timeout=self.health_check_timeout)
+            available = self.session.get(f"{node.base_url}/api/tags", timeout=self.health_check_timeout)
+            loaded.raise_for_status()
+            available.raise_for_status()
+
+            node.loaded_models = {m.get("name", m.get("model", "")) for m in loaded.json().get("models", [])}
+            node.available_models = {m.get("name", m.get("model", "")) for m in available.json().get("models", [])}
+        except (requests.RequestException, ValueError) as e:
+            self._set_health(node, False, str(e))
+            return
+        self._set_health(node, True)
+
+    def _check_in_background(self, node):
+        try:
+            self.check_health(node)
+        finally:
+            with self.lock:
+                node.checking = False
+
+    def _refresh_stale(self, nodes):
+        """Start a background check of each node whose state is older than the interval, unless one is running"""
+        now = time.time()
+        stale = []
+        with self.lock:
+            for node in nodes:
+                if not node.checking and now - node.last_checked > self.health_check_interval:
+                    node.checking = True
+                    stale.append(node)
+        for node in stale:
+            threading.Thread(
+                target=self._check_in_background, args=(node,), name="ollama-health-check", daemon=True
+            ).start()
+
+    def rank(self, model, base_urls):
+        """
+        Nodes from base_urls in the order they should be tried for a model.
+        Unhealthy nodes come last rather than being dropped, in case they have recovered.
+        """
+        nodes = [self.get_node(base_url) for base_url in base_urls]
+        if len(nodes) == 1:
+            return nodes
+
+        self._refresh_stale(nodes)
+        model = normalize_model_name(model) if model else None
+
+        def preference(indexed_node):
+            index, node = indexed_node
+            if model in node.loaded_models:
+                residency = 0
+            elif model in node.available_models:
+                residency = 1
+            else:
+                residency = 2
+            return (not node.healthy, residency, node.in_flight, index)
+
+        return [node for _, node in sorted(enumerate(nodes), key=preference)]
+
+    def mark_unhealthy(self, node, error):
+        self._set_health(node, False, str(error))
+
+    @contextmanager
+    def track(self, node):
+        """Count a request as in flight on a node for as long as the block runs"""
+        with self.lock:
+            node.in_flight += 1
+        try:
+            yield node
+        finally:
+            with self.lock:
+                node.in_flight -= 1
+
+    def status(self):
+        with self.lock:
+            nodes = list(self.nodes.values())
+        return [node.to_dict() for node in nodes]
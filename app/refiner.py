@@ -0,0 +1,105 @@
+from app.generations import RequestGenerations
+from collections import defaultdict
+import queue
+import threading
+import traceback
+
+# Events a session's listeners can fall behind by before the oldest are dropped
+MAX_PENDING_EVENTS = 100
+
+class SessionEvents:
+    """
+    Pushes events to the browser tabs listening for a session (see the
+    /update_history/events route). Each listener has its own queue; a listener
+    that stops reading loses its oldest events rather than holding memory.
+
+    Listeners are per process, so an event only reaches listeners connected to
+    the worker process that published it.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.listeners = defaultdict(list)
+
+    def subscribe(self, session_id):
+        listener = queue.Queue(MAX_PENDING_EVENTS)
+        with self.lock:
+            self.listeners[session_id].append(listener)
+        return listener
+
+    def unsubscribe(self, session_id, listener):
+        with self.lock:
+            listeners = self.listeners.get(session_id, [])
+            if listener in listeners:
+                listeners.remove(listener)
+            if not listeners:
+                self.listeners.pop(session_id, None)
+
+    def has_listeners(self, session_id):
+        with self.lock:
+            return bool(self.listeners.get(session_id))
+
+    def publish(self, session_id, event):
+        with self.lock:
+            listeners = list(self.listeners.get(session_id, []))
+        for listener in listeners:
+            while True:
+                try:
+                    listener.put_nowait(event)
+                    break
+                except queue.Full:
+                    try:
+                        listener.get_nowait()
+                    except queue.Empty:
+                        pass
+
+class Refiner:
+    """
+    Runs background work for a session once its history has settled: work
+    scheduled for a session starts after settle_seconds, unless more work is
+    scheduled for the session (or it is cancelled) in the meantime. Scheduling
+    or cancelling also supersedes the session's work already running, which
+    checks the RequestToken it is given.
+
+    Each scheduled piece of work runs on its own daemon thread. State is per process.
+    """
+    def __init__(self, settle_seconds=2.0):
+        self.settle_seconds = settle_seconds
+        self.generations = RequestGenerations()
+        self.lock = threading.Lock()
+        self.timers = {}
+
+    def schedule(self, session_id, work):
+        """Call work(token) for the session once it has settled"""
+        token = self.generations.begin(session_id)
+        timer = threading.Timer(self.settle_seconds, self._run, args=(session_id, work, token))
+        timer.daemon = True
+        with self.lock:
+            previous = self.timers.get(session_id)
+            self.timers[session_id] = timer
+        if previous:
+            previous.cancel()
+        timer.start()
+        return token
+
+    def cancel(self, session_id):
+        """Drop the session's pending work and supersede any that is running"""
+        self.generations.begin(session_id)
+        with self.lock:
+            timer = self.timers.pop(session_id, None)
+        if timer:
+            timer.cancel()
+
+    def _run(self, session_id, work, token):
+        with self.lock:
+            if self.timers.get(session_id) is threading.current_thread():
+                del self.timers[session_id]
+        if token.is_superseded():
+            return
+        try:
+            work(token)
+        except Exception:
+            traceback.print_exc()
+
+# Shared for all requests in this process
+session_events = SessionEvents()
+refiner = Refiner()
@@ -0,0 +1,246 @@
+from app.json_stream import IncrementalJSONParser
+import json
+import re
+
+RESPONSE_FIELDS = ("recommended_questions", "recommended_investigations", "problem_list")
+
+# Markdown code fences some models wrap their JSON in, despite format="json"
+CODE_FENCE = re.compile(r"```[a-zA-Z]*")
+
+CLOSERS = {"{": "}", "[": "]"}
+
+class SchemaError(ValueError):
+    """A field's value doesn't match the response schema"""
+    pass
+
+class FieldSpec:
+    """
+    One field of the response schema and how its value becomes the display string.
+    The value may be a string or a list of strings; if item_keys are given, list
+    items may also be objects, shown as their item_keys values joined with " - ".
+    """
+    def __init__(self, name, item_keys=None):
+        self.name = name
+        self.item_keys = tuple(item_keys or ())
+
+    def display(self, value):
+        """The display string for a parsed value, raising SchemaError if it doesn't fit the schema"""
+        if isinstance(value, str):
+            return value
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return str(value)
+        if not isinstance(value, list):
+            raise SchemaError(f"{self.name} should be a string or a list, not {type(value).__name__}")
+        return "\n".join(self._item(item) for item in value)
+
+    def _item(self, item):
+        if isinstance(item, str):
+            return item
+        if isinstance(item, (int, float)) and not isinstance(item, bool):
+            return str(item)
+        if isinstance(item, dict) and self.item_keys:
+            parts = [str(item[key]) for key in self.item_keys if item.get(key) not in (None, "")]
+            if not parts:
+                raise SchemaError(f"{self.name} items should have {' or '.join(self.item_keys)}")
+            return " - ".join(parts)
+        raise SchemaError(f"{self.name} items should be strings, not {type(item).__name__}")
+
+class ResponseSchema:
+    """The fields an LLM response should contain, compiled once into a lookup by name"""
+    def __init__(self, fields):
+        self.fields = tuple(fields)
+        self.specs = {spec.name: spec for spec in self.fields}
+        self.names = tuple(spec.name for spec in self.fields)
+
+    def display(self, name, value):
+        return self.specs[name].display(value)
+
+RESPONSE_SCHEMA = ResponseSchema([
+    FieldSpec("recommended_questions"),
+    FieldSpec("recommended_investigations"),
+    FieldSpec("problem_list", item_keys=("ICD10 Code", "Problem Description"))
+])
+
+class ParseResult:
+    """
+    The display strings of the fields that could be read from a response, with
+    a note for each field that couldn't. repaired is True if the text had to be
+    fixed up (code fences, trailing text, truncation) before it parsed, and
+    truncated if the output was cut off, so the last field read may be incomplete.
+    """
+    def __init__(self, fields, errors, repaired=False, truncated=False, schema=RESPONSE_SCHEMA):
+        self.fields = fields
+        self.errors = errors
+        self.repaired = repaired
+        self.truncated = truncated
+        self.schema = schema
+
+    @property
+    def complete(self):
+        return len(self.fields) == len(self.schema.names)
+
+    def to_result(self):
+        """All of the schema's fields, with an empty string for any that were lost"""
+        return {name: self.fields.get(name, "") for name in self.schema.names}
+
+    def error_message(self):
+        """None if every field was read in full, otherwise what was lost and why"""
+        if self.complete:
+            if self.truncated:
+                return "LLM response was cut off; the last field may be incomplete"
+            return None
+        if not self.fields:
+            return "Failed to parse JSON response from LLM: " + "; ".join(self.errors)
+        return (
+            f"Recovered {len(self.fields)} of {len(self.schema.names)} fields from the LLM response: "
+            + "; ".join(self.errors)
+        )
+
+def normalize_field(name, value, schema=RESPONSE_SCHEMA):
+    """The display string for one parsed field, or None if it doesn't fit the schema"""
+    try:
+        return schema.display(name, value)
+    except SchemaError:
+        return None
+
+def repair_json(text):
+    """
+    Fix the ways LLM output commonly fails to be a JSON object: code fences or
+    prose around the object, trailing commas, and output cut off part way (the
+    last incomplete value is dropped and open containers are closed).
+    Returns (repaired text, whether it was cut off), or (None, False) if there
+    is no object in the text.
+    """
+    start = text.find("{")
+    if start == -1:
+        return None, False
+
+    stack = []
+    in_string = False
+    escape = False
+    expect_key = []  # Per open container: True while an object waits for its next key
+    last_comma = None
+    drop = []  # Positions of trailing commas to remove
+    safe = start  # End of the last complete value, where a truncated object can be cut off
+    safe_stack = ""
+    scalar = False
+
+    pos = start
+    length = len(text)
+    while pos < length:
+        char = text[pos]
+        if in_string:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+                if expect_key[-1]:
+                    expect_key[-1] = False
+                else:
+                    safe, safe_stack = pos + 1, "".join(stack)
+            pos += 1
+            continue
+
+        if scalar and (char in ",}]" or char.isspace()):
+            scalar = False
+            safe, safe_stack = pos, "".join(stack)
+
+        if char == '"':
+            in_string = True
+            last_comma = None
+        elif char in "{[":
+            stack.append(CLOSERS[char])
+            expect_key.append(char == "{")
+            last_comma = None
+            safe, safe_stack = pos + 1, "".join(stack)
+        elif char in "}]":
+            if last_comma is not None:
+                drop.append(last_comma)
+                last_comma = None
+            stack.pop()
+            expect_key.pop()
+            if not stack:
+                return _without(text[start:pos + 1], drop, start), False
+            safe, safe_stack = pos + 1, "".join(stack)
+        elif char == ",":
+            last_comma = pos
+            if stack[-1] == "}":
+                expect_key[-1] = True
+        elif not char.isspace() and char != ":":
+            scalar = True
+            last_comma = None
+        pos += 1
+
+    # Cut off part way: keep everything up to the last complete value and close what is still open
+    repaired = _without(text[start:safe], [p for p in drop if p < safe], start)
+    return repaired + "".join(reversed(safe_stack)), True
+
+def _without(text, positions, offset):
+    """Remove the characters at the given absolute positions from text, which starts at offset"""
+    for position in reversed(positions):
+        index = position - offset
+        text = text[:index] + text[index + 1:]
+    return text
+
+def _loads_object(text):
+    try:
+        value = json.loads(text)
+    except (json.JSONDecodeError, RecursionError):
+        return None
+    return value if isinstance(value, dict) else None
+
+def _unwrap(parsed, schema):
+    """Look inside an object that holds the response under a single key, e.g. {"response": {...}}"""
+    if len(parsed) == 1 and not any(name in parsed for name in schema.names):
+        value = next(iter(parsed.values()))
+        if isinstance(value, dict):
+            return value
+    return parsed
+
+def parse_llm_response(raw_response, schema=RESPONSE_SCHEMA):
+    """
+    Read the response fields from an LLM's raw output, recovering as many as possible.
+
+    Well-formed JSON is parsed directly. Otherwise the text is repaired (see
+    repair_json) and parsed again, and if it still isn't valid JSON, each
+    top-level field that is complete and valid on its own is salvaged. Fields
+    that are missing or don't fit the schema are left out and noted in errors.
+    """
+    errors = []
+    repaired = False
+    truncated = False
+    parsed = _loads_object(raw_response) if raw_response else None
+
+    if parsed is None and raw_response:
+        repaired = True
+        text = CODE_FENCE.sub("", raw_response)
+        fixed, truncated = repair_json(text)
+        parsed = _loads_object(fixed) if fixed is not None else None
+
+        if parsed is None:
+            # Take the fields that parse individually and skip the rest
+            salvager = IncrementalJSONParser(fields=schema.names)
+            salvager.feed(text)
+            parsed = salvager.completed
+            if not parsed:
+                errors.append("no JSON object found" if fixed is None else "response is not valid JSON")
+
+    if parsed:
+        parsed = _unwrap(parsed, schema)
+
+    fields = {}
+    for name in schema.names:
+        if name not in (parsed or {}):
+            if parsed:
+                errors.append(f"{name} is missing")
+            continue
+        try:
+            fields[name] = schema.display(name, parsed[name])
+        except SchemaError as e:
+            errors.append(str(e))
+
+    if not raw_response:
+        errors.append("response is empty")
+    return ParseResult(fields, errors, repaired, truncated, schema)
@@ -1,12 +1,31 @@
-from flask import Blueprint, render_template, request, jsonify, redirect, url_for
-from app.models import Investigation, MedicalRecord, LLMConfig, QueryLog, ModelConfig
+from flask import Blueprint, render_template, request, jsonify, redirect, url_for, Response, stream_with_context, session, current_app, abort
+from app.models import Investigation, MedicalRecord, LLMConfig, QueryLog, ModelConfig, ModelResult
 from app import db
-from app.services import process_medical_history
+from app.database import insert_on_conflict
+from app.services import iter_medical_history_events, iter_medical_history_results, get_active_model_configs, ollama_client, investigation_catalogue, warm_models, get_model_warm_status, get_model_results, RESPONSE_FIELDS, change_gate_context, log_skipped_update, split_model_tiers
+from app.generations import request_generations, RequestSuperseded
+from app.coalescer import update_coalescer
+from app.change_gate import change_gate
+from app.scheduler import llm_scheduler, SchedulerBusy, BACKGROUND
+from app.refiner import refiner, session_events
+from app.log_queries import query_log_summaries, summary_to_dict
+from app.archive import archived_log_summaries, find_archived_log
+from app.metrics import StageTimer, observe_request_timings, registry, CHANGE_GATE_TOTAL
+from datetime import datetime, timedelta
+import json
+import queue
+import re
+import time
+import uuid
 
 main_bp = Blueprint('main', __name__)
 
 @main_bp.route('/')
 def index():
+    # Each page load is a new encounter, unless the page reopens one (?encounter_id=..., e.g. on reload)
+    encounter_id = _valid_encounter_id(request.args.get('encounter_id')) or uuid.uuid4().hex[:ENCOUNTER_ID_LENGTH]
+    session_id = _get_session_id(encounter_id)
+    
     # Get all investigations for display
     investigations = Investigation.query.all()
     
@@ -17,8 +36,8 @@ def index():
         db.session.add(config)
         db.session.commit()
     
-    # Get or create a medical record
-    record = MedicalRecord.query.first()
+    # This session's medical record; it's saved on the first update
+    record = MedicalRecord.query.filter_by(session_id=session_id).first()
     if not record:
         record = MedicalRecord(
             history="",
@@ -26,15 +45,9 @@ def index():
             recommended_questions="",
             recommended_investigations=""
         )
-        db.session.add(record)
-        db.session.commit()
     
     # Get all model configurations
     model_configs = ModelConfig.query.order_by(ModelConfig.position).all()
-    if not model_configs:
-        from app.services import init_services
-        init_services()
-        model_configs = ModelConfig.query.order_by(ModelConfig.position).all()
     
     # Get a list of available model types
     model_options = {
@@ -44,29 +57,69 @@ def index():
     
     return render_template('index.html', 
                            investigations=investigations,
+                           encounter_id=encounter_id,
                            record=record,
                            config=config,
                            model_configs=model_configs,
+                           model_results=get_model_results(session_id),
                            model_options=model_options)
 
-@main_bp.route('/update_history', methods=['POST'])
-def update_history():
-    data = request.json
-    history_text = data.get('history', '')
-    
-    # Get the current record or create one
-    record = MedicalRecord.query.first()
+# Hex digits in the encounter id each page load is given
+ENCOUNTER_ID_LENGTH = 16
+ENCOUNTER_ID = re.compile(r'^[0-9a-f]{%d}$' % ENCOUNTER_ID_LENGTH)
+
+def _valid_encounter_id(value):
+    return value if isinstance(value, str) and ENCOUNTER_ID.match(value) else None
+
+def _get_session_id(encounter_id=None):
+    """
+    Identify the encounter (one patient, open in one page) a request belongs to,
+    so its record, results and requests are kept apart from the other pages open
+    in the same browser. Pages send the encounter id they were given with each
+    request; it is scoped to the browser's session cookie, so another browser
+    can't open the encounter. Requests without one share the browser session's.
+    """
+    if 'session_id' not in session:
+        session['session_id'] = uuid.uuid4().hex
+    if encounter_id is None:
+        data = request.get_json(silent=True) if request.is_json else None
+        encounter_id = (data or {}).get('encounter_id') or request.args.get('encounter_id')
+    encounter_id = _valid_encounter_id(encounter_id)
+    if encounter_id:
+        return f"{session['session_id']}-{encounter_id}"
+    return session['session_id']
+
+def _begin_request():
+    """Start a new request generation for this session, superseding any in flight"""
+    session_id = _get_session_id()
+    if not current_app.config.get('LLM_CANCEL_SUPERSEDED'):
+        return None
+    return request_generations.begin(session_id)
+
+def _get_medical_record(history_text, session_id):
+    """
+    Get the session's record or create one, and update the history.
+    Called once the models have finished, so the record's row isn't held
+    locked by the update while waiting on the LLM.
+    """
+    record = MedicalRecord.query.filter_by(session_id=session_id).first()
     if not record:
-        record = MedicalRecord()
-        db.session.add(record)
+        insert = insert_on_conflict(db.engine.dialect.name)
+        if insert is not None:
+            # Another request for the session may create the record first; use that one if so
+            db.session.execute(
+                insert(MedicalRecord).values(session_id=session_id).on_conflict_do_nothing(index_elements=['session_id'])
+            )
+            record = MedicalRecord.query.filter_by(session_id=session_id).one()
+        else:
+            record = MedicalRecord(session_id=session_id)
+            db.session.add(record)
     
-    # Update the history
     record.history = history_text
-    
-    # Process with LLM
-    result = process_medical_history(history_text)
-    
-    # Update recommendations without completely replacing previous data
+    return record
+
+def _update_record_recommendations(record, result):
+    """Update recommendations without completely replacing previous data"""
     if result.get('recommended_questions'):
         record.recommended_questions = result.get('recommended_questions')
     
@@ -75,34 +128,420 @@ def update_history():
     
     if result.get('problem_list'):
         record.problem_list = result.get('problem_list')
-    
-    db.session.commit()
-    
-    # Get all model results
+
+def _model_result_data(model, result, processing_time_ms):
+    """JSON-ready results for one model tab"""
+    return {
+        'id': model.id,
+        'name': model.name,
+        'model_type': model.model_type,
+        'model_name': model.model_name,
+        'recommended_questions': result.get('recommended_questions'),
+        'recommended_investigations': result.get('recommended_investigations'),
+        'problem_list': result.get('problem_list'),
+        'processing_time_ms': processing_time_ms
+    }
+
+def _record_data(record):
+    return {
+        'recommended_questions': record.recommended_questions,
+        'recommended_investigations': record.recommended_investigations,
+        'problem_list': record.problem_list
+    }
+
+def _min_update_interval():
+    """Seconds a session must wait between LLM updates, from the LLM config"""
+    config = LLMConfig.query.first()
+    return (config.min_update_interval_ms or 0) / 1000 if config else 0
+
+def _interval_wait(session_id):
+    """
+    The before_dispatch hook that spaces the session's LLM calls at least the
+    minimum update interval apart, or None if there is no minimum. Updates the
+    change gate or the cache answer never call it, so never wait.
+    """
+    min_interval = _min_update_interval()
+    if min_interval <= 0:
+        return None
+    return lambda cancel_check: update_coalescer.wait_for_interval(session_id, min_interval, cancel_check)
+
+def _superseded_response():
+    return {'success': False, 'superseded': True, 'error': 'Superseded by a newer request'}
+
+def _busy_response():
+    return {'success': False, 'busy': True, 'error': 'The LLM service is busy, please try again shortly'}
+
+def _update_response_data(record, model_results):
+    """The record's summary and the model results, with the history they answer"""
+    return dict(_record_data(record), history=record.history, model_results=model_results)
+
+def _stored_model_results(session_id, model_configs, stored_results=None):
+    """The session's latest result for each model, as model tab data"""
     model_results = []
-    model_configs = ModelConfig.query.filter_by(is_active=True).order_by(ModelConfig.position).all()
+    if stored_results is None:
+        stored_results = get_model_results(session_id)
     for model in model_configs:
-        model_results.append({
-            'id': model.id,
-            'name': model.name,
-            'model_type': model.model_type,
-            'model_name': model.model_name,
-            'recommended_questions': model.recommended_questions,
-            'recommended_investigations': model.recommended_investigations,
-            'problem_list': model.problem_list,
-            'processing_time_ms': model.last_processing_time_ms
+        stored = stored_results.get(model.id)
+        result_fields = {field: getattr(stored, field) for field in RESPONSE_FIELDS} if stored else {}
+        model_results.append(_model_result_data(model, result_fields, stored.processing_time_ms if stored else None))
+    return model_results
+
+def _check_change_gate(history_text, session_id, model_configs, timings):
+    """
+    Ask the change gate whether the models need to run on this history.
+    Returns (gate context to record once they have, GateDecision), or (None, None)
+    if the gate is off.
+    """
+    if not current_app.config.get('LLM_CHANGE_GATE'):
+        return None, None
+    with timings.stage('change_gate'):
+        context = change_gate_context(model_configs)
+        decision = change_gate.check(session_id, history_text, context)
+    CHANGE_GATE_TOTAL.inc(decision='run' if decision.significant else 'skipped')
+    return context, decision
+
+def _skip_update(history_text, session_id, model_configs, skipped_configs, reason, timings):
+    """
+    Answer an update the change gate skipped with the session's previous results,
+    logging the skip for the models that weren't called. The record keeps the new
+    history so it isn't lost on reload. Returns the response data.
+    """
+    stored_results = get_model_results(session_id)
+    log_skipped_update(history_text, skipped_configs, stored_results, reason)
+    with timings.stage('record_commit'):
+        record = _get_medical_record(history_text, session_id)
+        db.session.commit()
+    return _update_response_data(record, _stored_model_results(session_id, model_configs, stored_results))
+
+def _refine(history_text, session_id, model_config_ids, token):
+    """
+    Run the refine-tier models on a settled history at background priority,
+    pushing each result to the session's listeners as it arrives. The first
+    refine model's answer then replaces the fast models' answer in the record,
+    unless the history has changed since.
+    """
+    model_configs = (
+        ModelConfig.query
+        .filter(ModelConfig.id.in_(model_config_ids), ModelConfig.is_active.is_(True))
+        .order_by(ModelConfig.position)
+        .all()
+    )
+    if not model_configs:
+        return
+    
+    # The refine models have their own baseline, kept under a separate key
+    gate_key = ('refine', session_id)
+    gate_context = None
+    if current_app.config.get('LLM_CHANGE_GATE'):
+        gate_context = change_gate_context(model_configs)
+        if not change_gate.check(gate_key, history_text, gate_context).significant:
+            return
+    
+    session_events.publish(session_id, {'type': 'refining', 'model_ids': [model.id for model in model_configs]})
+    results = {}
+    errors = {}
+    for model, result, error_message, _, processing_time_ms in iter_medical_history_results(
+            history_text, model_configs, token, session_id, priority=BACKGROUND):
+        results[model.id] = result
+        errors[model.id] = error_message
+        session_events.publish(session_id, {
+            'type': 'model_result', 'data': _model_result_data(model, result, processing_time_ms),
+            'error': error_message, 'refined': True
         })
     
+    token.check()
+    record = MedicalRecord.query.filter_by(session_id=session_id).first()
+    if record and record.history == history_text and errors[model_configs[0].id] is None:
+        _update_record_recommendations(record, results[model_configs[0].id])
+    db.session.commit()
+    
+    if gate_context is not None and not any(errors.values()):
+        change_gate.record(gate_key, history_text, gate_context)
+    session_events.publish(session_id, {'type': 'refined', 'data': _record_data(record) if record else None})
+
+def _schedule_refinement(history_text, session_id, refine_configs):
+    """Refine the history in the background once the session stops sending updates"""
+    if not refine_configs:
+        return
+    app = current_app._get_current_object()
+    model_config_ids = [model.id for model in refine_configs]
+    
+    def refine(token):
+        with app.app_context():
+            try:
+                _refine(history_text, session_id, model_config_ids, token)
+            except RequestSuperseded:
+                pass
+            except SchedulerBusy:
+                session_events.publish(session_id, dict(_busy_response(), type='refine_busy', model_ids=model_config_ids))
+    
+    refiner.schedule(session_id, refine)
+
+def _begin_tiered_update(session_id):
+    """
+    The session's active models, split into those answering this update and those
+    refining later. Refinement of an older history is called off, freeing the
+    backend for this update.
+    """
+    model_configs = get_active_model_configs()
+    interactive_configs, refine_configs = split_model_tiers(model_configs)
+    if refine_configs:
+        refiner.cancel(session_id)
+    return model_configs, interactive_configs, refine_configs
+
+def _process_update(history_text, session_id, timings, before_dispatch=None):
+    """
+    Run the models on the history and save the session's record. Returns the
+    response data. Refine-tier models are left to run once the history settles.
+    before_dispatch is passed on to iter_medical_history_events.
+    """
+    model_configs, interactive_configs, refine_configs = _begin_tiered_update(session_id)
+    gate_context, decision = _check_change_gate(history_text, session_id, interactive_configs, timings)
+    if decision and not decision.significant:
+        response_data = _skip_update(
+            history_text, session_id, model_configs, interactive_configs, decision.reason, timings
+        )
+        _schedule_refinement(history_text, session_id, refine_configs)
+        return response_data
+    
+    request_token = _begin_request()
+    results = {}
+    failed = False
+    for model, result, error_message, _, _ in iter_medical_history_results(
+            history_text, interactive_configs, request_token, session_id, timings, before_dispatch=before_dispatch):
+        results[model.id] = result
+        failed = failed or error_message is not None
+    
+    with timings.stage('record_commit'):
+        record = _get_medical_record(history_text, session_id)
+        # The first model by tab position drives the record (for backward compatibility)
+        _update_record_recommendations(record, results[interactive_configs[0].id])
+        db.session.commit()
+    
+    # Only a history every model answered is a baseline worth skipping small edits against
+    if gate_context is not None and not failed:
+        change_gate.record(session_id, history_text, gate_context)
+    _schedule_refinement(history_text, session_id, refine_configs)
+    
+    return _update_response_data(record, _stored_model_results(session_id, model_configs))
+
+@main_bp.route('/update_history', methods=['POST'])
+def update_history():
+    """
+    Run all active models on the history.
+    
+    With LLM_COALESCE_UPDATES, updates from one session run one at a time: an
+    update arriving while another runs waits, and only the latest text is run
+    once the slot frees up. Waiting callers whose text that latest text starts
+    with get its result; the others get a superseded response. The response's
+    history is the text the results answer.
+    """
+    start_time = time.time()
+    timings = StageTimer()
+    data = request.json
+    history_text = data.get('history', '')
+    session_id = _get_session_id()
+    
+    # The history hasn't settled, so any refinement of it is out of date
+    refiner.cancel(session_id)
+    
+    try:
+        if current_app.config.get('LLM_COALESCE_UPDATES'):
+            # Cancel the session's update in flight (if enabled) so the slot frees up for this text sooner
+            _begin_request()
+            before_dispatch = _interval_wait(session_id)
+            response_data = update_coalescer.run(
+                session_id, history_text, lambda text: _process_update(text, session_id, timings, before_dispatch),
+                retry_on=(RequestSuperseded,)
+            )
+        else:
+            response_data = _process_update(history_text, session_id, timings)
+    except RequestSuperseded:
+        return jsonify(_superseded_response())
+    except SchedulerBusy:
+        return jsonify(_busy_response()), 503
+    
+    observe_request_timings(timings, 'update_history', time.time() - start_time)
     return jsonify({
         'success': True,
-        'data': {
-            'recommended_questions': record.recommended_questions,
-            'recommended_investigations': record.recommended_investigations,
-            'problem_list': record.problem_list,
-            'model_results': model_results
-        }
+        'data': response_data
     })
 
+def _stream_update(history_text, session_id, timings, before_dispatch=None):
+    """
+    Run all models on the history, yielding NDJSON 'field' and 'model_result' lines,
+    then save the session's record. Returns the same response data as update_history.
+    """
+    model_configs, interactive_configs, refine_configs = _begin_tiered_update(session_id)
+    gate_context, decision = _check_change_gate(history_text, session_id, interactive_configs, timings)
+    if decision and not decision.significant:
+        response_data = _skip_update(
+            history_text, session_id, interactive_configs, interactive_configs, decision.reason, timings
+        )
+        for model_result in response_data['model_results']:
+            yield json.dumps({'type': 'model_result', 'data': model_result, 'error': None, 'history': history_text}) + '\n'
+        _schedule_refinement(history_text, session_id, refine_configs)
+        return response_data
+    
+    request_token = _begin_request()
+    main_result = None
+    model_results = {}
+    failed = False
+    events = iter_medical_history_events(
+        history_text, interactive_configs, stream_fields=True, request_token=request_token, session_id=session_id,
+        timings=timings, before_dispatch=before_dispatch
+    )
+    
+    for event in events:
+        if event[0] == 'field':
+            _, model, field, value = event
+            yield json.dumps({'type': 'field', 'model_id': model.id, 'field': field, 'value': value}) + '\n'
+            continue
+        
+        _, model, result, error_message, _, processing_time_ms = event
+        
+        # The first model by tab position drives the record (for backward compatibility)
+        if model.id == interactive_configs[0].id:
+            main_result = result
+        
+        failed = failed or error_message is not None
+        model_results[model.id] = _model_result_data(model, result, processing_time_ms)
+        yield json.dumps({
+            'type': 'model_result', 'data': model_results[model.id], 'error': error_message, 'history': history_text
+        }) + '\n'
+    
+    with timings.stage('record_commit'):
+        record = _get_medical_record(history_text, session_id)
+        _update_record_recommendations(record, main_result)
+        db.session.commit()
+    
+    if gate_context is not None and not failed:
+        change_gate.record(session_id, history_text, gate_context)
+    _schedule_refinement(history_text, session_id, refine_configs)
+    
+    return _update_response_data(record, [model_results[model.id] for model in model_configs if model.id in model_results])
+
+@main_bp.route('/update_history/stream', methods=['POST'])
+def update_history_stream():
+    """
+    Streaming variant of update_history.
+    
+    Responds with newline-delimited JSON: 'field' events as each model generates
+    each output field, one 'model_result' event per model as soon as that model
+    has finished, then a final 'done' event with the record summary, or a
+    'superseded' or 'busy' event if the update was abandoned.
+    
+    Updates are coalesced as in update_history. A caller answered by another
+    caller's update gets just the 'model_result' and 'done' events. Each
+    'model_result' event and the 'done' event's data carry the history they
+    answer.
+    """
+    start_time = time.time()
+    timings = StageTimer()
+    data = request.json
+    history_text = data.get('history', '')
+    session_id = _get_session_id()
+    coalesce = current_app.config.get('LLM_COALESCE_UPDATES')
+    before_dispatch = _interval_wait(session_id) if coalesce else None
+    # The history hasn't settled, so any refinement of it is out of date
+    refiner.cancel(session_id)
+    if coalesce:
+        # Cancel the session's update in flight (if enabled) so the slot frees up for this text sooner
+        _begin_request()
+    
+    def done_line(response_data):
+        record_data = {key: value for key, value in response_data.items() if key != 'model_results'}
+        return json.dumps({'type': 'done', 'success': True, 'data': record_data}) + '\n'
+    
+    def generate():
+        if not coalesce:
+            try:
+                response_data = yield from _stream_update(history_text, session_id, timings)
+            except RequestSuperseded:
+                yield json.dumps(dict(_superseded_response(), type='superseded')) + '\n'
+                return
+            except SchedulerBusy:
+                yield json.dumps(dict(_busy_response(), type='busy')) + '\n'
+                return
+            observe_request_timings(timings, 'update_history_stream', time.time() - start_time)
+            yield done_line(response_data)
+            return
+        
+        ticket = update_coalescer.join(session_id, history_text)
+        while update_coalescer.next_turn(ticket):
+            response_data = None
+            try:
+                response_data = yield from _stream_update(ticket.text, session_id, timings, before_dispatch)
+            except RequestSuperseded:
+                if update_coalescer.has_newer(ticket):
+                    continue
+                yield json.dumps(dict(_superseded_response(), type='superseded')) + '\n'
+                return
+            except SchedulerBusy:
+                yield json.dumps(dict(_busy_response(), type='busy')) + '\n'
+                return
+            finally:
+                # Also runs if the client disconnects mid-stream, so waiting callers can take over
+                if response_data is None:
+                    update_coalescer.release(ticket)
+                else:
+                    update_coalescer.finish(ticket, response_data)
+            if not ticket.covered:
+                # Ran on newer, edited text that arrived while this caller waited for the slot
+                yield json.dumps(dict(_superseded_response(), type='superseded')) + '\n'
+                return
+            observe_request_timings(timings, 'update_history_stream', time.time() - start_time)
+            yield done_line(response_data)
+            return
+        
+        if not ticket.covered:
+            yield json.dumps(dict(_superseded_response(), type='superseded')) + '\n'
+            return
+        
+        # Answered by an update run for another caller in this session, on text that starts with this caller's
+        for model_result in ticket.value['model_results']:
+            yield json.dumps({
+                'type': 'model_result', 'data': model_result, 'error': None, 'history': ticket.value['history']
+            }) + '\n'
+        yield done_line(ticket.value)
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+# Seconds between comment lines on an idle event stream
+SSE_KEEPALIVE_SECONDS = 15
+
+@main_bp.route('/update_history/events')
+def update_history_events():
+    """
+    Server-sent events for this session's background refinements: 'refining'
+    when the refine-tier models start on a settled history, a 'model_result' per
+    model as it finishes, then 'refined' with the record's updated summary (or
+    'refine_busy' if the scheduler turned the work away).
+    
+    Pass the page's encounter_id as a query argument. Events are published by
+    the worker process that ran the update, so they only arrive here if this
+    request reached the same process.
+    """
+    session_id = _get_session_id()
+    
+    def generate():
+        listener = session_events.subscribe(session_id)
+        try:
+            yield ': connected\n\n'
+            while True:
+                try:
+                    event = listener.get(timeout=SSE_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    # Keeps proxies from closing an idle connection, and notices a client that has gone
+                    yield ': keep-alive\n\n'
+                    continue
+                yield f'data: {json.dumps(event)}\n\n'
+        finally:
+            session_events.unsubscribe(session_id, listener)
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @main_bp.route('/update_config', methods=['POST'])
 def update_config():
     data = request.json
@@ -121,6 +560,9 @@ def update_config():
     if 'line_count_before_update' in data:
         config.line_count_before_update = int(data['line_count_before_update'])
     
+    if 'min_update_interval_ms' in data:
+        config.min_update_interval_ms = max(int(data['min_update_interval_ms']), 0)
+    
     if 'model_name' in data:
         config.model_name = data['model_name']
         
@@ -135,6 +577,7 @@ def update_config():
             'update_frequency': config.update_frequency,
             'update_on_newline': config.update_on_newline,
             'line_count_before_update': config.line_count_before_update,
+            'min_update_interval_ms': config.min_update_interval_ms,
             'model_name': config.model_name,
             'system_prompt': config.system_prompt
         }
@@ -154,21 +597,34 @@ def manage_models():
                 model_name=data.get('model_name', 'llama3.2'),
                 system_prompt=data.get('system_prompt', ''),
                 api_key=data.get('api_key', ''),
+                ollama_base_urls=data.get('ollama_base_urls', '').strip() or None,
+                keep_alive=data.get('keep_alive', '').strip() or None,
+                tier=data.get('tier') or None,
                 position=ModelConfig.query.count(),
                 is_active=bool(data.get('is_active', False))
             )
             db.session.add(new_model)
             db.session.commit()
             
+            if new_model.is_active:
+                warm_models([new_model])
+            
         elif action == 'update':
             model_id = int(data.get('id'))
             model = ModelConfig.query.get(model_id)
             if model:
+                was_active = model.is_active
                 model.name = data.get('name', model.name)
                 model.model_type = data.get('model_type', model.model_type)
                 model.model_name = data.get('model_name', model.model_name)
                 model.system_prompt = data.get('system_prompt', model.system_prompt)
                 model.is_active = 'is_active' in data
+                if 'ollama_base_urls' in data:
+                    model.ollama_base_urls = data.get('ollama_base_urls').strip() or None
+                if 'keep_alive' in data:
+                    model.keep_alive = data.get('keep_alive').strip() or None
+                if 'tier' in data:
+                    model.tier = data.get('tier') or None
                 
                 # Only update API key if provided and not empty
                 new_api_key = data.get('api_key', '')
@@ -177,10 +633,15 @@ def manage_models():
                 
                 db.session.commit()
                 
+                # Load the model now rather than on the first request after activating it
+                if model.is_active and not was_active:
+                    warm_models([model])
+                
         elif action == 'delete':
             model_id = int(data.get('id'))
             model = ModelConfig.query.get(model_id)
             if model:
+                ModelResult.query.filter_by(model_config_id=model.id).delete()
                 db.session.delete(model)
                 db.session.commit()
                 
@@ -216,6 +677,22 @@ def manage_models():
                            model_configs=model_configs,
                            model_options=model_options)
 
+@main_bp.route('/models/status')
+def models_status():
+    # Whether each active Ollama model is loaded (warm) on its nodes
+    return jsonify({
+        'success': True,
+        'data': get_model_warm_status()
+    })
+
+@main_bp.route('/ollama/nodes')
+def ollama_nodes():
+    # Health, load and loaded models for each Ollama node the pool has used
+    return jsonify({
+        'success': True,
+        'data': ollama_client.pool.status()
+    })
+
 @main_bp.route('/investigations', methods=['GET', 'POST'])
 def manage_investigations():
     if request.method == 'POST':
@@ -229,6 +706,7 @@ def manage_investigations():
                 new_investigation = Investigation(name=name)
                 db.session.add(new_investigation)
                 db.session.commit()
+                investigation_catalogue.invalidate()
                 return jsonify({'success': True, 'id': new_investigation.id, 'name': name})
             return jsonify({'success': False, 'error': 'Investigation already exists'})
         
@@ -241,14 +719,109 @@ def manage_investigations():
         'data': [{'id': inv.id, 'name': inv.name} for inv in investigations]
     })
 
+LOGS_PAGE_SIZE = 50
+LOGS_MAX_PAGE_SIZE = 200
+
+def _parse_log_date(value, end=False):
+    """Parse an ISO date or datetime filter. A bare end date includes that whole day."""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if end and len(value) == 10:
+        parsed += timedelta(days=1)
+    return parsed
+
+def _log_query_args(args):
+    """Filters, cursor and page size for query_log_summaries from request args. Raises ValueError on bad input."""
+    has_error = args.get('error', '').lower()
+    if has_error in ('1', 'true', 'yes'):
+        has_error = True
+    elif has_error in ('0', 'false', 'no'):
+        has_error = False
+    elif has_error:
+        raise ValueError("error must be true or false")
+    else:
+        has_error = None
+    
+    limit = min(max(int(args.get('limit', LOGS_PAGE_SIZE)), 1), LOGS_MAX_PAGE_SIZE)
+    
+    return {
+        'model_name': args.get('model') or None,
+        'start': _parse_log_date(args.get('start')),
+        'end': _parse_log_date(args.get('end'), end=True),
+        'has_error': has_error,
+        'cursor': args.get('cursor') or None,
+        'limit': limit
+    }
+
+def _log_page(args):
+    """One page of logs from the database, or from the archive with source=archive. Raises ValueError on bad input."""
+    query_args = _log_query_args(args)
+    source = args.get('source') or 'live'
+    if source == 'archive':
+        return archived_log_summaries(**query_args)
+    if source != 'live':
+        raise ValueError("source must be live or archive")
+    return query_log_summaries(**query_args)
+
 @main_bp.route('/logs')
 def view_logs():
-    # Get query logs ordered by timestamp (newest first)
-    logs = QueryLog.query.order_by(QueryLog.timestamp.desc()).all()
-    return render_template('logs.html', logs=logs)
+    # One page of logs (newest first), loading only the columns the table shows
+    try:
+        logs, next_cursor = _log_page(request.args)
+    except ValueError:
+        return redirect(url_for('main.view_logs'))
+    
+    # Links to the next page keep the current filters
+    filters = {key: value for key, value in request.args.items() if key != 'cursor' and value}
+    model_names = [row.model_name for row in db.session.query(QueryLog.model_name).distinct().order_by(QueryLog.model_name)]
+    return render_template('logs.html', logs=logs, next_cursor=next_cursor, filters=filters,
+                           model_names=model_names, first_page=not request.args.get('cursor'),
+                           archived=request.args.get('source') == 'archive')
+
+@main_bp.route('/api/logs')
+def api_logs():
+    """
+    Query log summaries as JSON, newest first.
+    Filters: model, start, end (ISO dates), error (true/false); source=archive lists archived logs instead.
+    Pass next_cursor back as cursor for the next page.
+    """
+    try:
+        logs, next_cursor = _log_page(request.args)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': f'Invalid query: {str(e)}'}), 400
+    
+    return jsonify({
+        'success': True,
+        'logs': [summary_to_dict(row) for row in logs],
+        'next_cursor': next_cursor
+    })
 
 @main_bp.route('/logs/<int:log_id>')
 def view_log_detail(log_id):
     # Get specific log entry
     log = QueryLog.query.get_or_404(log_id)
-    return render_template('log_detail.html', log=log) 
\ No newline at end of file
+    stage_timings = json.loads(log.stage_timings) if log.stage_timings else {}
+    return render_template('log_detail.html', log=log, stage_timings=stage_timings)
+
+@main_bp.route('/logs/archive/<day>/<int:log_id>')
+def view_archived_log_detail(day, log_id):
+    # Archived logs are found by id within their day's partition
+    try:
+        log = find_archived_log(log_id, datetime.strptime(day, '%Y-%m-%d').date())
+    except ValueError:
+        log = None
+    if log is None:
+        abort(404)
+    stage_timings = json.loads(log.stage_timings) if log.stage_timings else {}
+    return render_template('log_detail.html', log=log, stage_timings=stage_timings)
+
+@main_bp.route('/metrics')
+def metrics():
+    """Stage latency and token histograms in the Prometheus text format (for this worker process)"""
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+@main_bp.route('/scheduler')
+def scheduler_status():
+    """Each LLM backend's concurrency limit, calls in flight and queued calls (for this worker process)"""
+    return jsonify({'success': True, 'backends': llm_scheduler.status()}) 
\ No newline at end of file
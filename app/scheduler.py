@@ -0,0 +1,179 @@
+from app.generations import RequestSuperseded
+from app.metrics import SCHEDULER_QUEUE_WAIT_SECONDS, SCHEDULER_SHED_TOTAL
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+import threading
+import time
+
+# Job priorities, highest first
+INTERACTIVE = 0  # A clinician waiting on the result
+BACKGROUND = 1  # Re-runs, comparisons and batch evaluation
+
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+class SchedulerBusy(Exception):
+    """Raised when a job is turned away because the backend's queue is full or the wait ran out"""
+    pass
+
+class _Waiter:
+    def __init__(self):
+        self.event = threading.Event()
+        self.granted = False
+
+class _BackendQueue:
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        # Per priority, each user's waiting jobs, in the order users take turns
+        self.queues = {INTERACTIVE: OrderedDict(), BACKGROUND: OrderedDict()}
+
+    def depth(self):
+        return sum(len(jobs) for users in self.queues.values() for jobs in users.values())
+
+class LLMScheduler:
+    """
+    Admission control for LLM calls.
+
+    Each backend runs at most its concurrency limit of calls at once; the rest
+    queue. When a slot frees up, interactive jobs go before background jobs, and
+    within a priority users take turns, so one user with many jobs can't hold up
+    everyone else. Once a backend's queue reaches max_queue_depth, new jobs are
+    turned away with SchedulerBusy (background jobs at half that depth, so they
+    are shed first), as is a job that has waited longer than queue_timeout seconds.
+    """
+    def __init__(self, limits=None, default_limit=4, max_queue_depth=32, queue_timeout=60):
+        self.limits = dict(limits or {})
+        self.default_limit = default_limit
+        self.max_queue_depth = max_queue_depth
+        self.queue_timeout = queue_timeout
+        self.lock = threading.Lock()
+        self.backends = {}
+
+    def configure(self, limits, max_queue_depth, queue_timeout):
+        with self.lock:
+            self.limits = dict(limits)
+            self.max_queue_depth = max_queue_depth
+            self.queue_timeout = queue_timeout
+            for name, backend in self.backends.items():
+                backend.limit = self.limits.get(name, self.default_limit)
+                self._grant(backend)
+
+    def set_limit(self, backend_name, limit):
+        """Change one backend's concurrency limit, e.g. as nodes come and go"""
+        with self.lock:
+            self.limits[backend_name] = limit
+            backend = self._backend(backend_name)
+            backend.limit = limit
+            self._grant(backend)
+
+    def _backend(self, name):
+        backend = self.backends.get(name)
+        if backend is None:
+            backend = _BackendQueue(self.limits.get(name, self.default_limit))
+            self.backends[name] = backend
+        return backend
+
+    def _grant(self, backend):
+        """Hand free slots to waiting jobs: highest priority first, users in turn"""
+        while backend.active < backend.limit:
+            for priority in (INTERACTIVE, BACKGROUND):
+                users = backend.queues[priority]
+                if users:
+                    user, jobs = next(iter(users.items()))
+                    waiter = jobs.popleft()
+                    # This user goes to the back of the line for their next job
+                    del users[user]
+                    if jobs:
+                        users[user] = jobs
+                    break
+            else:
+                return
+            backend.active += 1
+            waiter.granted = True
+            waiter.event.set()
+
+    def _remove(self, backend, priority, user, waiter):
+        jobs = backend.queues[priority].get(user)
+        if jobs and waiter in jobs:
+            jobs.remove(waiter)
+            if not jobs:
+                del backend.queues[priority][user]
+
+    def acquire(self, backend_name, user=None, priority=INTERACTIVE, cancel_check=None):
+        """
+        Wait for a slot on the backend. Raises SchedulerBusy if the job is shed or
+        times out, and RequestSuperseded if cancel_check() becomes true while waiting.
+        """
+        start_time = time.time()
+        labels = {"backend": backend_name, "priority": PRIORITY_NAMES[priority]}
+        with self.lock:
+            backend = self._backend(backend_name)
+            if backend.active < backend.limit and not backend.depth():
+                backend.active += 1
+                SCHEDULER_QUEUE_WAIT_SECONDS.observe(0, **labels)
+                return
+
+            max_depth = self.max_queue_depth if priority == INTERACTIVE else self.max_queue_depth // 2
+            if backend.depth() >= max_depth:
+                SCHEDULER_SHED_TOTAL.inc(reason="queue_full", **labels)
+                raise SchedulerBusy(f"The {backend_name} queue is full")
+
+            waiter = _Waiter()
+            backend.queues[priority].setdefault(user, deque()).append(waiter)
+
+        deadline = start_time + self.queue_timeout
+        while True:
+            # Wake up regularly to notice cancellation
+            if waiter.event.wait(min(0.1, max(deadline - time.time(), 0))):
+                SCHEDULER_QUEUE_WAIT_SECONDS.observe(time.time() - start_time, **labels)
+                return
+
+            cancelled = bool(cancel_check and cancel_check())
+            if not cancelled and time.time() < deadline:
+                continue
+
+            with self.lock:
+                if waiter.granted:
+                    # Granted just as we gave up; hand the slot back
+                    backend.active -= 1
+                    self._grant(backend)
+                else:
+                    self._remove(backend, priority, user, waiter)
+            if cancelled:
+                raise RequestSuperseded("Request was superseded while queued")
+            SCHEDULER_SHED_TOTAL.inc(reason="timeout", **labels)
+            raise SchedulerBusy(f"Timed out waiting for the {backend_name} queue")
+
+    def release(self, backend_name):
+        with self.lock:
+            backend = self._backend(backend_name)
+            backend.active -= 1
+            self._grant(backend)
+
+    @contextmanager
+    def slot(self, backend_name, user=None, priority=INTERACTIVE, cancel_check=None):
+        """Hold a slot on the backend for as long as the block runs"""
+        self.acquire(backend_name, user, priority, cancel_check)
+        try:
+            yield
+        finally:
+            self.release(backend_name)
+
+    def status(self):
+        with self.lock:
+            return [
+                {
+                    "backend": name,
+                    "limit": backend.limit,
+                    "active": backend.active,
+                    "queued": {
+                        PRIORITY_NAMES[priority]: sum(len(jobs) for jobs in users.values())
+                        for priority, users in backend.queues.items()
+                    },
+                    "max_queue_depth": self.max_queue_depth
+                }
+                for name, backend in self.backends.items()
+            ]
+
+# Shared scheduler for all LLM calls in this process
+llm_scheduler = LLMScheduler()
@@ -1,19 +1,102 @@
 from app import db
-from app.models import Investigation, LLMConfig, QueryLog, ModelConfig
+from app.models import Investigation, LLMConfig, QueryLog, ModelConfig, ModelResult
 import json
 import requests
+import threading
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from contextlib import contextmanager
 import traceback
 import time
+import queue
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-import openai
+from flask import current_app
+from sqlalchemy import inspect
+from sqlalchemy.exc import SQLAlchemyError
+from app.json_stream import IncrementalJSONParser
+from app.response_parser import RESPONSE_FIELDS, normalize_field, parse_llm_response
+from app.cache import get_result_cache, make_cache_key
+from app.database import insert_on_conflict
+from app.generations import RequestSuperseded
+from app.ollama_pool import OllamaPool
+from app.warmup import WarmupManager, parse_keep_alive
+from app.incremental import conversation_store
+from app.change_gate import change_gate, load_vocabulary
+from app.refiner import refiner
+from app.log_writer import get_query_log_writer
+from app.blob_store import compact_query_logs
+from app.metrics import StageTimer, observe_model_timings
+from app.scheduler import llm_scheduler, SchedulerBusy, INTERACTIVE
 
 # Ollama API client for LLM integration
 class OllamaClient:
-    def __init__(self, base_url="http://localhost:11434"):
-        self.base_url = base_url
-        self.api_url = f"{base_url}/api/generate"
+    def __init__(self, base_url="http://localhost:11434", base_urls=None, connect_timeout=3.05, read_timeout=300,
+                 max_retries=2, backoff_factor=0.5, pool_size=10, health_check_interval=15):
+        self.configure(base_urls or [base_url], connect_timeout, read_timeout, max_retries, backoff_factor, pool_size,
+                       health_check_interval)
+    
+    def configure(self, base_urls, connect_timeout=3.05, read_timeout=300, max_retries=2, backoff_factor=0.5, pool_size=10,
+                  health_check_interval=15):
+        """
+        (Re)build the pooled HTTP session and node pool.
+        
+        Connections are kept alive and reused across calls. Connection failures and
+        Ollama's 502/503/504 responses are retried with exponential backoff, then the
+        next node is tried. Read failures are not retried on the same node, since
+        the model may already have done the work.
+        """
+        self.base_urls = [url.rstrip("/") for url in base_urls]
+        self.base_url = self.base_urls[0]
+        self.api_url = f"{self.base_url}/api/generate"
+        self.timeout = (connect_timeout, read_timeout)
+        
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=0,
+            status=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=None,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=len(self.base_urls), pool_maxsize=pool_size, max_retries=retry)
+        
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        
+        self.pool = OllamaPool(health_check_interval=health_check_interval, health_check_timeout=connect_timeout,
+                               base_urls=self.base_urls)
+    
+    @contextmanager
+    def _post(self, path, payload, stream=False, base_urls=None):
+        """
+        POST to the best node for the payload's model, failing over to the next node
+        if the connection fails. The node counts the request as in flight until the
+        block exits, so streamed responses keep their node busy while being read.
+        
+        base_urls restricts the nodes used (e.g. per model); defaults to all configured nodes.
+        """
+        last_error = None
+        for node in self.pool.rank(payload.get("model"), base_urls or self.base_urls):
+            with self.pool.track(node):
+                try:
+                    response = self.session.post(f"{node.base_url}{path}", json=payload, stream=stream, timeout=self.timeout)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    print(f"Ollama at {node.base_url} unavailable: {str(e)}")
+                    self.pool.mark_unhealthy(node, e)
+                    last_error = e
+                    continue
+                
+                with response:
+                    yield response
+                return
         
-    def generate(self, prompt, model="llama3.2", system="", format="json"):
+        raise last_error or requests.ConnectionError("No Ollama nodes configured")
+        
+    def generate(self, prompt, model="llama3.2", system="", format="json", base_urls=None, keep_alive=None, context=None):
         """
         Generate text from Ollama API with proper JSON formatting
         """
@@ -25,37 +108,104 @@ class OllamaClient:
                 "format": format,
                 "stream": False
             }
+            if keep_alive is not None:
+                payload["keep_alive"] = keep_alive
+            if context:
+                payload["context"] = context
             
             print("PAYLOAD***", payload)
-            response = requests.post(self.api_url, json=payload)
-            
-            if response.status_code == 200:
-                return response.json()
-            else:
-                print(f"Error: {response.status_code} - {response.text}")
-                return None
+            with self._post("/api/generate", payload, base_urls=base_urls) as response:
+                if response.status_code == 200:
+                    return response.json()
+                else:
+                    print(f"Error: {response.status_code} - {response.text}")
+                    return None
         except Exception as e:
             print(f"Exception in Ollama API call: {str(e)}")
             traceback.print_exc()
             return None
+    
+    def generate_stream(self, prompt, model="llama3.2", system="", format="json", base_urls=None, keep_alive=None,
+                        context=None):
+        """
+        Stream generated text from Ollama API, yielding each response chunk as it arrives.
+        The final chunk has "done" set along with Ollama's timing and context fields.
+        """
+        payload = {
+            "model": model,
+            "prompt": prompt,
+            "system": system,
+            "format": format,
+            "stream": True
+        }
+        if keep_alive is not None:
+            payload["keep_alive"] = keep_alive
+        if context:
+            payload["context"] = context
+        
+        with self._post("/api/generate", payload, stream=True, base_urls=base_urls) as response:
+            if response.status_code != 200:
+                print(f"Error: {response.status_code} - {response.text}")
+                return
+            
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+    
+    def preload(self, model, keep_alive=None, base_url=None):
+        """
+        Load a model into memory on one node without generating anything
+        """
+        payload = {"model": model, "stream": False}
+        if keep_alive is not None:
+            payload["keep_alive"] = keep_alive
+        
+        response = self.session.post(f"{base_url or self.base_url}/api/generate", json=payload, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
 
 # OpenAI API client
 class OpenAIClient:
-    def __init__(self):
+    def __init__(self, read_timeout=300, connect_timeout=3.05, max_retries=2):
         self.client = None
+        self.read_timeout = read_timeout
+        self.connect_timeout = connect_timeout
+        self.max_retries = max_retries
+        self.clients = {}  # SDK clients by API key, each with its own connection pool
+        self.lock = threading.Lock()
+    
+    def get_client(self, api_key):
+        """
+        The SDK client for an API key, created on first use and then reused.
+        The openai package is only imported here, as it's slow to import and
+        most deployments only use Ollama.
+        """
+        with self.lock:
+            client = self.clients.get(api_key)
+            if client is None:
+                import openai
+                timeout = openai.Timeout(self.read_timeout, connect=self.connect_timeout)
+                client = openai.OpenAI(api_key=api_key, timeout=timeout, max_retries=self.max_retries)
+                self.clients[api_key] = client
+            return client
     
     def set_api_key(self, api_key):
-        self.client = openai.OpenAI(api_key=api_key)
+        self.client = self.get_client(api_key)
+    
+    def _resolve_client(self, api_key):
+        client = self.get_client(api_key) if api_key else self.client
+        if not client:
+            raise ValueError("API key not set. Call set_api_key first or pass api_key.")
+        return client
     
-    def generate(self, prompt, model="gpt-3.5-turbo", system="", format="json"):
+    def generate(self, prompt, model="gpt-3.5-turbo", system="", format="json", api_key=None):
         """
         Generate text from OpenAI API with proper JSON formatting
         """
-        if not self.client:
-            raise ValueError("API key not set. Call set_api_key first.")
+        client = self._resolve_client(api_key)
             
         try:
-            response = self.client.chat.completions.create(
+            response = client.chat.completions.create(
                 model=model,
                 messages=[
                     {"role": "system", "content": system},
@@ -64,143 +214,496 @@ class OpenAIClient:
                 response_format={"type": "json_object"} if format == "json" else None
             )
             
-            return {
+            result = {
                 "response": response.choices[0].message.content,
                 "model": model
             }
+            # Token counts under Ollama's names, so both backends are recorded the same way
+            if response.usage:
+                result["prompt_eval_count"] = response.usage.prompt_tokens
+                result["eval_count"] = response.usage.completion_tokens
+            return result
         except Exception as e:
             print(f"Exception in OpenAI API call: {str(e)}")
             traceback.print_exc()
             return None
+    
+    def generate_stream(self, prompt, model="gpt-3.5-turbo", system="", format="json", api_key=None):
+        """
+        Stream generated text from OpenAI API, yielding Ollama-style chunks
+        ({"response": ..., "done": ...}) so both clients can be consumed the same way
+        """
+        client = self._resolve_client(api_key)
+        
+        stream = client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": system},
+                {"role": "user", "content": prompt}
+            ],
+            response_format={"type": "json_object"} if format == "json" else None,
+            stream=True
+        )
+        
+        try:
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield {"response": chunk.choices[0].delta.content, "done": False}
+        finally:
+            # Close the connection if the caller stops reading early
+            stream.response.close()
+        
+        yield {"response": "", "done": True, "model": model}
 
 # Create singleton clients
 ollama_client = OllamaClient()
 openai_client = OpenAIClient()
+warmup_manager = WarmupManager(ollama_client)
 
-def process_medical_history_with_model(history_text, model_config):
+def configure_clients(config):
     """
-    Process medical history with a specific model configuration
+    Apply connection settings from the app config to the singleton clients
     """
-    # Track processing time
-    start_time = time.time()
-    error_message = None
-    raw_response = None
-    
-    # Get all available investigations from the database
-    available_investigations = Investigation.query.all()
-    investigation_list = "\n".join([f"- {inv.name}" for inv in available_investigations])
-    
-    # Format the prompt with history and available investigations
-    prompt = f"""
-Patient History:
-{history_text}
+    ollama_client.configure(
+        base_urls=config['OLLAMA_BASE_URLS'],
+        connect_timeout=config['LLM_CONNECT_TIMEOUT'],
+        read_timeout=config['LLM_READ_TIMEOUT'],
+        max_retries=config['LLM_MAX_RETRIES'],
+        backoff_factor=config['LLM_RETRY_BACKOFF'],
+        health_check_interval=config['OLLAMA_HEALTH_CHECK_INTERVAL']
+    )
+    openai_client.read_timeout = config['LLM_READ_TIMEOUT']
+    openai_client.connect_timeout = config['LLM_CONNECT_TIMEOUT']
+    openai_client.max_retries = config['LLM_MAX_RETRIES']
+    openai_client.clients = {}
+    warmup_manager.default_keep_alive = parse_keep_alive(config['OLLAMA_KEEP_ALIVE'])
+    conversation_store.max_turns = config['LLM_INCREMENTAL_MAX_TURNS']
+    change_gate.min_words = config['LLM_CHANGE_MIN_WORDS']
+    change_gate.ignore_typos = config['LLM_CHANGE_IGNORE_TYPOS']
+    change_gate.vocabulary = load_vocabulary(config['LLM_CHANGE_VOCABULARY']) if config['LLM_CHANGE_VOCABULARY'] else None
+    refiner.settle_seconds = config['LLM_REFINE_SETTLE_MS'] / 1000
+    investigation_catalogue.ttl_seconds = config['INVESTIGATION_CACHE_TTL']
+    investigation_catalogue.invalidate()
+    # The Ollama limit is per node, so each healthy node adds capacity
+    ollama_limit = lambda healthy_nodes: config['LLM_OLLAMA_CONCURRENCY'] * max(healthy_nodes, 1)
+    llm_scheduler.configure(
+        limits={"ollama": ollama_limit(ollama_client.pool.healthy_count()), "openai": config['LLM_OPENAI_CONCURRENCY']},
+        max_queue_depth=config['LLM_MAX_QUEUE_DEPTH'],
+        queue_timeout=config['LLM_QUEUE_TIMEOUT']
+    )
+    ollama_client.pool.on_health_change = lambda healthy_nodes: llm_scheduler.set_limit("ollama", ollama_limit(healthy_nodes))
 
+def build_prompt_prefix(investigation_names):
+    """
+    The part of the prompt that doesn't depend on the history. It comes first so
+    that, together with the system prompt, it forms a prefix Ollama can reuse from
+    its prompt cache across calls instead of evaluating it again.
+    """
+    investigation_list = "\n".join([f"- {name}" for name in investigation_names])
+    
+    return f"""
 Available Investigations:
 {investigation_list}
+"""
+
+def build_prompt(history_text, prompt_prefix):
+    """
+    Format the prompt with available investigations (the prefix) and history
+    """
+    return f"""{prompt_prefix}
+Patient History:
+{history_text}
 
 Based on this patient history, provide recommendations.
 """
+
+class InvestigationCatalogue:
+    """
+    In-process cache of the investigation names and the prompt prefix built from them.
+    
+    Invalidated when an investigation is added. The TTL bounds how long other
+    worker processes, which don't see that invalidation, keep serving a stale list.
+    """
+    def __init__(self, ttl_seconds=60):
+        self.ttl_seconds = ttl_seconds
+        self.lock = threading.Lock()
+        self.entry = None
+        self.loaded_at = 0
+    
+    def get(self):
+        """Returns (investigation_names, prompt_prefix), loading them if needed"""
+        with self.lock:
+            if self.entry is None or time.time() - self.loaded_at > self.ttl_seconds:
+                investigation_names = [inv.name for inv in Investigation.query.all()]
+                self.entry = (investigation_names, build_prompt_prefix(investigation_names))
+                self.loaded_at = time.time()
+            return self.entry
+    
+    def invalidate(self):
+        with self.lock:
+            self.entry = None
+
+investigation_catalogue = InvestigationCatalogue()
+
+def collect_stream(chunks, on_field=None, cancel_check=None):
+    """
+    Consume a client's generate_stream output into the same shape generate returns.
+    
+    If on_field is given, it is called with (field_name, display_value) as soon as
+    each response field has been fully generated. If cancel_check returns True
+    between chunks, the stream is closed (which aborts generation on the server)
+    and RequestSuperseded is raised.
+    """
+    parser = IncrementalJSONParser(fields=RESPONSE_FIELDS)
+    text_parts = []
+    final_chunk = None
+    
+    for chunk in chunks:
+        if cancel_check and cancel_check():
+            chunks.close()
+            raise RequestSuperseded("Stopped generating for a superseded request")
+        
+        text = chunk.get("response", "")
+        text_parts.append(text)
+        if on_field:
+            for name, value in parser.feed(text):
+                display_value = normalize_field(name, value)
+                if display_value is not None:
+                    on_field(name, display_value)
+        if chunk.get("done"):
+            final_chunk = chunk
+    
+    if final_chunk is None:
+        return None
+    
+    return dict(final_chunk, response="".join(text_parts))
+
+# Ollama's own breakdown of a call, reported in nanoseconds, and the stage each is recorded as
+OLLAMA_DURATION_STAGES = (
+    ("load_duration", "ollama_load"),
+    ("prompt_eval_duration", "ollama_prompt_eval"),
+    ("eval_duration", "ollama_eval")
+)
+
+def record_backend_stats(timings, response):
+    """
+    Keep the backend's token counts and, for Ollama, its own timing of the call.
+    Whatever part of the call Ollama didn't spend on the request is recorded as
+    llm_network (connection, transfer and queueing).
+    """
+    if not response:
+        return
+    for field in ("prompt_eval_count", "eval_count"):
+        if response.get(field) is not None:
+            timings.count(field, response[field])
+    for field, stage in OLLAMA_DURATION_STAGES:
+        if response.get(field):
+            timings.add(stage, response[field] / 1e6)
+    if response.get("total_duration") and "llm_call" in timings.stages:
+        timings.add("llm_network", max(0, timings.stages["llm_call"] - response["total_duration"] / 1e6))
+
+def run_model(history_text, prompt, investigation_names, model_type, model_name, system_prompt, api_key=None,
+              ollama_base_urls=None, keep_alive=None, conversation=None, on_field=None, cancel_check=None,
+              timings=None, user=None, priority=INTERACTIVE):
+    """
+    Call a single model and parse its output.
     
+    Takes plain values rather than ORM objects and never touches the database,
+    so it is safe to run on a worker thread. If on_field is given the model's
+    output is streamed and on_field(field_name, value) is called as each field completes.
+    If cancel_check is given the output is also streamed, and the call is abandoned
+    with RequestSuperseded as soon as cancel_check() returns True.
+    
+    If an Ollama conversation is given and the history only had text appended since
+    its last call, just the appended text is sent along with the conversation's context.
+    
+    If a StageTimer is given as timings, the call, parse and backend-reported stages
+    are recorded on it along with the backend's token counts.
+    
+    The call waits for a slot from the LLM scheduler, queued fairly against other
+    users' calls (user) at the given priority, and raises SchedulerBusy if it is
+    turned away.
+    """
+    # Track processing time
+    start_time = time.time()
+    timings = timings or StageTimer()
+    error_message = None
+    raw_response = None
     result = None
+    incremental = False
     
     try:
         # Call appropriate API based on model type
-        if model_config.model_type == "ollama":
-            response = ollama_client.generate(
-                prompt=prompt,
-                model=model_config.model_name,
-                system=model_config.system_prompt,
-                format="json"
-            )
-        elif model_config.model_type == "openai":
-            # Set API key (refreshed in case it was updated)
-            openai_client.set_api_key(model_config.api_key)
-            response = openai_client.generate(
-                prompt=prompt,
-                model=model_config.model_name,
-                system=model_config.system_prompt,
-                format="json"
-            )
+        client_args = {}
+        if model_type == "ollama":
+            client = ollama_client
+            client_args = {"base_urls": ollama_base_urls, "keep_alive": warmup_manager.keep_alive_for(keep_alive)}
+            if conversation:
+                fingerprint = make_cache_key(model_type, model_name, system_prompt, "", investigation_names)
+                prompt, client_args["context"], incremental = conversation.prepare(
+                    history_text, prompt, fingerprint, conversation_store.max_turns
+                )
+        elif model_type == "openai":
+            # Pass the key per call so concurrent OpenAI models can't swap each other's API key
+            client = openai_client
+            client_args = {"api_key": api_key}
         else:
-            error_message = f"Unsupported model type: {model_config.model_type}"
+            error_message = f"Unsupported model type: {model_type}"
             print(error_message)
-            return mock_llm_process(history_text, available_investigations), error_message, None, 0
+            return mock_llm_process(history_text, investigation_names), error_message, None, 0
+        
+        if cancel_check and cancel_check():
+            raise RequestSuperseded("Skipped model call for a superseded request")
+        
+        with timings.stage("queue_wait"):
+            llm_scheduler.acquire(model_type, user, priority, cancel_check)
+        try:
+            with timings.stage("llm_call"):
+                if on_field or cancel_check:
+                    response = collect_stream(
+                        client.generate_stream(prompt=prompt, model=model_name, system=system_prompt, format="json", **client_args),
+                        on_field=on_field,
+                        cancel_check=cancel_check
+                    )
+                else:
+                    response = client.generate(prompt=prompt, model=model_name, system=system_prompt, format="json", **client_args)
+        finally:
+            llm_scheduler.release(model_type)
+        record_backend_stats(timings, response)
         
         if response and 'response' in response:
             raw_response = response['response']
-            try:
-                # Parse the JSON response
-                llm_response = json.loads(raw_response)
-                
-                # Ensure required fields exist and convert any lists or objects to strings
-                recommended_questions = llm_response.get("recommended_questions", "")
-                recommended_investigations = llm_response.get("recommended_investigations", "")
-                problem_list = llm_response.get("problem_list", "")
-                
-                # Convert to strings if they are not already
-                if isinstance(recommended_questions, list):
-                    recommended_questions = "\n".join(recommended_questions)
-                elif not isinstance(recommended_questions, str):
-                    recommended_questions = json.dumps(recommended_questions)
-                    
-                if isinstance(recommended_investigations, list):
-                    recommended_investigations = "\n".join(recommended_investigations)
-                elif not isinstance(recommended_investigations, str):
-                    recommended_investigations = json.dumps(recommended_investigations)
-                    
-                if isinstance(problem_list, list):
-                    # Handle list of objects or strings
-                    if problem_list and isinstance(problem_list[0], dict):
-                        problem_items = []
-                        for item in problem_list:
-                            code = item.get("ICD10 Code", "")
-                            desc = item.get("Problem Description", "")
-                            problem_items.append(f"{code} - {desc}")
-                        problem_list = "\n".join(problem_items)
-                    else:
-                        problem_list = "\n".join(problem_list)
-                elif not isinstance(problem_list, str):
-                    problem_list = json.dumps(problem_list)
-                
-                result = {
-                    "recommended_questions": recommended_questions,
-                    "recommended_investigations": recommended_investigations,
-                    "problem_list": problem_list
-                }
-            except json.JSONDecodeError:
-                error_message = "Failed to parse JSON response from LLM"
+            with timings.stage("parse"):
+                parsed = parse_llm_response(raw_response)
+            # Show whichever fields could be recovered rather than made-up recommendations
+            result = parsed.to_result()
+            error_message = parsed.error_message()
+            if error_message:
                 print(error_message)
-                # Return a fallback response
-                result = mock_llm_process(history_text, available_investigations)
+            elif conversation and response.get("context"):
+                conversation.update(history_text, response["context"], fingerprint, incremental)
         else:
             error_message = "Invalid or empty response from API"
             print(error_message)
-            result = mock_llm_process(history_text, available_investigations)
+            result = mock_llm_process(history_text, investigation_names)
+    except (RequestSuperseded, SchedulerBusy):
+        raise
     except Exception as e:
-        error_message = f"Error processing with {model_config.model_type} model: {str(e)}"
+        error_message = f"Error processing with {model_type} model: {str(e)}"
         print(error_message)
         traceback.print_exc()
         # Fall back to mock response
-        result = mock_llm_process(history_text, available_investigations)
+        result = mock_llm_process(history_text, investigation_names)
+    
+    # Don't build on a context that produced an error; the next call sends the full prompt
+    if conversation and error_message:
+        conversation.reset()
     
     # Calculate processing time
     end_time = time.time()
     processing_time_ms = int((end_time - start_time) * 1000)
     
-    # Update the model config with the results and processing time
-    model_config.recommended_questions = result.get("recommended_questions", "")
-    model_config.recommended_investigations = result.get("recommended_investigations", "")
-    model_config.problem_list = result.get("problem_list", "")
-    model_config.last_processing_time_ms = processing_time_ms
-    db.session.commit()
+    return result, error_message, raw_response, processing_time_ms
+
+def parse_base_urls(value):
+    """Split a comma-separated list of URLs, returning None if there are none"""
+    urls = [url.strip().rstrip("/") for url in (value or "").split(",") if url.strip()]
+    return urls or None
+
+def get_investigation_names():
+    """Names of all available investigations"""
+    return investigation_catalogue.get()[0]
+
+def _model_call_args(model_config, session_id=None, priority=INTERACTIVE):
+    """
+    Snapshot the fields run_model needs, so worker threads never read ORM state.
+    With LLM_INCREMENTAL_PROMPTS enabled, Ollama models also get the session's conversation.
+    """
+    call_args = {
+        "model_type": model_config.model_type,
+        "model_name": model_config.model_name,
+        "system_prompt": model_config.system_prompt,
+        "api_key": model_config.api_key,
+        "ollama_base_urls": parse_base_urls(model_config.ollama_base_urls),
+        "keep_alive": model_config.keep_alive,
+        "user": session_id,
+        "priority": priority
+    }
+    if session_id and model_config.model_type == "ollama" and current_app.config.get('LLM_INCREMENTAL_PROMPTS'):
+        call_args["conversation"] = conversation_store.get(session_id, model_config.id)
+    return call_args
+
+# Session id that results are stored under when the caller has no session
+DEFAULT_SESSION_ID = "default"
+
+def get_model_results(session_id):
+    """The session's latest result for each model, by model config id"""
+    return {
+        model_result.model_config_id: model_result
+        for model_result in ModelResult.query.filter_by(session_id=session_id or DEFAULT_SESSION_ID)
+    }
+
+def _store_model_result(model_config, result, processing_time_ms, session_id=None):
+    """Save the model's results and processing time for the session"""
+    session_id = session_id or DEFAULT_SESSION_ID
+    values = {
+        "recommended_questions": result.get("recommended_questions", ""),
+        "recommended_investigations": result.get("recommended_investigations", ""),
+        "problem_list": result.get("problem_list", ""),
+        "processing_time_ms": processing_time_ms
+    }
+    
+    # Don't flush earlier results yet; that would hold the database write lock until the other models finish
+    with db.session.no_autoflush:
+        model_result = ModelResult.query.filter_by(session_id=session_id, model_config_id=model_config.id).first()
+    if model_result is None:
+        insert = insert_on_conflict(db.engine.dialect.name)
+        if insert is not None:
+            # Another request for the session may insert the row first, so upsert it. This is written
+            # straight away rather than at commit, but only for the session's first result from the model
+            values["updated_at"] = datetime.utcnow()
+            db.session.execute(
+                insert(ModelResult)
+                .values(session_id=session_id, model_config_id=model_config.id, **values)
+                .on_conflict_do_update(index_elements=["session_id", "model_config_id"], set_=values)
+            )
+            return
+        model_result = ModelResult(session_id=session_id, model_config_id=model_config.id)
+        db.session.add(model_result)
+    
+    for name, value in values.items():
+        setattr(model_result, name, value)
+
+def process_medical_history_with_model(history_text, model_config, session_id=None):
+    """
+    Process medical history with a specific model configuration
+    """
+    timings = StageTimer()
+    with timings.stage("investigations"):
+        investigation_names, prompt_prefix = investigation_catalogue.get()
+    with timings.stage("prompt_build"):
+        prompt = build_prompt(history_text, prompt_prefix)
+    
+    result, error_message, raw_response, processing_time_ms = run_model(
+        history_text, prompt, investigation_names, timings=timings, **_model_call_args(model_config)
+    )
+    
+    with timings.stage("db_commit"):
+        _store_model_result(model_config, result, processing_time_ms, session_id)
+        db.session.commit()
+    observe_model_timings(timings, model_config.model_name)
     
     return result, error_message, raw_response, processing_time_ms
 
-def process_medical_history(history_text):
+def _dispatch(history_text, prompt, investigation_names, model_configs, max_workers, stream_fields=False,
+              cancel_check=None, session_id=None, model_timings=None, priority=INTERACTIVE):
+    """
+    Run the models on worker threads, yielding events as they happen:
+    ("field", model_config, field_name, value) for each completed field when
+    stream_fields is set, ("result", model_config, result, error_message,
+    raw_response, processing_time_ms) when a model finishes,
+    ("superseded", model_config) when a model call is abandoned via cancel_check,
+    and ("busy", model_config) when the scheduler turns a model call away.
+    
+    Only the LLM calls run on worker threads; results are applied to the
+    database on the calling thread as they are yielded. model_timings maps
+    model config ids to the StageTimer for each model's call.
+    """
+    events = queue.Queue()
+    
+    def worker(model_config, call_args):
+        on_field = None
+        if stream_fields:
+            on_field = lambda name, value: events.put(("field", model_config, name, value))
+        try:
+            outcome = run_model(
+                history_text, prompt, investigation_names, on_field=on_field, cancel_check=cancel_check, **call_args
+            )
+        except RequestSuperseded:
+            events.put(("superseded", model_config))
+            return
+        except SchedulerBusy:
+            events.put(("busy", model_config))
+            return
+        except Exception as e:
+            traceback.print_exc()
+            outcome = (mock_llm_process(history_text, investigation_names), f"Error processing model: {str(e)}", None, 0)
+        events.put(("result", model_config) + outcome)
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for model_config in model_configs:
+            call_args = _model_call_args(model_config, session_id, priority)
+            if model_timings:
+                call_args["timings"] = model_timings[model_config.id]
+            executor.submit(worker, model_config, call_args)
+        
+        remaining = len(model_configs)
+        while remaining:
+            event = events.get()
+            if event[0] in ("result", "superseded", "busy"):
+                remaining -= 1
+            if event[0] == "result":
+                _, model_config, result, _, _, processing_time_ms = event
+                _store_model_result(model_config, result, processing_time_ms, session_id)
+            yield event
+
+def _run_sequentially(history_text, prompt, investigation_names, model_configs, cancel_check=None, session_id=None,
+                      model_timings=None, priority=INTERACTIVE):
     """
-    Process medical history with all active models
+    Run the models one after another on the calling thread, yielding result events
+    """
+    for model_config in model_configs:
+        outcome = run_model(
+            history_text, prompt, investigation_names, cancel_check=cancel_check,
+            timings=model_timings[model_config.id] if model_timings else None,
+            **_model_call_args(model_config, session_id, priority)
+        )
+        _store_model_result(model_config, outcome[0], outcome[3], session_id)
+        yield ("result", model_config) + outcome
+
+def _warmup_targets(model_configs):
+    return [
+        (model_config.model_name, model_config.keep_alive, parse_base_urls(model_config.ollama_base_urls))
+        for model_config in model_configs
+        if model_config.model_type == "ollama"
+    ]
+
+def warm_models(model_configs):
+    """
+    Preload the Ollama models among model_configs in the background
+    """
+    targets = _warmup_targets(model_configs)
+    if targets:
+        warmup_manager.warm_in_background(targets)
+
+def get_model_warm_status():
+    """
+    Whether each active Ollama model is currently loaded
+    """
+    model_configs = ModelConfig.query.filter_by(is_active=True, model_type="ollama").order_by(ModelConfig.position).all()
+    statuses = warmup_manager.status([(model_name, base_urls) for model_name, _, base_urls in _warmup_targets(model_configs)])
+    for model_config, status in zip(model_configs, statuses):
+        status.update(id=model_config.id, name=model_config.name)
+    return statuses
+
+def load_active_model_configs():
+    """
+    The active models, without creating a default if there are none. Returns
+    an empty list if the database schema hasn't been created yet.
+    """
+    try:
+        if not inspect(db.engine).has_table(ModelConfig.__tablename__):
+            return []
+        return ModelConfig.query.filter_by(is_active=True).order_by(ModelConfig.position).all()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        print(f"Could not load the active models: {str(e)}")
+        return []
+
+def get_active_model_configs():
+    """
+    Get all active models or use default if none
     """
-    # Get all active models or use default if none
     model_configs = ModelConfig.query.filter_by(is_active=True).order_by(ModelConfig.position).all()
     
     # If no models are configured, use the default configuration
@@ -224,43 +727,264 @@ def process_medical_history(history_text):
         db.session.commit()
         model_configs = [default_model]
     
-    main_result = None
+    return model_configs
+
+def split_model_tiers(model_configs):
+    """
+    Split models into those that answer every update and those in the "refine"
+    tier, which run in the background once the history settles. If every model
+    is in the refine tier, they all answer every update instead.
+    """
+    interactive = [model_config for model_config in model_configs if model_config.tier != "refine"]
+    if not interactive:
+        return model_configs, []
+    return interactive, [model_config for model_config in model_configs if model_config.tier == "refine"]
+
+def _lookup_cached_results(history_text, investigation_names, model_configs):
+    """
+    Split model_configs into cache hits and misses.
+    Returns ({model_config.id: cache key}, [(model_config, cached value, lookup time ms)], [misses])
+    """
+    cache = get_result_cache()
+    keys = {}
+    hits = []
+    misses = []
     
-    # Process with each model
     for model_config in model_configs:
-        result, error_message, raw_response, processing_time_ms = process_medical_history_with_model(
-            history_text, model_config
+        start_time = time.time()
+        key = make_cache_key(
+            model_config.model_type, model_config.model_name, model_config.system_prompt,
+            history_text, investigation_names
         )
+        keys[model_config.id] = key
         
-        # Log this query
-        query_log = QueryLog(
+        cached = cache.get(key) if cache else None
+        if cached is not None:
+            hits.append((model_config, cached, int((time.time() - start_time) * 1000)))
+        else:
+            misses.append(model_config)
+    
+    return keys, hits, misses
+
+def iter_medical_history_events(history_text, model_configs=None, stream_fields=False, request_token=None,
+                                session_id=None, timings=None, priority=INTERACTIVE, before_dispatch=None):
+    """
+    Process medical history with all active models, yielding ("result", model_config,
+    result, error_message, raw_response, processing_time_ms) for each model once it
+    has been stored and logged. With stream_fields, ("field", model_config, field_name,
+    value) events are also yielded as each model generates each field.
+    
+    Models whose result is in the response cache are yielded first without calling
+    the LLM. With LLM_CONCURRENT_DISPATCH enabled the remaining models run in parallel
+    and finish in completion order; otherwise they run one after another in tab order.
+    
+    If request_token is given and a newer request for the same session starts,
+    in-flight model calls are abandoned, pending database changes are rolled back
+    and RequestSuperseded is raised. session_id identifies the session whose model
+    results are stored, and its Ollama conversations for incremental prompting.
+    
+    Request stages are timed on timings (a StageTimer) if given. Each model's own
+    stages are stored with its query log and recorded in the metrics.
+    
+    Model calls are queued by the LLM scheduler at the given priority, with the
+    session as the user. If any call is turned away, the others are abandoned,
+    pending database changes are rolled back and SchedulerBusy is raised.
+    
+    If before_dispatch is given and any model has to be called, it is called
+    with the cancel check (or None) just before the LLM calls start, e.g. to
+    wait out a minimum interval between a session's calls.
+    """
+    if model_configs is None:
+        model_configs = get_active_model_configs()
+    
+    timings = timings or StageTimer()
+    model_timings = {model_config.id: StageTimer() for model_config in model_configs}
+    
+    with timings.stage("investigations"):
+        investigation_names, prompt_prefix = investigation_catalogue.get()
+    with timings.stage("prompt_build"):
+        prompt = build_prompt(history_text, prompt_prefix)
+    
+    with timings.stage("cache_lookup"):
+        cache_keys, hits, misses = _lookup_cached_results(history_text, investigation_names, model_configs)
+    cache_hit_ids = {model_config.id for model_config, _, _ in hits}
+    
+    def cached_events():
+        for model_config, cached, processing_time_ms in hits:
+            model_timings[model_config.id].add("cache_lookup", processing_time_ms)
+            _store_model_result(model_config, cached["result"], processing_time_ms, session_id)
+            yield ("result", model_config, cached["result"], None, cached["raw_response"], processing_time_ms)
+    
+    # Set when a call is turned away by the scheduler, so the other calls give up too, even without a request token
+    shed = threading.Event()
+    if request_token:
+        cancel_check = lambda: shed.is_set() or request_token.is_superseded()
+    else:
+        cancel_check = shed.is_set
+    
+    if not misses:
+        events = ()
+    elif current_app.config.get('LLM_CONCURRENT_DISPATCH') and len(misses) > 1:
+        events = _dispatch(
+            history_text, prompt, investigation_names, misses, len(misses), stream_fields, cancel_check, session_id,
+            model_timings, priority
+        )
+    elif stream_fields:
+        # Still needs a worker thread to surface fields mid-call, but one model at a time
+        events = _dispatch(
+            history_text, prompt, investigation_names, misses, 1, stream_fields, cancel_check, session_id, model_timings,
+            priority
+        )
+    else:
+        events = _run_sequentially(
+            history_text, prompt, investigation_names, misses, cancel_check, session_id, model_timings, priority
+        )
+    
+    cache = get_result_cache()
+    log_writer = get_query_log_writer()
+    
+    def all_events():
+        yield from cached_events()
+        if misses and before_dispatch:
+            with timings.stage("dispatch_wait"):
+                before_dispatch(cancel_check)
+        yield from events
+    
+    for event in _until_superseded(all_events(), request_token, shed):
+        if event[0] == "result":
+            _, model_config, result, error_message, raw_response, processing_time_ms = event
+            cache_hit = model_config.id in cache_hit_ids
+            model_timer = model_timings[model_config.id]
+            
+            # Only successful LLM results are worth reusing
+            if cache and not cache_hit and error_message is None:
+                cache.set(cache_keys[model_config.id], {"result": result, "raw_response": raw_response})
+            
+            # Log this query
+            query_log = dict(
+                timestamp=datetime.utcnow(),
+                query_text=history_text,
+                model_type=model_config.model_type,
+                model_name=model_config.model_name,
+                recommended_questions=result.get("recommended_questions", ""),
+                recommended_investigations=result.get("recommended_investigations", ""),
+                problem_list=result.get("problem_list", ""),
+                raw_response=raw_response,
+                processing_time_ms=processing_time_ms,
+                error=error_message,
+                cache_hit=cache_hit,
+                stage_timings=json.dumps(model_timer.to_dict()),
+                prompt_eval_count=model_timer.counts.get("prompt_eval_count"),
+                eval_count=model_timer.counts.get("eval_count"),
+                skip_reason=None
+            )
+            with model_timer.stage("log_write"):
+                if log_writer:
+                    # Written in the background; the model result is committed once all models finish
+                    log_writer.submit(query_log)
+                else:
+                    db.session.add(QueryLog(**compact_query_logs([query_log])[0]))
+                    db.session.commit()
+            observe_model_timings(model_timer, model_config.model_name)
+        
+        yield event
+    
+    if log_writer:
+        with timings.stage("db_commit"):
+            db.session.commit()
+
+def change_gate_context(model_configs):
+    """What the models' results depend on besides the history, for the change gate"""
+    investigation_names, _ = investigation_catalogue.get()
+    return tuple(
+        (model_config.id, make_cache_key(model_config.model_type, model_config.model_name, model_config.system_prompt,
+                                         "", investigation_names))
+        for model_config in model_configs
+    )
+
+def log_skipped_update(history_text, model_configs, stored_results, reason):
+    """Log the previous results as each model's answer to a history the change gate didn't run the models on"""
+    log_writer = get_query_log_writer()
+    for model_config in model_configs:
+        stored = stored_results.get(model_config.id)
+        query_log = dict(
             timestamp=datetime.utcnow(),
             query_text=history_text,
             model_type=model_config.model_type,
             model_name=model_config.model_name,
-            recommended_questions=result.get("recommended_questions", ""),
-            recommended_investigations=result.get("recommended_investigations", ""),
-            problem_list=result.get("problem_list", ""),
-            raw_response=raw_response,
-            processing_time_ms=processing_time_ms,
-            error=error_message
+            recommended_questions=stored.recommended_questions if stored else "",
+            recommended_investigations=stored.recommended_investigations if stored else "",
+            problem_list=stored.problem_list if stored else "",
+            raw_response=None,
+            processing_time_ms=0,
+            error=None,
+            cache_hit=False,
+            stage_timings=None,
+            prompt_eval_count=None,
+            eval_count=None,
+            skip_reason=reason[:200]
         )
-        db.session.add(query_log)
+        if log_writer:
+            log_writer.submit(query_log)
+        else:
+            db.session.add(QueryLog(**compact_query_logs([query_log])[0]))
+    if not log_writer:
         db.session.commit()
-        
-        # First result becomes the main one (for backward compatibility)
-        if main_result is None:
-            main_result = result
+
+def _until_superseded(events, request_token, shed=None):
+    """
+    Pass events through until the request is superseded or a model call is turned
+    away by the scheduler, then discard any pending database changes and raise
+    RequestSuperseded or SchedulerBusy
+    """
+    try:
+        for event in events:
+            if event[0] == "busy":
+                raise SchedulerBusy("The LLM service is busy")
+            if event[0] == "superseded" or (request_token and request_token.is_superseded()):
+                raise RequestSuperseded("A newer request for this session has started")
+            yield event
+    except (RequestSuperseded, SchedulerBusy):
+        # Stop waiting on the remaining model calls; they see the same token (or shed flag) and abort
+        if shed is not None:
+            shed.set()
+        events.close()
+        db.session.rollback()
+        raise
+
+def iter_medical_history_results(history_text, model_configs=None, request_token=None, session_id=None,
+                                 timings=None, priority=INTERACTIVE, before_dispatch=None):
+    """
+    Process medical history with all active models, yielding each model's outcome
+    as (model_config, result, error_message, raw_response, processing_time_ms)
+    once it has been stored and logged.
+    """
+    for event in iter_medical_history_events(history_text, model_configs, request_token=request_token,
+                                             session_id=session_id, timings=timings, priority=priority,
+                                             before_dispatch=before_dispatch):
+        yield event[1:]
+
+def process_medical_history(history_text, request_token=None, session_id=None, timings=None):
+    """
+    Process medical history with all active models.
+    Raises RequestSuperseded if request_token is superseded before all models finish.
+    """
+    model_configs = get_active_model_configs()
+    results = {}
+    
+    for model_config, result, _, _, _ in iter_medical_history_results(history_text, model_configs, request_token, session_id,
+                                                                      timings):
+        results[model_config.id] = result
     
-    return main_result
+    # First result by tab position becomes the main one (for backward compatibility)
+    return results[model_configs[0].id]
 
 # Mock LLM response - used as fallback if API fails
-def mock_llm_process(history_text, available_investigations):
+def mock_llm_process(history_text, investigation_names):
     """
     Mock LLM processing as a fallback
     """
     # Very basic mock response
-    investigation_names = [inv.name for inv in available_investigations]
     investigation_list = "\n- ".join(investigation_names[:3]) if investigation_names else "No investigations available"
     
     return {
@@ -270,9 +994,11 @@ def mock_llm_process(history_text, available_investigations):
     }
 
 def init_services():
-    """Initialize services and seed data"""
+    """Seed the default investigations, LLM config and models into an empty database (see `flask init-db`)"""
+    seeded = False
+    
     # Add some initial investigations if none exist
-    if Investigation.query.count() == 0:
+    if Investigation.query.first() is None:
         initial_investigations = [
             "Full Blood Count (FBC)",
             "Urea Electrolytes Creatinine (UEC)",
@@ -289,12 +1015,12 @@ def init_services():
         for inv_name in initial_investigations:
             investigation = Investigation(name=inv_name)
             db.session.add(investigation)
-        
-        db.session.commit()
+        seeded = True
         
     # Create default LLM config if none exists
-    if LLMConfig.query.count() == 0:
-        default_config = LLMConfig(
+    config = LLMConfig.query.first()
+    if config is None:
+        config = LLMConfig(
             update_frequency=100,
             update_on_newline=True,
             line_count_before_update=2,
@@ -313,14 +1039,11 @@ Format your response in JSON with the following structure:
   "problem_list": "ICD10 Code - Problem Description\\nICD10 Code - Problem Description"
 }"""
         )
-        db.session.add(default_config)
-        db.session.commit()
+        db.session.add(config)
+        seeded = True
     
     # Create default model configs if none exist
-    if ModelConfig.query.count() == 0:
-        # Get the default configuration
-        config = LLMConfig.query.first()
-        
+    if ModelConfig.query.first() is None:
         # Create Ollama model
         ollama_model = ModelConfig(
             name="Ollama: Llama3",
@@ -353,7 +1076,10 @@ Format your response in JSON with the following structure:
             api_key="" 
         )
         db.session.add(openai_model)
-        
+        seeded = True
+    
+    # One transaction for all of it
+    if seeded:
         db.session.commit()
-        
-    print("Database seeded with initial data.") 
\ No newline at end of file
+        print("Database seeded with initial data.")
+    return seeded
\ No newline at end of file
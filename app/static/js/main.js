@@ -8,7 +8,17 @@ document.addEventListener('DOMContentLoaded', function() {
     const updateOnNewline = document.getElementById('updateOnNewline');
     const lineCountBeforeUpdate = document.getElementById('lineCountBeforeUpdate');
     const inactivityTimer = document.getElementById('inactivityTimer');
+    const minUpdateInterval = document.getElementById('minUpdateInterval');
     const saveConfigBtn = document.getElementById('saveConfigBtn');
+    
+    // This page's encounter: sent with each update so other tabs' patients don't share its record or results.
+    // It's kept in the URL so a reload reopens the same encounter
+    const encounterId = historyTextarea.dataset.encounterId;
+    const pageUrl = new URL(window.location.href);
+    if (pageUrl.searchParams.get('encounter_id') !== encounterId) {
+        pageUrl.searchParams.set('encounter_id', encounterId);
+        window.history.replaceState(null, '', pageUrl);
+    }
 
     // Configuration
     let config = {
@@ -24,6 +34,15 @@ document.addEventListener('DOMContentLoaded', function() {
     let lastHistoryText = historyTextarea.value;
     let newlineCounter = 0;  // Count of new lines added since last update
     let lastLineCount = historyTextarea.value.split('\n').length;
+    let activeRequest = null;  // AbortController for the in-flight update, if any
+    
+    // Outputs of the model tabs that answer updates (refine tabs are filled in later by the server),
+    // and each one's last answer, to put back if an update is superseded before replacing it
+    const interactiveOutputs = ['.questions-output', '.investigations-output', '.problems-output']
+        .map(outputClass => `.tab-pane:not([data-tier="refine"]) ${outputClass}`)
+        .join(', ');
+    const processingText = "Processing...";
+    const answeredOutputs = new Map();
     
     // Update the LLM output based on history text
     async function updateLLMOutput() {
@@ -38,63 +57,181 @@ document.addEventListener('DOMContentLoaded', function() {
         lastLineCount = historyText.split('\n').length;
         newlineCounter = 0;  // Reset the counter after update
         
+        // A refinement of the older history is called off on the server
+        document.querySelectorAll('.refine-status').forEach(el => {
+            el.textContent = '';
+        });
+        
+        // Abort any update still in flight; its results would be stale
+        if (activeRequest) {
+            activeRequest.abort();
+        }
+        const controller = new AbortController();
+        activeRequest = controller;
+        
         try {
-            // Show loading state in all model tabs
-            document.querySelectorAll('.questions-output').forEach(el => {
-                el.textContent = "Processing...";
-            });
-            document.querySelectorAll('.investigations-output').forEach(el => {
-                el.textContent = "Processing...";
+            // Show loading state in the model tabs that answer updates; refine tabs keep their last answer
+            document.querySelectorAll(interactiveOutputs).forEach(el => {
+                if (el.textContent !== processingText) {
+                    answeredOutputs.set(el, el.textContent);
+                }
+                el.textContent = processingText;
             });
-            document.querySelectorAll('.problems-output').forEach(el => {
-                el.textContent = "Processing...";
+            document.querySelectorAll('.tab-pane:not([data-tier="refine"]) .model-error').forEach(el => {
+                showModelError(el, null);
             });
             
-            const response = await fetch('/update_history', {
+            const response = await fetch('/update_history/stream', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json'
                 },
-                body: JSON.stringify({ history: historyText })
+                body: JSON.stringify({ history: historyText, encounter_id: encounterId }),
+                signal: controller.signal
             });
             
-            const data = await response.json();
-            
-            if (data.success) {
-                // Update each model's output in its tab
-                if (data.data.model_results && data.data.model_results.length > 0) {
-                    data.data.model_results.forEach(model => {
-                        // Find the outputs for this model
-                        const questionsOutput = document.querySelector(`.questions-output[data-model-id="${model.id}"]`);
-                        const investigationsOutput = document.querySelector(`.investigations-output[data-model-id="${model.id}"]`);
-                        const problemsOutput = document.querySelector(`.problems-output[data-model-id="${model.id}"]`);
-                        
-                        // Update outputs if elements exist
-                        if (questionsOutput && model.recommended_questions) {
-                            questionsOutput.textContent = model.recommended_questions;
-                        }
-                        
-                        if (investigationsOutput && model.recommended_investigations) {
-                            investigationsOutput.textContent = model.recommended_investigations;
-                        }
-                        
-                        if (problemsOutput && model.problem_list) {
-                            problemsOutput.textContent = model.problem_list;
-                        }
-                    });
+            // Each line of the response is one JSON event; render each field and each
+            // model's tab as soon as it arrives
+            await readEventStream(response, event => {
+                if (event.type === 'field') {
+                    renderModelField(event.model_id, event.field, event.value);
+                } else if (event.type === 'model_result') {
+                    // Only show results that answer this text (or text it has grown into since)
+                    if (event.history === undefined || event.history.startsWith(historyText)) {
+                        renderModelResult(event.data, event.error);
+                    }
+                } else if (event.type === 'busy') {
+                    showOutputMessage(event.error);
+                } else if (event.type === 'superseded') {
+                    // A newer update took over and will fill in the outputs; don't leave them saying "Processing..."
+                    restoreAnsweredOutputs();
                 }
-            }
+            });
         } catch (error) {
+            // A newer update replaced this one, which will fill in the outputs
+            if (error.name === 'AbortError') {
+                return;
+            }
+            
             console.error('Error updating LLM output:', error);
-            document.querySelectorAll('.questions-output').forEach(el => {
-                el.textContent = "Error processing request.";
-            });
-            document.querySelectorAll('.investigations-output').forEach(el => {
-                el.textContent = "Error processing request.";
-            });
-            document.querySelectorAll('.problems-output').forEach(el => {
-                el.textContent = "Error processing request.";
-            });
+            showOutputMessage("Error processing request.");
+        } finally {
+            if (activeRequest === controller) {
+                activeRequest = null;
+            }
+        }
+    }
+    
+    // Show a message in the outputs of the model tabs that answer updates
+    function showOutputMessage(message) {
+        document.querySelectorAll(interactiveOutputs).forEach(el => {
+            el.textContent = message;
+        });
+    }
+    
+    // Put back the last answer in any update output still showing "Processing..."
+    function restoreAnsweredOutputs() {
+        document.querySelectorAll(interactiveOutputs).forEach(el => {
+            if (el.textContent === processingText) {
+                el.textContent = answeredOutputs.get(el) || '';
+            }
+        });
+    }
+    
+    // Output element class for each response field
+    const fieldOutputClasses = {
+        recommended_questions: 'questions-output',
+        recommended_investigations: 'investigations-output',
+        problem_list: 'problems-output'
+    };
+    
+    // Update a single field in a model's tab while the model is still generating
+    function renderModelField(modelId, field, value) {
+        const output = document.querySelector(`.${fieldOutputClasses[field]}[data-model-id="${modelId}"]`);
+        if (output && value) {
+            output.textContent = value;
+        }
+    }
+    
+    // Show (or with no error, hide) why a model's answer is incomplete
+    function showModelError(element, error) {
+        if (element) {
+            element.textContent = error || '';
+            element.classList.toggle('d-none', !error);
+        }
+    }
+    
+    // Update a model's tab with its results. A field left empty is shown as such, rather than
+    // leaving the tab's previous text (or "Processing...") in place; error says why, if the model failed
+    function renderModelResult(model, error) {
+        const emptyText = error ? '(could not be read from the response)' : '(none)';
+        Object.entries(fieldOutputClasses).forEach(([field, outputClass]) => {
+            const output = document.querySelector(`.${outputClass}[data-model-id="${model.id}"]`);
+            if (output) {
+                output.textContent = model[field] || emptyText;
+            }
+        });
+        
+        showModelError(document.querySelector(`.model-error[data-model-id="${model.id}"]`), error);
+    }
+    
+    // Show a refine model's progress next to its tab name
+    function setRefineStatus(modelId, text) {
+        const status = document.querySelector(`.refine-status[data-model-id="${modelId}"]`);
+        if (status) {
+            status.textContent = text;
+        }
+    }
+    
+    // A refined answer supersedes the fast one, so bring its tab forward if a fast model's tab is showing
+    function showRefinedTab(modelId) {
+        const activeTab = document.querySelector('#modelTabs .nav-link.active');
+        const refinedTab = document.getElementById(`model-tab-${modelId}`);
+        if (activeTab && refinedTab && activeTab.dataset.tier !== 'refine') {
+            bootstrap.Tab.getOrCreateInstance(refinedTab).show();
+        }
+    }
+    
+    // Refine-tier models run on the server once typing pauses; their results are pushed as server-sent events
+    if (document.querySelector('.tab-pane[data-tier="refine"]')) {
+        const refineEvents = new EventSource(`/update_history/events?encounter_id=${encodeURIComponent(encounterId)}`);
+        refineEvents.onmessage = message => {
+            const event = JSON.parse(message.data);
+            if (event.type === 'refining') {
+                event.model_ids.forEach(modelId => setRefineStatus(modelId, '(refining...)'));
+            } else if (event.type === 'model_result') {
+                renderModelResult(event.data, event.error);
+                setRefineStatus(event.data.id, event.error ? '(refine failed)' : '');
+                if (!event.error) {
+                    showRefinedTab(event.data.id);
+                }
+            } else if (event.type === 'refine_busy') {
+                event.model_ids.forEach(modelId => setRefineStatus(modelId, '(busy)'));
+            }
+        };
+    }
+    
+    // Read a newline-delimited JSON response, calling onEvent for each event as it arrives
+    async function readEventStream(response, onEvent) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) {
+                break;
+            }
+            
+            buffer += decoder.decode(value, { stream: true });
+            const lines = buffer.split('\n');
+            buffer = lines.pop();  // Keep any partial line for the next chunk
+            
+            lines.filter(line => line.trim()).forEach(line => onEvent(JSON.parse(line)));
+        }
+        
+        if (buffer.trim()) {
+            onEvent(JSON.parse(buffer));
         }
     }
     
@@ -255,6 +392,7 @@ document.addEventListener('DOMContentLoaded', function() {
             update_frequency: parseInt(updateFrequency.value) || 100,
             update_on_newline: updateOnNewline.checked,
             line_count_before_update: parseInt(lineCountBeforeUpdate.value) || 2,
+            min_update_interval_ms: parseInt(minUpdateInterval.value) || 0,
             inactivity_timer: parseInt(inactivityTimer.value) || 3
         };
         
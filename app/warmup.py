@@ -0,0 +1,98 @@
+from app.ollama_pool import normalize_model_name
+import threading
+import traceback
+
+def parse_keep_alive(value):
+    """
+    Ollama accepts keep_alive as a duration string ("30m") or a number of seconds
+    (-1 keeps the model loaded indefinitely)
+    """
+    if value is None or str(value).strip() == "":
+        return None
+    value = str(value).strip()
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+class WarmupManager:
+    """
+    Keeps Ollama models resident so requests don't pay for a cold model load.
+
+    Preloads models on every node they can be routed to, with the model's
+    keep_alive, and reports whether each model is currently loaded.
+    """
+    def __init__(self, client, default_keep_alive="30m"):
+        self.client = client
+        self.default_keep_alive = default_keep_alive
+        self.lock = threading.Lock()
+        self.warming = set()  # (base_url, model) pairs with a preload in progress
+
+    def keep_alive_for(self, keep_alive):
+        """A model's keep_alive setting, or the default if it has none"""
+        keep_alive = parse_keep_alive(keep_alive)
+        return keep_alive if keep_alive is not None else self.default_keep_alive
+
+    def warm(self, model_name, keep_alive=None, base_urls=None):
+        """
+        Load a model on each of its nodes. Blocks until the loads finish.
+        """
+        keep_alive = self.keep_alive_for(keep_alive)
+        for base_url in base_urls or self.client.base_urls:
+            key = (base_url, model_name)
+            with self.lock:
+                if key in self.warming:
+                    continue
+                self.warming.add(key)
+            try:
+                self.client.preload(model_name, keep_alive=keep_alive, base_url=base_url)
+            except Exception as e:
+                print(f"Failed to warm {model_name} on {base_url}: {str(e)}")
+            finally:
+                with self.lock:
+                    self.warming.discard(key)
+
+    def warm_in_background(self, models):
+        """
+        Warm models without blocking the caller.
+        models is a list of (model_name, keep_alive, base_urls) tuples.
+        """
+        def run():
+            for model_name, keep_alive, base_urls in models:
+                try:
+                    self.warm(model_name, keep_alive, base_urls)
+                except Exception:
+                    traceback.print_exc()
+
+        thread = threading.Thread(target=run, name="ollama-warmup", daemon=True)
+        thread.start()
+        return thread
+
+    def status(self, models):
+        """
+        Whether each model is loaded, checking its nodes now.
+        models is a list of (model_name, base_urls) tuples.
+        """
+        nodes = {}
+        for _, base_urls in models:
+            for base_url in base_urls or self.client.base_urls:
+                if base_url not in nodes:
+                    node = self.client.pool.get_node(base_url)
+                    self.client.pool.check_health(node)
+                    nodes[base_url] = node
+
+        results = []
+        for model_name, base_urls in models:
+            warm_nodes = [
+                url for url in (base_urls or self.client.base_urls)
+                if normalize_model_name(model_name) in nodes[url].loaded_models
+            ]
+            with self.lock:
+                warming = any(model == model_name for _, model in self.warming)
+            results.append({
+                "model_name": model_name,
+                "warm": bool(warm_nodes),
+                "warm_nodes": warm_nodes,
+                "warming": warming
+            })
+        return results
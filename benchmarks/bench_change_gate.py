@@ -0,0 +1,211 @@
+"""
+Replay benchmark for the change-significance gate (app/change_gate.py).
+
+Simulates clinicians typing the corpus histories word by word, and sends an
+update whenever main.js would: on finishing a line, and after a pause in
+typing (the inactivity timer). Along the way they make typos, fixing some
+straight away and some only after a pause, and tidy up punctuation, spacing
+and capitals. Each update would call every active model; the gate decides
+which of those calls are actually made.
+
+Reports the LLM calls made without the gate and with it at several
+thresholds (LLM_CHANGE_MIN_WORDS), and how long a gate check takes.
+
+Also checks that edits between clinical terms one letter apart (dysphagia to
+dysphasia) always run the models, and fails if a configuration that is safe
+to use (the default, or typo fixes checked against a vocabulary) skips one.
+
+Usage:
+    python benchmarks/bench_change_gate.py [--sessions 50] [--models 2] [--seed 1]
+        [--pause-rate 0.12] [--typo-rate 0.06]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+from app.change_gate import ChangeGate, normalize_words
+
+DEFAULT_CORPUS = os.path.join(BENCHMARK_DIR, 'corpus', 'patient_histories.json')
+
+# Chance of pausing at the end of a line before pressing Enter, which sends the same words twice
+LINE_END_PAUSE_RATE = 0.4
+# Chance of a typo being noticed and fixed before the next update is sent
+IMMEDIATE_FIX_RATE = 0.5
+# Chance of tidying a line's punctuation, spacing or capitals, then pausing
+TIDY_RATE = 0.25
+
+# Edits that look small but change the meaning: clinical terms one letter apart
+# (correcting one to the other is not a typo fix), and signs and qualifiers
+CLINICAL_NEAR_MISSES = [
+    (f"Presenting with {old} since this morning", f"Presenting with {new} since this morning")
+    for old, new in [
+        ("dysphagia", "dysphasia"),
+        ("abduction", "adduction"),
+        ("ileum", "ilium"),
+        ("perineal", "peroneal"),
+        ("dysphasia", "dysphagia"),
+        ("adduction", "abduction"),
+    ]
+] + [
+    ("Troponin +ve", "Troponin -ve"),
+    ("HIV +", "HIV -"),
+    ("Na 135", "Na <135"),
+    ("CRP 10", "CRP >10"),
+    ("Impression: PE", "Impression: ?PE"),
+]
+
+def make_typo(word, rng):
+    """Swap two neighbouring letters, or drop one"""
+    index = rng.randrange(1, len(word) - 1)
+    if rng.random() < 0.5:
+        return word[:index] + word[index + 1] + word[index] + word[index + 2:]
+    return word[:index] + word[index + 1:]
+
+def tidy(line, rng):
+    """A formatting-only edit to a line"""
+    choice = rng.randrange(4)
+    if choice == 0:
+        return line[:-1] if line.endswith('.') else line + '.'
+    if choice == 1:
+        return line.replace(' ', '  ', 1)
+    if choice == 2:
+        return line + ' '
+    return line[:1].swapcase() + line[1:]
+
+def replay_session(case, rng, pause_rate, typo_rate):
+    """The texts one clinician's typing of a case would send, in order"""
+    done = []
+    sent = []
+
+    def text(words):
+        return '\n'.join(done + [' '.join(words)])
+
+    for line in case['lines']:
+        words = []
+        typo = None  # (index, correct word) of a typo not yet fixed
+        for word in line.split(' '):
+            if rng.random() < typo_rate and len(word) >= 3 and word.isalpha():
+                if rng.random() >= IMMEDIATE_FIX_RATE and typo is None:
+                    typo = (len(words), word)
+                    word = make_typo(word, rng)
+            words.append(word)
+
+            if rng.random() < pause_rate:
+                sent.append(text(words))
+                if typo is not None:
+                    # Spotted it while pausing: fix it, then pause again
+                    words[typo[0]] = typo[1]
+                    typo = None
+                    sent.append(text(words))
+
+        if typo is not None:
+            words[typo[0]] = typo[1]
+        line = ' '.join(words)
+        if rng.random() < TIDY_RATE:
+            if rng.random() < LINE_END_PAUSE_RATE:
+                sent.append('\n'.join(done + [line]))
+            line = tidy(line, rng)
+            sent.append('\n'.join(done + [line]))
+        elif rng.random() < LINE_END_PAUSE_RATE:
+            sent.append('\n'.join(done + [line]))
+
+        # Enter on a line with content triggers an update
+        done.append(line)
+        sent.append('\n'.join(done) + '\n')
+    return sent
+
+def corpus_vocabulary(cases):
+    """The corpus's own words plus the near-miss terms, standing in for a medical word list"""
+    vocabulary = set()
+    for case in cases:
+        vocabulary.update(normalize_words('\n'.join(case['lines'])))
+    for old, new in CLINICAL_NEAR_MISSES:
+        vocabulary.update(normalize_words(old) + normalize_words(new))
+    return vocabulary
+
+def skipped_near_misses(min_words, ignore_typos, vocabulary=None):
+    """The near-miss edits the gate would wrongly skip"""
+    gate = ChangeGate(min_words=min_words, ignore_typos=ignore_typos, vocabulary=vocabulary)
+    context = ('models',)
+    skipped = []
+    for session_id, (old, new) in enumerate(CLINICAL_NEAR_MISSES):
+        gate.record(session_id, old, context)
+        if not gate.check(session_id, new, context).significant:
+            skipped.append(f"{old!r}->{new!r}")
+    return skipped
+
+def run_gate(sessions, min_words, ignore_typos=False, vocabulary=None):
+    """Updates the gate lets through, and the total time spent in check()"""
+    gate = ChangeGate(min_words=min_words, ignore_typos=ignore_typos, vocabulary=vocabulary)
+    context = ('models',)
+    run = 0
+    check_seconds = 0
+    checks = 0
+    for session_id, texts in enumerate(sessions):
+        for text in texts:
+            start = time.perf_counter()
+            decision = gate.check(session_id, text, context)
+            check_seconds += time.perf_counter() - start
+            checks += 1
+            if decision.significant:
+                run += 1
+                gate.record(session_id, text, context)
+    return run, check_seconds / max(checks, 1)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS)
+    parser.add_argument('--sessions', type=int, default=50, help='Typing sessions to replay per case')
+    parser.add_argument('--models', type=int, default=2, help='Active models, i.e. LLM calls per update')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--pause-rate', type=float, default=0.12, help='Chance of pausing after each word')
+    parser.add_argument('--typo-rate', type=float, default=0.06, help='Chance of a typo in each word')
+    args = parser.parse_args()
+
+    with open(args.corpus) as corpus_file:
+        cases = json.load(corpus_file)
+    rng = random.Random(args.seed)
+    sessions = [
+        replay_session(case, rng, args.pause_rate, args.typo_rate)
+        for case in cases for _ in range(args.sessions)
+    ]
+    updates = sum(len(texts) for texts in sessions)
+    print(f"{len(sessions)} typing sessions, {updates} updates, {args.models} models\n")
+
+    vocabulary = corpus_vocabulary(cases)
+    print(f"{'gate':<38} {'updates run':>11} {'LLM calls':>10} {'saved':>7} {'check us':>9}  near misses skipped")
+    print(f"{'off':<38} {updates:>11} {updates * args.models:>10} {'':>7} {'':>9}")
+    # (name, min words, ignore typos, vocabulary, safe to use)
+    configurations = [
+        ("punctuation/whitespace only (default)", 1, False, None, True),
+        ("min words 1, typos, vocabulary", 1, True, vocabulary, True),
+        ("min words 1, typos, no vocabulary", 1, True, None, False),
+        ("min words 2, ignore typos", 2, True, None, False),
+        ("min words 3, ignore typos", 3, True, None, False),
+    ]
+    unsafe = []
+    for name, min_words, ignore_typos, config_vocabulary, safe in configurations:
+        run, check_seconds = run_gate(sessions, min_words, ignore_typos, config_vocabulary)
+        saved = 1 - run / updates
+        skipped = skipped_near_misses(min_words, ignore_typos, config_vocabulary)
+        print(
+            f"{name:<38} {run:>11} {run * args.models:>10} {saved:>7.1%} {check_seconds * 1e6:>9.1f}  "
+            f"{len(skipped)}/{len(CLINICAL_NEAR_MISSES)}"
+        )
+        if safe and skipped:
+            unsafe.append(f"{name}: {', '.join(skipped)}")
+
+    if unsafe:
+        print("\nFAILED: clinically different edits were skipped by")
+        for line in unsafe:
+            print(f"  {line}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""
+Microbenchmark and fuzz test for the LLM response parser (app/response_parser.py).
+
+The benchmark times parse_llm_response on each response in the corpus
+(well-formed, fenced, truncated, partly invalid...) against a bare json.loads,
+and shows which fields each one recovers.
+
+The fuzz test mutates the corpus at random (truncation, dropped, inserted
+and duplicated characters, wrapping text) and checks that the parser never
+raises, that every recovered field is a string, and that well-formed input
+parses exactly as json.loads would.
+
+Usage:
+    python benchmarks/bench_response_parser.py [--iterations 2000] [--fuzz 20000] [--seed 1]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+from app.response_parser import RESPONSE_FIELDS, normalize_field, parse_llm_response
+
+DEFAULT_CORPUS = os.path.join(BENCHMARK_DIR, 'corpus', 'llm_responses.json')
+
+WRAPPERS = [
+    ('```json\n', '\n```'),
+    ('Here are my recommendations:\n', ''),
+    ('', '\nI hope this helps.'),
+    ('', '}'),
+    ('', ',')
+]
+NOISE = '{}[]",:\\ \n\'abc0'
+
+def time_call(function, text, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function(text)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+def json_loads_or_none(text):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return None
+
+def run_benchmark(cases, iterations):
+    print(f"{'case':<26} {'parse us':>9} {'json us':>8}  fields  note")
+    for case in cases:
+        text = case['text']
+        parse_us = time_call(parse_llm_response, text, iterations)
+        loads_us = time_call(json_loads_or_none, text, iterations)
+        parsed = parse_llm_response(text)
+        note = parsed.error_message() or ('repaired' if parsed.repaired else '')
+        print(f"{case['name']:<26} {parse_us:>9.1f} {loads_us:>8.1f}  {len(parsed.fields)}/{len(RESPONSE_FIELDS)}     {note[:70]}")
+
+def mutate(text, rng):
+    kind = rng.randrange(6)
+    if not text:
+        return rng.choice(NOISE)
+    position = rng.randrange(len(text) + 1)
+    if kind == 0:
+        return text[:position]
+    if kind == 1:
+        return text[:position] + text[position + 1:]
+    if kind == 2:
+        return text[:position] + rng.choice(NOISE) + text[position:]
+    if kind == 3:
+        end = min(len(text), position + rng.randrange(1, 20))
+        return text[:end] + text[position:]
+    if kind == 4:
+        prefix, suffix = rng.choice(WRAPPERS)
+        return prefix + text + suffix
+    return text[:position] + text[position:][::-1][:rng.randrange(1, 10)]
+
+def expected_fields(text):
+    """The fields a well-formed response must parse to, or None if the text isn't a well-formed response"""
+    value = json_loads_or_none(text)
+    if not isinstance(value, dict):
+        return None
+    if len(value) == 1 and not any(name in value for name in RESPONSE_FIELDS):
+        # A response wrapped in an outer object is read from the inner one
+        inner = next(iter(value.values()))
+        value = inner if isinstance(inner, dict) else value
+    fields = {}
+    for name in RESPONSE_FIELDS:
+        if name in value:
+            display_value = normalize_field(name, value[name])
+            if display_value is not None:
+                fields[name] = display_value
+    return fields
+
+def run_fuzz(cases, count, seed):
+    rng = random.Random(seed)
+    outcomes = {'complete': 0, 'partial': 0, 'none': 0}
+    failures = 0
+    start = time.perf_counter()
+
+    for _ in range(count):
+        text = rng.choice(cases)['text']
+        for _ in range(rng.randrange(1, 4)):
+            text = mutate(text, rng)
+
+        try:
+            parsed = parse_llm_response(text)
+        except Exception as e:
+            failures += 1
+            print(f"Parser raised {e!r} on {text!r}")
+            continue
+
+        problems = [name for name, value in parsed.fields.items() if not isinstance(value, str)]
+        expected = expected_fields(text)
+        if expected is not None and expected != parsed.fields:
+            problems.append('differs from json.loads')
+        if problems:
+            failures += 1
+            print(f"{', '.join(problems)}: {text!r}")
+            continue
+
+        if parsed.complete:
+            outcomes['complete'] += 1
+        elif parsed.fields:
+            outcomes['partial'] += 1
+        else:
+            outcomes['none'] += 1
+
+    elapsed = time.perf_counter() - start
+    print(f"\nFuzzed {count} mutated responses in {elapsed:.2f}s ({elapsed / max(count, 1) * 1e6:.0f} us each)")
+    print(f"All fields recovered: {outcomes['complete']}, some: {outcomes['partial']}, none: {outcomes['none']}")
+    print(f"Failures: {failures}")
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS)
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--fuzz', type=int, default=20000, help='number of mutated responses (0 to skip)')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    with open(args.corpus) as f:
+        cases = json.load(f)
+
+    run_benchmark(cases, args.iterations)
+    if args.fuzz and run_fuzz(cases, args.fuzz, args.seed):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
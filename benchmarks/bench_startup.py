@@ -0,0 +1,98 @@
+"""
+Cold-start benchmark: how long a fresh worker process takes to import the app
+and run create_app, as gunicorn does for every worker it starts.
+
+Each sample runs in a new Python process against a temporary SQLite database,
+with and without DB_INIT_ON_STARTUP (creating, upgrading and seeding the
+database on every start, instead of once with `flask init-db`). The database
+is first created the way a deploy would, with `flask init-db` and
+DB_INIT_ON_STARTUP=false. Model warmup stays on, pointed at a closed port,
+so its startup query is included. It also checks that the openai package is
+no longer imported until an OpenAI model is used, and that starting a worker
+with DB_INIT_ON_STARTUP=false never writes to the database.
+
+Usage:
+    python benchmarks/bench_startup.py [--runs 10]
+"""
+import argparse
+import hashlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+
+# Runs in the child process; prints its timings as JSON
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {repo!r})
+from app import create_app
+imported = time.perf_counter()
+app = create_app()
+created = time.perf_counter()
+print(json.dumps({{
+    "import_ms": (imported - start) * 1000,
+    "create_app_ms": (created - imported) * 1000,
+    "openai_imported": "openai" in sys.modules
+}}))
+"""
+
+def start_worker(env):
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD.format(repo=REPO_DIR)],
+        env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def init_db(env):
+    """Create and seed the database as the per-deploy step does"""
+    subprocess.run(
+        [sys.executable, "-m", "flask", "--app", "run", "init-db"],
+        env=dict(env, DB_INIT_ON_STARTUP="false"), cwd=REPO_DIR, capture_output=True, text=True, check=True
+    )
+
+def file_digest(path):
+    with open(path, "rb") as database_file:
+        return hashlib.sha256(database_file.read()).hexdigest()
+
+def report(name, samples):
+    import_ms = [sample["import_ms"] for sample in samples]
+    create_ms = [sample["create_app_ms"] for sample in samples]
+    total_ms = [a + b for a, b in zip(import_ms, create_ms)]
+    openai = "yes" if any(sample["openai_imported"] for sample in samples) else "no"
+    print(f"{name:<24} {statistics.median(import_ms):>10.0f} {statistics.median(create_ms):>13.0f} "
+          f"{statistics.median(total_ms):>9.0f} {max(total_ms):>7.0f}   {openai}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10, help='Worker starts to time per configuration')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        database_path = os.path.join(directory, 'bench.db')
+        env = dict(
+            os.environ,
+            DATABASE_URL=f"sqlite:///{database_path}",
+            OLLAMA_BASE_URLS="http://127.0.0.1:1",
+            PYTHONDONTWRITEBYTECODE="1"
+        )
+        init_db(env)
+
+        # Workers that don't initialise the database must leave it as it is
+        before = file_digest(database_path)
+        start_worker(dict(env, DB_INIT_ON_STARTUP="false"))
+        if file_digest(database_path) != before:
+            sys.exit("FAILED: a worker started with DB_INIT_ON_STARTUP=false wrote to the database")
+
+        print(f"{'configuration':<24} {'import ms':>10} {'create_app ms':>13} {'total ms':>9} {'max ms':>7}   openai imported")
+        for name, init_on_startup in (("init on startup", "true"), ("init-db once", "false")):
+            samples = [start_worker(dict(env, DB_INIT_ON_STARTUP=init_on_startup)) for _ in range(args.runs)]
+            report(name, samples)
+
+if __name__ == '__main__':
+    main()
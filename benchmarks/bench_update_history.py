@@ -0,0 +1,215 @@
+"""
+Throughput and latency benchmark for /update_history.
+
+Replays a corpus of patient histories the way a clinician types them: each
+virtual clinician takes a case and sends the history one line longer at a
+time, waiting for each response. --concurrency clinicians run at once.
+
+By default the app runs in-process on a fresh database, with the LLM backends
+replaced by benchmarks/mock_llm_server.py, so no GPU or API key is needed.
+Database writes are timed per stage (query logs, model results, medical
+records, result cache). --url benchmarks a running deployment instead, which
+reports latency only.
+
+Usage:
+    python benchmarks/bench_update_history.py [--concurrency 8] [--passes 2]
+        [--latency-ms 200] [--tokens-per-second 50] [--failure-rate 0]
+        [--malformed-rate 0] [--stream] [--cache] [--url http://host:5000]
+"""
+import argparse
+import json
+import math
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+sys.path.insert(0, BENCHMARK_DIR)
+
+from mock_llm_server import MockLLMSettings, start_mock_server
+
+DEFAULT_CORPUS = os.path.join(BENCHMARK_DIR, 'corpus', 'patient_histories.json')
+
+# Tables written while handling an update, and the stage each belongs to
+WRITE_STAGES = {
+    'query_log': 'query logs',
+    'model_result': 'model results',
+    'medical_record': 'medical record',
+    'cached_result': 'result cache'
+}
+WRITE_STATEMENT = re.compile(r'^\s*(?:INSERT\s+INTO|UPDATE|DELETE\s+FROM)\s+"?(\w+)"?', re.IGNORECASE)
+
+def percentile(values, percent):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(percent / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+class DBWriteTimer:
+    """
+    Times every INSERT, UPDATE and DELETE the engine runs, grouped by stage
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timings = {}
+
+    def attach(self, engine):
+        from sqlalchemy import event
+
+        @event.listens_for(engine, 'before_cursor_execute')
+        def before_execute(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault('bench_start', []).append(time.perf_counter())
+
+        @event.listens_for(engine, 'after_cursor_execute')
+        def after_execute(conn, cursor, statement, parameters, context, executemany):
+            elapsed_ms = (time.perf_counter() - conn.info['bench_start'].pop()) * 1000
+            match = WRITE_STATEMENT.match(statement)
+            if match:
+                stage = WRITE_STAGES.get(match.group(1).lower(), match.group(1))
+                with self.lock:
+                    self.timings.setdefault(stage, []).append(elapsed_ms)
+
+class Results:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies_ms = []
+        self.errors = 0
+        self.superseded = 0
+
+    def record(self, latency_ms, ok, superseded=False):
+        with self.lock:
+            self.latencies_ms.append(latency_ms)
+            if superseded:
+                self.superseded += 1
+            elif not ok:
+                self.errors += 1
+
+def load_corpus(path):
+    with open(path) as corpus_file:
+        return json.load(corpus_file)
+
+def post_update(client, path, history, stream, external):
+    """Send one update and return (ok, superseded)"""
+    if external:
+        response = client.post(path, json={'history': history}, stream=stream)
+        status = response.status_code
+        body = response.text
+    else:
+        response = client.post(path, json={'history': history})
+        status = response.status_code
+        body = response.get_data(as_text=True)
+
+    if status != 200:
+        return False, False
+    # The streamed response ends with a 'done' or 'superseded' event
+    last = json.loads(body.strip().split('\n')[-1])
+    return bool(last.get('success')), bool(last.get('superseded'))
+
+def run_clinician(make_client, path, cases, stream, external, results):
+    for case in cases:
+        # A fresh client per case, so each case is its own session
+        client = make_client()
+        for line_count in range(1, len(case['lines']) + 1):
+            history = '\n'.join(case['lines'][:line_count])
+            start = time.perf_counter()
+            try:
+                ok, superseded = post_update(client, path, history, stream, external)
+            except Exception as e:
+                print(f"Request failed: {str(e)}", file=sys.stderr)
+                ok, superseded = False, False
+            results.record((time.perf_counter() - start) * 1000, ok, superseded)
+
+def configure_environment(database_path, mock_url, cache):
+    os.environ['DATABASE_URL'] = f'sqlite:///{database_path}'
+    os.environ['OLLAMA_BASE_URLS'] = mock_url
+    os.environ['OPENAI_BASE_URL'] = f'{mock_url}/v1'
+    os.environ['OLLAMA_WARMUP_ON_STARTUP'] = 'false'
+    if not cache:
+        os.environ['LLM_CACHE_BACKEND'] = 'none'
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, default=8, help='clinicians typing at once')
+    parser.add_argument('--passes', type=int, default=2, help='times each clinician replays the corpus')
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS)
+    parser.add_argument('--latency-ms', type=float, default=200, help='mock time to first token')
+    parser.add_argument('--tokens-per-second', type=float, default=50, help='mock generation rate (0 = instant)')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='share of mock LLM calls that return HTTP 500')
+    parser.add_argument('--malformed-rate', type=float, default=0.0, help='share of mock LLM responses with truncated JSON')
+    parser.add_argument('--stream', action='store_true', help='use /update_history/stream')
+    parser.add_argument('--cache', action='store_true', help='leave the response cache on (off by default so every call reaches the LLM)')
+    parser.add_argument('--url', help='benchmark a running app instead of an in-process one')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    path = '/update_history/stream' if args.stream else '/update_history'
+    external = bool(args.url)
+    db_timer = None
+    app = None
+    settings = None
+
+    if external:
+        import requests
+        make_client = requests.Session
+        path = args.url.rstrip('/') + path
+    else:
+        settings = MockLLMSettings(args.latency_ms, args.tokens_per_second, args.failure_rate, args.malformed_rate, args.seed)
+        server, _ = start_mock_server(0, settings)
+        database_path = os.path.join(tempfile.mkdtemp(prefix='bench_update_history_'), 'medical_app.db')
+        configure_environment(database_path, f'http://127.0.0.1:{server.server_port}', args.cache)
+
+        from app import create_app, db
+        app = create_app()
+        with app.app_context():
+            db_timer = DBWriteTimer()
+            db_timer.attach(db.engine)
+        make_client = app.test_client
+
+    results = Results()
+    workers = [
+        threading.Thread(target=run_clinician, args=(make_client, path, corpus * args.passes, args.stream, external, results))
+        for _ in range(args.concurrency)
+    ]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    if app is not None:
+        from app.log_writer import get_query_log_writer
+        with app.app_context():
+            writer = get_query_log_writer()
+            if writer is not None:
+                writer.flush()
+
+    latencies = results.latencies_ms
+    print(f"Endpoint:     {path}")
+    print(f"Concurrency:  {args.concurrency} clinicians x {args.passes} passes over {len(corpus)} cases")
+    if not external:
+        print(f"Mock LLM:     {args.latency_ms:.0f}ms to first token, {args.tokens_per_second:g} tokens/s, "
+              f"{args.failure_rate:.0%} failures, {args.malformed_rate:.0%} malformed")
+        # The app falls back to mock results when an LLM call fails, so these don't show up as request errors
+        print(f"LLM calls:    {settings.requests}, failures injected: {settings.failures}")
+    print(f"Requests:     {len(latencies)} in {elapsed:.2f}s ({len(latencies) / elapsed:.1f} requests/s)")
+    print(f"Errors:       {results.errors} requests, superseded: {results.superseded}")
+    print(f"Latency (ms): p50 {percentile(latencies, 50):.0f}  p95 {percentile(latencies, 95):.0f}  "
+          f"p99 {percentile(latencies, 99):.0f}  max {max(latencies, default=0):.0f}")
+
+    if db_timer is not None:
+        print("DB writes by stage (ms):")
+        print(f"  {'stage':<16}{'writes':>8}{'total':>10}{'mean':>8}{'p95':>8}{'p99':>8}")
+        for stage, timings in sorted(db_timer.timings.items()):
+            print(f"  {stage:<16}{len(timings):>8}{sum(timings):>10.1f}{sum(timings) / len(timings):>8.2f}"
+                  f"{percentile(timings, 95):>8.2f}{percentile(timings, 99):>8.2f}")
+
+if __name__ == '__main__':
+    main()
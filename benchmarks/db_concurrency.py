@@ -0,0 +1,128 @@
+"""
+Concurrency check for the database layer.
+
+Starts several worker processes against one fresh SQLite database, the way
+gunicorn workers share it, and has each fire many parallel /update_history calls.
+Reports any request that failed with "database is locked", and checks that every
+query log (one per active model per request) was written.
+
+The LLM backend points at a closed port, so each call falls back to the mock
+result straight away and the run is dominated by database writes.
+
+Usage:
+    python benchmarks/db_concurrency.py [--processes 4] [--threads 16] [--requests 10] [--no-wal]
+
+--no-wal runs with SQLite's default rollback journal for comparison.
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def configure_environment(database_path, wal):
+    os.environ['DATABASE_URL'] = f'sqlite:///{database_path}'
+    os.environ['SQLITE_WAL'] = 'true' if wal else 'false'
+    os.environ['OLLAMA_BASE_URLS'] = 'http://127.0.0.1:9'
+    os.environ['OLLAMA_WARMUP_ON_STARTUP'] = 'false'
+    os.environ['LLM_MAX_RETRIES'] = '0'
+    # Every call must reach the database rather than being answered from the cache
+    os.environ['LLM_CACHE_BACKEND'] = 'none'
+
+def run_worker(database_path, wal, threads, requests_per_thread, results):
+    configure_environment(database_path, wal)
+    # The mock fallback prints a traceback for every call; keep the report readable
+    report = sys.stderr
+    sys.stdout = sys.stderr = open(os.devnull, 'w')
+    from app import create_app
+    from app.log_writer import get_query_log_writer
+
+    app = create_app()
+    app.testing = True  # Let errors propagate so they can be counted
+    counts = {'ok': 0, 'locked': 0, 'failed': 0}
+    lock = threading.Lock()
+
+    def client_thread(thread_index):
+        # One client per thread so each has its own session and none supersede another
+        client = app.test_client()
+        for request_index in range(requests_per_thread):
+            history = f"Patient {os.getpid()}-{thread_index} visit {request_index}: chest pain and shortness of breath"
+            try:
+                response = client.post('/update_history', json={'history': history})
+                outcome = 'ok' if response.status_code == 200 and response.get_json()['success'] else 'failed'
+            except Exception as e:
+                outcome = 'locked' if 'database is locked' in str(e) else 'failed'
+                if outcome == 'failed':
+                    print(f"Request failed: {str(e)}", file=report)
+            with lock:
+                counts[outcome] += 1
+
+    workers = [threading.Thread(target=client_thread, args=(i,)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    with app.app_context():
+        writer = get_query_log_writer()
+        if writer is not None:
+            writer.stop()
+    results.put(counts)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=10, help='requests per thread')
+    parser.add_argument('--no-wal', action='store_true')
+    args = parser.parse_args()
+    wal = not args.no_wal
+
+    database_path = os.path.join(tempfile.mkdtemp(prefix='db_concurrency_'), 'medical_app.db')
+    configure_environment(database_path, wal)
+
+    # Create and seed the database once, before the workers race to do it
+    from app import create_app, db
+    from app.models import QueryLog, ModelConfig
+    app = create_app()
+
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=run_worker, args=(database_path, wal, args.threads, args.requests, results))
+        for _ in range(args.processes)
+    ]
+    start = time.time()
+    for process in processes:
+        process.start()
+    totals = {'ok': 0, 'locked': 0, 'failed': 0}
+    for _ in processes:
+        for outcome, count in results.get().items():
+            totals[outcome] += count
+    for process in processes:
+        process.join()
+    elapsed = time.time() - start
+
+    with app.app_context():
+        logs_written = QueryLog.query.count()
+        active_models = ModelConfig.query.filter_by(is_active=True).count()
+        journal_mode = db.session.execute(db.text('PRAGMA journal_mode')).scalar()
+
+    expected = args.processes * args.threads * args.requests
+    print(f"Journal mode:          {journal_mode}")
+    print(f"Requests:              {expected} ({args.processes} processes x {args.threads} threads x {args.requests})")
+    print(f"Succeeded:             {totals['ok']}")
+    print(f"'database is locked':  {totals['locked']}")
+    print(f"Other failures:        {totals['failed']}")
+    print(f"Query logs written:    {logs_written} of {totals['ok'] * active_models}")
+    print(f"Elapsed:               {elapsed:.2f}s ({expected / elapsed:.1f} requests/s)")
+
+    passed = totals['locked'] == 0 and totals['failed'] == 0 and logs_written == totals['ok'] * active_models
+    print("PASS" if passed else "FAIL")
+    sys.exit(0 if passed else 1)
+
+if __name__ == '__main__':
+    main()
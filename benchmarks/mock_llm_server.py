@@ -0,0 +1,227 @@
+"""
+Stand-in Ollama and OpenAI HTTP server for benchmarks.
+
+Answers the endpoints the app uses with a canned JSON recommendation, at a
+configurable first-token latency and token rate, and can inject failures:
+
+    /api/generate, /api/tags, /api/ps        (Ollama)
+    /v1/chat/completions                     (OpenAI, streamed and not)
+
+Run standalone:
+    python benchmarks/mock_llm_server.py --port 11434 --latency-ms 200 --tokens-per-second 50 --failure-rate 0.05
+
+then point the app at it with OLLAMA_BASE_URLS=http://127.0.0.1:11434 and
+OPENAI_BASE_URL=http://127.0.0.1:11434/v1. Or start it in-process with
+start_mock_server().
+"""
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import argparse
+import json
+import random
+import re
+import threading
+import time
+
+RESPONSE_TEMPLATE = {
+    "recommended_questions": "- How long have the symptoms been present?\n- Any recent travel or sick contacts?\n- Any chest pain on exertion?\n- Examine chest, heart sounds and calves",
+    "recommended_investigations": "- Full Blood Count\n- Urea & Electrolytes\n- C-Reactive Protein\n- Chest X-ray",
+    "problem_list": "R50.9 - Fever, unspecified\nR05 - Cough\nR06.0 - Dyspnoea"
+}
+
+class MockLLMSettings:
+    """
+    Behaviour of the mock server; can be changed while it is running
+    """
+    def __init__(self, latency_ms=200, tokens_per_second=50, failure_rate=0.0, malformed_rate=0.0, seed=None):
+        self.latency_ms = latency_ms  # Time to first token
+        self.tokens_per_second = tokens_per_second  # 0 sends the whole response at once
+        self.failure_rate = failure_rate  # Share of requests answered with HTTP 500
+        self.malformed_rate = malformed_rate  # Share of responses that aren't valid JSON
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+
+    def roll(self, rate):
+        with self.lock:
+            return self.random.random() < rate
+
+def tokenize(text):
+    """Split text into roughly token-sized pieces (words and the whitespace before them)"""
+    return re.findall(r"\s*\S+", text) or [text]
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    settings = None
+    loaded_models = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._send_json({"models": [{"name": name, "model": name} for name in sorted(self.loaded_models)]})
+        elif self.path == "/api/ps":
+            self._send_json({"models": [{"name": name, "model": name} for name in sorted(self.loaded_models)]})
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            payload = {}
+
+        with self.settings.lock:
+            self.settings.requests += 1
+        if self.settings.roll(self.settings.failure_rate):
+            with self.settings.lock:
+                self.settings.failures += 1
+            self._send_json({"error": "injected failure"}, status=500)
+            return
+
+        if self.path == "/api/generate":
+            self._ollama_generate(payload)
+        elif self.path in ("/v1/chat/completions", "/chat/completions"):
+            self._openai_chat(payload)
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    def _response_text(self):
+        text = json.dumps(RESPONSE_TEMPLATE, indent=2)
+        if self.settings.roll(self.settings.malformed_rate):
+            # Cut off mid-object, as a model does when it runs out of tokens
+            text = text[:len(text) // 2]
+        return text
+
+    def _token_delay(self):
+        rate = self.settings.tokens_per_second
+        return 1 / rate if rate else 0
+
+    def _ollama_generate(self, payload):
+        model = payload.get("model", "")
+        name = model if ":" in model else f"{model}:latest"
+        self.loaded_models.add(name)
+
+        # A preload request has no prompt
+        if not payload.get("prompt"):
+            self._send_json({"model": model, "response": "", "done": True})
+            return
+
+        tokens = tokenize(self._response_text())
+        prompt_tokens = len(tokenize(payload.get("prompt", "")))
+        start = time.time()
+        time.sleep(self.settings.latency_ms / 1000)
+        final = {
+            "model": model,
+            "response": "",
+            "done": True,
+            "context": list(range(prompt_tokens + len(tokens))),
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_duration": int(self.settings.latency_ms * 1e6),
+            "eval_count": len(tokens)
+        }
+
+        if payload.get("stream", True):
+            self._start_chunked("application/x-ndjson")
+            for token in tokens:
+                time.sleep(self._token_delay())
+                self._write_chunk(json.dumps({"model": model, "response": token, "done": False}) + "\n")
+            final["eval_duration"] = int((time.time() - start) * 1e9) - final["prompt_eval_duration"]
+            final["total_duration"] = int((time.time() - start) * 1e9)
+            self._write_chunk(json.dumps(final) + "\n")
+            self._end_chunked()
+        else:
+            time.sleep(self._token_delay() * len(tokens))
+            final["response"] = "".join(tokens)
+            final["eval_duration"] = int((time.time() - start) * 1e9) - final["prompt_eval_duration"]
+            final["total_duration"] = int((time.time() - start) * 1e9)
+            self._send_json(final)
+
+    def _openai_chat(self, payload):
+        model = payload.get("model", "")
+        tokens = tokenize(self._response_text())
+        created = int(time.time())
+        time.sleep(self.settings.latency_ms / 1000)
+
+        if payload.get("stream"):
+            self._start_chunked("text/event-stream")
+            for token in tokens:
+                time.sleep(self._token_delay())
+                chunk = {
+                    "id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]
+                }
+                self._write_chunk(f"data: {json.dumps(chunk)}\n\n")
+            chunk = {
+                "id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]
+            }
+            self._write_chunk(f"data: {json.dumps(chunk)}\n\n")
+            self._write_chunk("data: [DONE]\n\n")
+            self._end_chunked()
+        else:
+            time.sleep(self._token_delay() * len(tokens))
+            self._send_json({
+                "id": "chatcmpl-mock", "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)}
+            })
+
+    def _send_json(self, body, status=200):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _start_chunked(self, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _write_chunk(self, text):
+        data = text.encode()
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _end_chunked(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+def start_mock_server(port=0, settings=None):
+    """
+    Start the mock server on a background thread.
+    Returns (server, settings); the server's URL is http://127.0.0.1:{server.server_port}.
+    """
+    settings = settings or MockLLMSettings()
+    handler = type("Handler", (MockLLMHandler,), {"settings": settings, "loaded_models": set()})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="mock-llm-server", daemon=True).start()
+    return server, settings
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument("--tokens-per-second", type=float, default=50)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    settings = MockLLMSettings(args.latency_ms, args.tokens_per_second, args.failure_rate, args.malformed_rate, args.seed)
+    server, _ = start_mock_server(args.port, settings)
+    print(f"Mock LLM server listening on http://127.0.0.1:{server.server_port}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()